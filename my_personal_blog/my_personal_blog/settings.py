@@ -10,12 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 TEMPLATE_DIR = BASE_DIR / "personal_app" / "templates"
-STATIC_DIR = BASE_DIR / "personal_app" / "static"
 
 
 # Quick-start development settings - unsuitable for production
@@ -43,13 +43,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'personal_app.middleware.RequestMetricsMiddleware',
+    'personal_app.nplusone.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'personal_app.replica.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'personal_app.middleware.AnonymousPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'my_personal_blog.urls'
@@ -79,10 +83,132 @@ WSGI_APPLICATION = 'my_personal_blog.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # "BLOG_DB_PATH" --> another database file, e.g. to try "import_blog" on an empty database.
+        'NAME': os.environ.get("BLOG_DB_PATH", BASE_DIR / 'db.sqlite3'),
+        # keep the connection open between the requests (seconds), instead of opening the file for every request.
+        'CONN_MAX_AGE': int(os.environ.get("BLOG_DB_CONN_MAX_AGE", 60)),
+        # a kept connection is checked before it is used again, a broken one is replaced.
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # seconds a query waits for a lock held by another process before "database is locked".
+            'timeout': 20,
+        },
     }
 }
 
+# Read replica:-
+# "BLOG_DB_REPLICA" is the path of a second SQLite file, a copy of the primary one kept up to date by
+# "python manage.py replicate_sqlite --interval 2" (a stand-in for real database replication).
+# The pages of "BLOG_REPLICA_VIEWS" read from it, everything else (and every write) uses "default".
+# After a write the browser gets a signed cookie which keeps its reads on "default" for "BLOG_REPLICA_PIN_SECONDS",
+# so the writer sees its own change even if the replica is behind ("personal_app/replica.py").
+BLOG_DB_REPLICA = os.environ.get("BLOG_DB_REPLICA")
+if BLOG_DB_REPLICA:
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=BLOG_DB_REPLICA, TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['personal_app.replica.ReadReplicaRouter']
+BLOG_READ_REPLICA = bool(BLOG_DB_REPLICA)
+BLOG_REPLICA_VIEWS = [
+    "personal_app:post_list", "personal_app:post_detail", "personal_app:draft_list", "personal_app:comment_list",
+    "personal_app:search", "personal_app:post_feed", "personal_app:author_feed", "personal_app:api_post_list",
+    "personal_app:api_post_detail", "personal_app:api_comment_list", "personal_app:archive_index",
+    "personal_app:archive_month", "personal_app:archive_author",
+]
+BLOG_REPLICA_PIN_SECONDS = 10
+
+# PRAGMAs run on every new SQLite connection ("personal_app/database.py"):-
+# "journal_mode=wal" --> the readers do not wait for the writer and the writer does not wait for the readers.
+# "synchronous=normal" --> with WAL, a commit does not wait for the disk (a power cut may lose the last commits,
+#                          but the database never gets corrupted).
+# "busy_timeout" --> milliseconds to wait for a lock. "cache_size" --> negative means KiB of page cache per connection.
+# "mmap_size" --> bytes of the file read through memory mapping. "temp_store=memory" --> sorts/temp tables in memory.
+BLOG_SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("BLOG_SQLITE_JOURNAL_MODE", "wal"),
+    "synchronous": os.environ.get("BLOG_SQLITE_SYNCHRONOUS", "normal"),
+    "busy_timeout": 20000,
+    "cache_size": -20000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# "locmem" keeps the cache inside every worker process (good for a single process / development).
+# "file" keeps it in files under "BLOG_CACHE_DIR", so that all the worker processes (gunicorn/uwsgi) share it.
+BLOG_CACHE_BACKEND = os.environ.get("BLOG_CACHE_BACKEND", "locmem")
+BLOG_CACHE_DIR = Path(os.environ.get("BLOG_CACHE_DIR", BASE_DIR / "cache"))
+
+# "default" --> everything else, "fragments" --> rendered parts of the post detail page ("personal_app/fragments.py"),
+# "pages" --> whole pages for the anonymous readers ("personal_app/middleware.py"),
+# "sessions" --> the sessions and the logged in users ("personal_app/auth.py").
+BLOG_CACHE_ALIASES = ["default", "fragments", "pages", "sessions"]
+
+if BLOG_CACHE_BACKEND == "file":
+    CACHES = {
+        alias: {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": BLOG_CACHE_DIR / alias}
+        for alias in BLOG_CACHE_ALIASES
+    }
+else:
+    CACHES = {
+        alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": alias}
+        for alias in BLOG_CACHE_ALIASES
+    }
+
+# With the shared "file" cache, the sessions are read from the "sessions" cache and written to it and to the database
+# ("cached_db"): a cache miss (a restart) reads the database, nothing is lost. With "locmem" every worker process
+# would keep its own copy of a session, still valid there after a logout in another worker, so they use the database.
+if BLOG_CACHE_BACKEND == "file":
+    SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+else:
+    SESSION_ENGINE = "django.contrib.sessions.backends.db"
+SESSION_CACHE_ALIAS = "sessions"
+
+# the logged in user of a session is also read from the "sessions" cache (only when it is shared, see "auth.py"), for
+# "AUTH_USER_CACHE_TIMEOUT" seconds at most; it is dropped when the user is saved (e.g. a new password) or deleted,
+# and at logout. It is the only backend: a second "ModelBackend" would check every wrong password a second time
+# (the sessions opened with "ModelBackend" before have to log in again).
+AUTHENTICATION_BACKENDS = ["personal_app.auth.CachedModelBackend"]
+AUTH_USER_CACHE_TIMEOUT = 60 * 5
+
+# how long (seconds) a rendered fragment is kept; fragments are also thrown away whenever their post/comments change.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# pages (url names) which are cached as a whole for the anonymous readers, and for how long (seconds) at most.
+# They are also purged whenever a published post or an approved comment changes.
+ANONYMOUS_CACHE_VIEWS = ["personal_app:post_list", "personal_app:about", "personal_app:archive_index",
+                         "personal_app:archive_month", "personal_app:archive_author"]
+PAGE_CACHE_TIMEOUT = 60 * 5
+# the "site state" (the stamp of the page cache keys and of the ETags) is made again after this many seconds at most,
+# and when a post with a future "published_date" becomes visible. The page cache and the ETags of the pages, feeds
+# and api need a shared cache ("BLOG_CACHE_BACKEND=file"): with "locmem" they are turned off.
+PAGE_STATE_TIMEOUT = 60 * 60
+
+# "1" --> every request is measured (time, queries, template, size) by "RequestMetricsMiddleware", see the
+# "Server-Timing" response header and the "request_metrics" page. "0" --> the middleware is not used at all.
+BLOG_REQUEST_METRICS = os.environ.get("BLOG_REQUEST_METRICS", "1") == "1"
+
+# N+1 query detector ("personal_app/nplusone.py"): "log" --> a warning, "raise" --> an error, when the same query
+# is run "BLOG_NPLUSONE_THRESHOLD" times in one request. "off" --> the middleware is not used at all.
+BLOG_NPLUSONE = os.environ.get("BLOG_NPLUSONE", "log" if DEBUG else "off")
+BLOG_NPLUSONE_THRESHOLD = 5
+
+# "1" --> the read-only pages are served by the async views ("personal_app/async_views.py").
+# "asgi.py" turns it on, so the ASGI server runs them on its event loop instead of a thread pool.
+BLOG_ASYNC_VIEWS = os.environ.get("BLOG_ASYNC_VIEWS", "0") == "1"
+
+# background jobs ("personal_app/jobs.py"), run by "python manage.py run_jobs".
+# "1" --> run every job in the process right after the commit instead (no worker needed, e.g. in development).
+BLOG_JOBS_EAGER = os.environ.get("BLOG_JOBS_EAGER", "0") == "1"
+# seconds before the first retry of a failed job (doubled for every further attempt).
+BLOG_JOBS_RETRY_DELAY = 10
+# seconds a worker may run a job before the other workers consider it dead and pick the job up again.
+BLOG_JOBS_LEASE = 60 * 5
+
+# most milliseconds a new worker process may take to import "wsgi.py" and answer its first request ("cold start"),
+# checked by "python manage.py profile_startup --check" and by the tests.
+BLOG_COLD_START_BUDGET_MS = int(os.environ.get("BLOG_COLD_START_BUDGET_MS", 1500))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -118,11 +244,17 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
-# Either we can use "STATICFILES_DIRS = [STATIC_DIR]" (or) we can use "static_root" variable as shown below.
-# Idea is to give the path of the static files directory.
+# django finds the static files of the apps ("personal_app/static") by itself. "collectstatic" (run by the
+# "build_assets" command) copies them into STATIC_ROOT, a build output which is not in git, with hashed names and
+# gzip/brotli copies ("personal_app/storage.py"). They are served from there by "personal_app.assets.serve_static",
+# or by the web server in front of django.
 
 STATIC_URL = '/static/'
-STATIC_ROOT = STATIC_DIR
+STATIC_ROOT = BASE_DIR / "static"
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "personal_app.storage.BlogStaticFilesStorage"},
+}
 
 
 # after the domain name in the url, the below endpoint takes us to the login page. So it is called "login url".
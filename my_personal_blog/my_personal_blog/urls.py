@@ -13,11 +13,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.urls import include
 from django.contrib.auth import views as auth_views
 from personal_app import views
+from personal_app.assets import serve_static
 
 
 # Remember:- urls "127.0.0.1:8000" and "127.0.0.1:8000/" are same. This is the domain name.
@@ -31,7 +33,9 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("personal_app.urls")),
     path("user/login/", auth_views.LoginView.as_view(), name="user_login"),
-    path("user/logout/", auth_views.LogoutView.as_view(), name="user_logout")
+    path("user/logout/", auth_views.LogoutView.as_view(), name="user_logout"),
+    # the collected static files (STATIC_ROOT), see "personal_app/assets.py". "runserver" serves them itself.
+    re_path(r"^%s(?P<path>.+)$" % settings.STATIC_URL.lstrip("/"), serve_static, name="static"),
 ]
 
 
@@ -1,7 +1,9 @@
 from django.contrib import admin
-from personal_app.models import Post, Comment
+from personal_app.models import Post, Comment, DeadLetterJob, Job
 
 # Register your models here.
 
 admin.site.register(Post)
 admin.site.register(Comment)
+admin.site.register(Job)
+admin.site.register(DeadLetterJob)
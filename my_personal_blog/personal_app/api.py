@@ -0,0 +1,193 @@
+import hashlib
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag, urlencode
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_safe
+
+from personal_app.caching import is_shared_cache
+from personal_app.fragments import fragment_cache, post_version
+from personal_app.middleware import site_state, uses_site_state
+from personal_app.models import Comment, Post
+from personal_app.pagination import InvalidCursor, KeysetPaginator
+from personal_app.replica import reads_from_replica
+
+
+# Read-only JSON API, version 1 ("/api/v1/..."), for the mobile clients.
+# It shows the same public content as the html pages: published posts and approved comments.
+# - "?fields=id,title" --> only these fields are selected from the database (".values()"), the others are never read.
+# - the lists are paged with cursors ("?after=..."/"?before=..."), see "pagination.py".
+# - every answer has an ETag; a client sending it back in "If-None-Match" gets an empty "304 Not Modified".
+# - the json is written without spaces and gzipped when the client accepts it.
+
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# public name of a field --> the column (or the related column) it is read from.
+POST_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "body": "body",
+    "body_html": "body_html",
+    "author": "author__username",
+    "created_date": "created_date",
+    "published_date": "published_date",
+    "comment_count": "approved_comment_count",
+}
+POST_LIST_DEFAULT_FIELDS = ["id", "title", "author", "published_date", "comment_count"]
+
+COMMENT_FIELDS = {
+    "id": "id",
+    "author": "author",
+    "text": "text",
+    "text_html": "text_html",
+    "created_date": "created_date",
+}
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def _selected_fields(request, allowed, default):
+    requested = request.GET.get("fields")
+    if not requested:
+        return list(default)
+    names = [name.strip() for name in requested.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise InvalidFields("Unknown fields: %s. Allowed fields: %s." % (", ".join(unknown), ", ".join(allowed)))
+    return names
+
+
+def _page_size(request):
+    try:
+        return max(1, min(int(request.GET.get("limit", API_PAGE_SIZE)), API_MAX_PAGE_SIZE))
+    except ValueError:
+        return API_PAGE_SIZE
+
+
+# ".values()" with the columns of the selected fields, plus the columns the cursors are made of ("extra").
+def _values(queryset, allowed, names, extra=()):
+    columns = {allowed[name] for name in names} | set(extra)
+    return queryset.values(*columns)
+
+
+# the rows from ".values()" use the column names, the answer uses the public names.
+def _rows(rows, allowed, names):
+    return [{name: row[allowed[name]] for name in names} for row in rows]
+
+
+def _json(data, status=200):
+    # compact separators: no spaces after "," and ":".
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder, json_dumps_params={"separators": (",", ":")})
+
+
+def _error(message, status):
+    return _json({"error": message}, status=status)
+
+
+# the url of another page of the same list, keeping the other GET parameters ("fields", "limit").
+def _page_url(request, cursor_name, cursor):
+    params = {key: value for key, value in request.GET.items() if key not in ("after", "before")}
+    params[cursor_name] = cursor
+    return "%s?%s" % (request.path, urlencode(params))
+
+
+def _paged(request, paginator, allowed, names):
+    try:
+        page = paginator.page(after=request.GET.get("after"), before=request.GET.get("before"))
+    except InvalidCursor:
+        raise Http404("Invalid page.")
+    return {
+        "results": _rows(page, allowed, names),
+        "next": _page_url(request, "after", page.next_cursor) if page.has_next else None,
+        "previous": _page_url(request, "before", page.previous_cursor) if page.has_previous else None,
+    }
+
+
+# answer with 304 when the client already has the version "version" of this url, otherwise build the json.
+# The ETag is only given to the successful answers, so a client never keeps the ETag of an error.
+# "version" is None when the versions are kept in a cache of this worker only: no ETag then, another worker would
+# not know about the changes this one saw.
+def _conditional(request, version, build):
+    etag = None
+    if version is not None:
+        etag = quote_etag(hashlib.md5(("%s|%s" % (version, request.get_full_path())).encode()).hexdigest())
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is None:
+        try:
+            response = _json(build())
+        except InvalidFields as error:
+            return _error(str(error), 400)
+        # the version is the one of "default": data read from a replica which is behind does not get its ETag.
+        if etag is not None and not reads_from_replica():
+            response.headers["ETag"] = etag
+    else:
+        response = not_modified
+    # the client may keep the answer, but it has to check with us (If-None-Match) before using it.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _post_version(post_object):
+    return post_version(post_object.pk) if is_shared_cache(fragment_cache()) else None
+
+
+def _published_post(pk):
+    queryset = Post.objects.published().filter(published_date__lte=timezone.now())
+    return get_object_or_404(queryset.only("id", "author_id", "published_date"), pk=pk)
+
+
+# GET /api/v1/posts/ --> the published posts, newest first (the same list as "PostListView" shows to anonymous readers).
+@gzip_page
+@require_safe
+def post_list(request):
+    def build():
+        names = _selected_fields(request, POST_FIELDS, POST_LIST_DEFAULT_FIELDS)
+        queryset = Post.objects.published().order_by("-published_date", "-pk")
+        queryset = _values(queryset, POST_FIELDS, names, extra=("id", "published_date"))
+        paginator = KeysetPaginator(queryset, "published_date", _page_size(request), upper_bound=timezone.now())
+        return _paged(request, paginator, POST_FIELDS, names)
+
+    # the site state changes whenever a post is published/edited or a comment is approved ("middleware.py").
+    return _conditional(request, site_state()["stamp"] if uses_site_state() else None, build)
+
+
+# GET /api/v1/posts/<pk>/ --> one published post, by default with all its fields.
+@gzip_page
+@require_safe
+def post_detail(request, pk):
+    def build():
+        names = _selected_fields(request, POST_FIELDS, POST_FIELDS)
+        queryset = Post.objects.published().filter(published_date__lte=timezone.now())
+        row = _values(queryset, POST_FIELDS, names).filter(pk=pk).first()
+        if row is None:
+            raise Http404("No post found.")
+        return _rows([row], POST_FIELDS, names)[0]
+
+    # the post is looked up first: a missing or draft post is a 404, never a 304, and gets no version stamp.
+    # The version stamp of the post changes with the post and with its comments ("fragments.py").
+    post_object = _published_post(pk)
+    return _conditional(request, _post_version(post_object), build)
+
+
+# GET /api/v1/posts/<pk>/comments/ --> the approved comments of a published post, oldest first.
+@gzip_page
+@require_safe
+def post_comments(request, pk):
+    post_object = _published_post(pk)
+
+    def build():
+        names = _selected_fields(request, COMMENT_FIELDS, COMMENT_FIELDS)
+        comments = Comment.objects.visible_to(AnonymousUser(), post_object)
+        comments = _values(comments, COMMENT_FIELDS, names, extra=("id", "created_date"))
+        paginator = KeysetPaginator(comments, "created_date", _page_size(request), descending=False)
+        return _paged(request, paginator, COMMENT_FIELDS, names)
+
+    return _conditional(request, _post_version(post_object), build)
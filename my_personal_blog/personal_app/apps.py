@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PersonalAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'personal_app'
+
+    # the signal receivers are connected, and the job handlers registered, when the modules are imported.
+    def ready(self):
+        from personal_app import signals, tasks  # noqa: F401
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from personal_app.models import ArchiveRollup, Post
+
+
+# Archive of the published posts by month and by author, read from "ArchiveRollup".
+# A (author, month) row is recomputed from the posts of that author and month only, which the
+# "post_author_published_idx" index finds directly; recomputing (instead of adding/subtracting 1) stays right even if
+# two requests change the same month at the same time, or if a post is published twice.
+# The months of a published/deleted post are recomputed by the "refresh_archive" job ("tasks.py"), not in the request.
+
+
+# the first moment of the month and of the next month, in the current time zone.
+def month_range(year, month):
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end
+
+
+def archive_month(published_date):
+    local = timezone.localtime(published_date)
+    return local.year, local.month
+
+
+def refresh_archive_month(author_id, year, month):
+    start, end = month_range(year, month)
+    posts = Post.objects.filter(author_id=author_id, published_date__gte=start, published_date__lt=end)
+    latest = posts.order_by("-published_date", "-pk").values("pk", "published_date").first()
+    if latest is None:
+        ArchiveRollup.objects.filter(author_id=author_id, year=year, month=month).delete()
+        return
+    ArchiveRollup.objects.update_or_create(
+        author_id=author_id, year=year, month=month,
+        defaults={"post_count": posts.count(), "latest_post_id": latest["pk"],
+                  "latest_published_date": latest["published_date"]},
+    )
+
+
+# the months of "published_dates" (None for a draft is skipped), each recomputed once.
+def refresh_post_archive(author_id, *published_dates):
+    for year, month in {archive_month(date) for date in published_dates if date is not None}:
+        refresh_archive_month(author_id, year, month)
+
+
+# recompute the whole table, "batch_size" authors per transaction. Returns the number of rows written.
+def rebuild_archive(batch_size=100):
+    written, last_pk = 0, 0
+    while True:
+        author_ids = list(User.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not author_ids:
+            return written
+        months = (Post.objects.published().filter(author_id__in=author_ids)
+                  .annotate(year=ExtractYear("published_date"), month=ExtractMonth("published_date"))
+                  .values("author_id", "year", "month")
+                  .annotate(post_count=Count("pk"), latest_published_date=Max("published_date"))
+                  .order_by())
+        rollups = ArchiveRollup.objects.filter(author_id__in=author_ids)
+        with transaction.atomic():
+            rollups.delete()
+            created = ArchiveRollup.objects.bulk_create([ArchiveRollup(**row) for row in months])
+            # the newest post of every month, found through the (author, published_date, id) index.
+            rollups.update(latest_post=Subquery(
+                Post.objects.filter(author=OuterRef("author"), published_date=OuterRef("latest_published_date"))
+                .order_by("-pk").values("pk")[:1]
+            ))
+        written += len(created)
+        last_pk = author_ids[-1]
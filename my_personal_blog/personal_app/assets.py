@@ -0,0 +1,216 @@
+import base64
+import gzip
+import hashlib
+import mimetypes
+import re
+import urllib.request
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:  # optional: "pip install brotli" adds the ".br" files next to the ".gz" ones.
+    brotli = None
+
+
+# Static assets:-
+# The css/js/fonts which "base.html" used to load from the CDNs are downloaded once ("build_assets" command) into
+# "personal_app/static/vendor/", so the pages need no other server. "collectstatic" (run by "build_assets") then copies
+# all the static files into STATIC_ROOT, minifies the css, adds the md5 of the content to every file name
+# ("blogpost.1a2b3c4d5e6f.css", see "storage.py") and writes a gzip (and a brotli) copy of every text file.
+# A file name with its hash never changes content, so "serve_static" lets the browsers keep it for a year.
+
+VENDOR_DIR = Path(__file__).resolve().parent / "static"
+
+# name --> where the file goes under "static/", where it comes from, and its "integrity" (sha384) when we know it.
+VENDOR_ASSETS = {
+    "bootstrap_css": {
+        "path": "vendor/bootstrap-4.0.0/bootstrap.min.css",
+        "url": "https://cdn.jsdelivr.net/npm/bootstrap@4.0.0/dist/css/bootstrap.min.css",
+        "integrity": "sha384-Gn5384xqQ1aoWXA+058RXPxPg6fy4IWvTNh0E263XmFcJlSAwiGgFAW/dAiS6JXm",
+    },
+    "medium_editor_js": {
+        "path": "vendor/medium-editor-5.23.3/medium-editor.min.js",
+        "url": "https://cdn.jsdelivr.net/npm/medium-editor@5.23.3/dist/js/medium-editor.min.js",
+    },
+    "medium_editor_css": {
+        "path": "vendor/medium-editor-5.23.3/medium-editor.min.css",
+        "url": "https://cdn.jsdelivr.net/npm/medium-editor@5.23.3/dist/css/medium-editor.min.css",
+    },
+    # google answers with the "@font-face" rules for the browser asking; the font files they point to are
+    # downloaded next to the css ("download_fonts").
+    "fonts_css": {
+        "path": "vendor/fonts/fonts.css",
+        "url": "https://fonts.googleapis.com/css2?family=Montserrat&family=Russo+One&display=swap",
+        "fonts": True,
+    },
+}
+
+# a current browser, so google sends woff2 fonts.
+DOWNLOAD_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+FONT_URL = re.compile(r"url\((https://fonts\.gstatic\.com/[^)]+)\)")
+
+# the files worth compressing, and the smallest size worth it.
+COMPRESSED_TYPES = (".css", ".js", ".svg", ".json", ".txt", ".html", ".map", ".xml", ".ttf", ".eot")
+COMPRESS_MIN_BYTES = 256
+
+# one year: the longest time the browsers keep a file.
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def _download(url):
+    request = urllib.request.Request(url, headers={"User-Agent": DOWNLOAD_USER_AGENT})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def subresource_integrity(content):
+    return "sha384-" + base64.b64encode(hashlib.sha384(content).digest()).decode()
+
+
+def vendor_path(name):
+    return VENDOR_DIR / VENDOR_ASSETS[name]["path"]
+
+
+# download one vendor asset (and its fonts) into "personal_app/static/"; returns the sha384 of the file.
+def download_vendor_asset(name):
+    asset = VENDOR_ASSETS[name]
+    content = _download(asset["url"])
+    integrity = subresource_integrity(content)
+    if asset.get("integrity") and asset["integrity"] != integrity:
+        raise ValueError("%s does not match its integrity hash (got %s)." % (asset["url"], integrity))
+    target = vendor_path(name)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if asset.get("fonts"):
+        content = download_fonts(content.decode(), target.parent).encode()
+    target.write_bytes(content)
+    return integrity
+
+
+# the fonts of the css are saved next to it and the css points to them with relative urls, which "collectstatic"
+# then replaces with the hashed names.
+def download_fonts(css, directory):
+    def local(match):
+        url = match.group(1)
+        file_name = url.rsplit("/", 1)[-1]
+        (directory / file_name).write_bytes(_download(url))
+        return "url(%s)" % file_name
+    return FONT_URL.sub(local, css)
+
+
+# a small css minifier: comments (except the "/*! license */" ones) and the spaces which do not matter are removed.
+CSS_COMMENT = re.compile(r"/\*(?!!).*?\*/", re.DOTALL)
+CSS_SPACES = re.compile(r"\s+")
+CSS_PUNCTUATION_SPACES = re.compile(r"\s*([{};,>])\s*")
+# a space before ":" matters in a selector (".a :hover" is not ".a:hover"), so the spaces around ":" are removed only
+# in the declarations, i.e. when the next brace is the "}" which closes the block.
+CSS_DECLARATION_COLON = re.compile(r"\s*:\s*(?=[^{}]*})")
+
+
+def minify_css(css):
+    css = CSS_COMMENT.sub("", css)
+    css = CSS_SPACES.sub(" ", css)
+    css = CSS_PUNCTUATION_SPACES.sub(r"\1", css)
+    css = CSS_DECLARATION_COLON.sub(":", css)
+    return css.replace(";}", "}").strip()
+
+
+# write "<file>.gz" (and "<file>.br") next to "path" when it is worth it; returns the names written.
+def compress_file(path):
+    path = Path(path)
+    if path.suffix not in COMPRESSED_TYPES:
+        return []
+    content = path.read_bytes()
+    if len(content) < COMPRESS_MIN_BYTES:
+        return []
+    written = []
+    variants = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", lambda data: brotli.compress(data, quality=11)))
+    for suffix, compress in variants:
+        compressed = compress(content)
+        # a copy which is not smaller is useless.
+        if len(compressed) < len(content):
+            Path(str(path) + suffix).write_bytes(compressed)
+            written.append(path.name + suffix)
+    return written
+
+
+HASHED_NAME = re.compile(r"^(?P<name>.+)\.[0-9a-f]{12}(?P<suffix>\.[^./]+)$")
+
+
+# "css/blogpost.1a2b3c4d5e6f.css" is a hashed name if the manifest maps "css/blogpost.css" to it.
+def is_hashed_name(path):
+    match = HASHED_NAME.match(path)
+    if match is None:
+        return False
+    return staticfiles_storage.hashed_files.get(match["name"] + match["suffix"]) == path
+
+
+# The encodings of an "Accept-Encoding" header, with their "q" value: "gzip, br;q=0" gives {"gzip": 1.0, "br": 0.0}.
+# "q=0" means "not this one", so the name alone is not enough to serve an encoding (see "accepts_encoding").
+def parse_accept_encoding(header):
+    qualities = {}
+    for item in header.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities
+
+
+# an encoding named with a "q" above 0, or not named while "*" is accepted.
+def accepts_encoding(qualities, name):
+    return qualities.get(name, qualities.get("*", 0.0)) > 0
+
+
+# Serves the collected files of STATIC_ROOT (when no web server like nginx does it in front of django):
+# the brotli/gzip copy when the browser accepts it, and "immutable" for a year for the hashed names.
+# The files without a hash in their name may change, the browsers have to check them (Last-Modified) every time.
+@require_safe
+def serve_static(request, path):
+    try:
+        full_path = Path(safe_join(settings.STATIC_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404("Not found.")
+    if not full_path.is_file():
+        raise Http404("Not found.")
+
+    accepted = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+    encoding, served_path = None, full_path
+    for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+        candidate = Path(str(full_path) + suffix)
+        if accepts_encoding(accepted, name) and candidate.is_file():
+            encoding, served_path = name, candidate
+            break
+
+    last_modified = int(full_path.stat().st_mtime)
+    response = get_conditional_response(request, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(full_path.name)[0] or "application/octet-stream"
+        response = FileResponse(served_path.open("rb"), content_type=content_type, filename=full_path.name)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Last-Modified"] = http_date(last_modified)
+    patch_vary_headers(response, ["Accept-Encoding"])
+    if is_hashed_name(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
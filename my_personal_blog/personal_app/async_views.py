@@ -0,0 +1,89 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404
+from django.shortcuts import render
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from django.views.generic import View
+
+from personal_app.fragments import aget_or_render
+from personal_app.models import Post
+from personal_app.pagination import InvalidCursor, KeysetPaginator
+from personal_app.views import (PostListView, comment_page_response, comment_paginator, comment_variant,
+                                published_posts_for, render_comment_list, render_post_body)
+
+
+# Async versions of the read-only pages, used under ASGI ("settings.BLOG_ASYNC_VIEWS").
+# They read the database with the async ORM ("aget", "async for"), so the server does not need a thread per request.
+# They use the same querysets, templates and fragment cache as the sync views in "views.py".
+
+
+# "request.user" is loaded lazily, and loading it may query the database, which is not allowed in async code.
+# Without a session cookie the user is anonymous and no query is needed; otherwise it is loaded in a thread once.
+async def resolve_user(request):
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+class AsyncAboutView(View):
+
+    async def get(self, request):
+        await resolve_user(request)
+        return render(request, "personal_app/about.html")
+
+
+class AsyncPostListView(View):
+
+    async def get(self, request):
+        user = await resolve_user(request)
+        paginator = KeysetPaginator(published_posts_for(user), PostListView.keyset_field,
+                                    PostListView.keyset_page_size, upper_bound=timezone.now())
+        try:
+            page = await paginator.apage(after=request.GET.get("after"), before=request.GET.get("before"))
+        except InvalidCursor:
+            raise Http404("Invalid page.")
+        return render(request, PostListView.template_name, {
+            PostListView.context_object_name: page.object_list,
+            "object_list": page.object_list,
+            "page_obj": page,
+            "is_paginated": page.has_other_pages,
+        })
+
+
+class AsyncPostDetailView(View):
+
+    async def get(self, request, pk):
+        user = await resolve_user(request)
+        try:
+            post_object = await Post.objects.select_related("author").aget(pk=pk)
+        except Post.DoesNotExist:
+            raise Http404("No post found.")
+
+        async def render_body():
+            return render_post_body(post_object)
+
+        async def render_comments():
+            return render_comment_list(post_object, await comment_paginator(user, post_object).apage())
+
+        return render(request, "personal_app/post_detail.html", {
+            "object": post_object,
+            "post_object": post_object,
+            "body_html": mark_safe(await aget_or_render(post_object.pk, "body", "all", render_body)),
+            "comments_html": mark_safe(await aget_or_render(post_object.pk, "comments",
+                                                            comment_variant(user, post_object), render_comments)),
+        })
+
+
+# the next pages of comments of a post (see "views.post_comments").
+async def post_comments(request, pk):
+    user = await resolve_user(request)
+    try:
+        post_object = await Post.objects.only("pk", "author_id").aget(pk=pk)
+    except Post.DoesNotExist:
+        raise Http404("No post found.")
+    try:
+        comment_page = await comment_paginator(user, post_object).apage(after=request.GET.get("after"))
+    except InvalidCursor:
+        raise Http404("Invalid page.")
+    return comment_page_response(request, post_object, comment_page)
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from personal_app.caching import is_shared_cache
+
+
+# The user of every request with a session ("request.user") is loaded by "get_user()" of the authentication backend.
+# "ModelBackend" reads the "auth_user" table every time; this one keeps the user in the "sessions" cache.
+# The cached user is dropped by "signals.py" when the user is saved or deleted and at logout, so a new password,
+# a deactivated account or a staff change is seen by the next request. ("User.objects.update()" sends no signal:
+# call "forget_user()" after it.)
+# The user is only cached in a cache shared by all the worker processes: with "locmem" the other workers would keep
+# their copy (and the old password, the deactivated account) until it expires, so the user is read from the database.
+
+def user_cache():
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def _user_key(user_id):
+    return "auth-user:%s" % user_id
+
+
+def forget_user(user_id):
+    user_cache().delete(_user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        if not is_shared_cache(user_cache()):
+            return super().get_user(user_id)
+        key = _user_key(user_id)
+        user = user_cache().get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                user_cache().set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
@@ -0,0 +1,153 @@
+import bisect
+import itertools
+import random
+import statistics
+import time
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client
+from django.utils import timezone
+
+from personal_app.archive import rebuild_archive
+from personal_app.metrics import percentile
+from personal_app.models import Comment, Post
+
+
+# helpers shared by the "benchmark_*" management commands.
+
+
+# run "function" several times and return the timings in milliseconds.
+def measure(function, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+# a test client sending a "Host" the project accepts: the first of ALLOWED_HOSTS, or "localhost" (always allowed
+# with DEBUG when ALLOWED_HOSTS is empty).
+def benchmark_client():
+    host = next((host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"), "localhost")
+    return Client(HTTP_HOST=host)
+
+
+def summarize(timings):
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+
+# create "count" published posts for "author" using "bulk_create" in batches, one minute apart from each other.
+def bulk_create_posts(author, count, batch_size=5000, start=None):
+    start = start or timezone.now() - timedelta(minutes=count + 1)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        batch = [
+            Post(author=author, title="Benchmark post %s" % number, body="Benchmark body %s" % number,
+                 created_date=start + timedelta(minutes=number), published_date=start + timedelta(minutes=number))
+            for number in range(created, created + size)
+        ]
+        # "bulk_create" does not call "save()", which renders the html.
+        for post in batch:
+            post.render_html()
+        Post.objects.bulk_create(batch, batch_size=batch_size)
+        created += size
+    return created
+
+
+# Deterministic synthetic blog ("seed_blog" command): the same "seed" always gives the same users, posts and comments.
+SEED_USERNAME_PREFIX = "seed-user-"
+# the posts are one "SEED_POST_STEP" apart from each other starting at "SEED_START" (a fixed date, so that the data
+# does not depend on the day it is generated; a million posts end around 2009).
+SEED_START = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+SEED_POST_STEP = timedelta(minutes=5)
+SEED_WORDS = (
+    "django python query index cache page template comment post author draft publish server client request "
+    "response latency throughput database sqlite table column row migration model view form field signal "
+    "worker queue job memory disk network socket thread process async event loop feed search token cursor "
+    "benchmark profile metric percentile deploy release static asset font image style script browser "
+    "engineer design review test coverage bug fix patch commit branch merge build pipeline the a of and to "
+    "in is it that for on with as this by from at be are was not or we can how why when what"
+).split()
+
+
+def _sentence(rng, low, high):
+    return " ".join(rng.choice(SEED_WORDS) for _ in range(rng.randint(low, high)))
+
+
+# a body of a few paragraphs; the number of paragraphs follows a log-normal distribution (most posts are short,
+# some are very long), like the posts of a real blog.
+def _body(rng):
+    paragraphs = max(1, min(40, int(rng.lognormvariate(1.2, 0.7))))
+    return "\n\n".join(_sentence(rng, 40, 120).capitalize() + "." for _ in range(paragraphs))
+
+
+def seed_dataset(users=20, posts=1000, comments=10000, draft_ratio=0.1, approved_ratio=0.8, skew=1.1,
+                 seed=1, batch_size=2000, log=None):
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    User.objects.bulk_create([
+        # an unusable password: hashing a real one costs a lot of time and nobody logs in as these users.
+        User(username="%s%04d" % (SEED_USERNAME_PREFIX, number), password="!seed")
+        for number in range(users)
+    ], batch_size=batch_size)
+    author_ids = list(User.objects.filter(username__startswith=SEED_USERNAME_PREFIX)
+                      .order_by("username").values_list("pk", flat=True))
+
+    # the primary keys and the dates (in minutes after SEED_START) of the published posts, for the comments.
+    published_ids, published_minutes = array("q"), array("q")
+    step_minutes = int(SEED_POST_STEP.total_seconds() // 60)
+    for start in range(0, posts, batch_size):
+        batch = []
+        for number in range(start, min(start + batch_size, posts)):
+            created_date = SEED_START + number * SEED_POST_STEP
+            draft = rng.random() < draft_ratio
+            batch.append(Post(author_id=rng.choice(author_ids), title=_sentence(rng, 3, 8).capitalize(),
+                              body=_body(rng), created_date=created_date,
+                              published_date=None if draft else created_date))
+            batch[-1].render_html()
+        # SQLite returns the primary keys of the new rows ("RETURNING"), so they are set on the objects.
+        Post.objects.bulk_create(batch, batch_size=batch_size)
+        for post in batch:
+            if post.published_date is not None:
+                published_ids.append(post.pk)
+                published_minutes.append(int((post.published_date - SEED_START).total_seconds() // 60))
+        log("posts: %s/%s" % (min(start + batch_size, posts), posts))
+
+    # a few posts get most of the comments: the weight of the post at popularity rank r is 1 / r ** skew.
+    created_comments = 0
+    if published_ids and comments:
+        ranks = list(range(len(published_ids)))
+        rng.shuffle(ranks)
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in ranks))
+        total_weight = cum_weights[-1]
+        while created_comments < comments:
+            size = min(batch_size, comments - created_comments)
+            batch = []
+            for _ in range(size):
+                # every comment takes its random numbers in the same order, so the data does not depend on "batch_size".
+                index = min(bisect.bisect(cum_weights, rng.random() * total_weight), len(cum_weights) - 1)
+                batch.append(Comment(
+                    post_id=published_ids[index], author="Reader %s" % rng.randint(1, 5000),
+                    text=_sentence(rng, 5, 60).capitalize() + ".", approved_comment=rng.random() < approved_ratio,
+                    created_date=SEED_START + timedelta(minutes=published_minutes[index] + rng.randint(1, 60 * 24 * 30)),
+                ))
+                batch[-1].render_html()
+            Comment.objects.bulk_create(batch, batch_size=batch_size)
+            created_comments += size
+            log("comments: %s/%s" % (created_comments, comments))
+
+    # "bulk_create" does not go through "Comment.approve()" and "Post.publish()", so the stored counters and the
+    # archive are computed once at the end.
+    Post.objects.filter(author_id__in=author_ids).refresh_comment_counts()
+    rebuild_archive()
+    return {"users": len(author_ids), "posts": posts, "published": len(published_ids), "comments": created_comments}
@@ -0,0 +1,9 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# "locmem" (the default of "BLOG_CACHE_BACKEND") keeps the cache in the memory of each worker process: what one
+# worker stores or deletes, the other workers never see. A change which has to reach every worker (a logout, a new
+# password, a fragment rendered ahead of time) needs a cache they all read: "file", memcached, redis...
+def is_shared_cache(cache):
+    return not isinstance(cache, (LocMemCache, DummyCache))
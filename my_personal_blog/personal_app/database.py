@@ -0,0 +1,47 @@
+import re
+import sqlite3
+
+from django.conf import settings
+
+
+# Settings of the SQLite connections ("PRAGMA"s), see "BLOG_SQLITE_PRAGMAS" in settings.py.
+# SQLite keeps most of them per connection only, so they are run on every new connection ("connection_created"
+# signal, see "signals.py"). "journal_mode=wal" is stored in the database file, it stays on once set.
+
+PRAGMA_NAME = re.compile(r"^[a-z_]+$")
+PRAGMA_VALUE = re.compile(r"^-?\w+$")
+
+
+def configure_connection(connection, pragmas=None):
+    if connection.vendor != "sqlite":
+        return
+    pragmas = settings.BLOG_SQLITE_PRAGMAS if pragmas is None else pragmas
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            # a PRAGMA can not take query parameters, so the names and the values are checked instead.
+            if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(str(value)):
+                raise ValueError("Invalid SQLite pragma: %s = %s" % (name, value))
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+
+
+# the current value of the pragmas of a connection, e.g. {"journal_mode": "wal", "busy_timeout": 20000}.
+def current_pragmas(connection, names=None):
+    names = names or list(settings.BLOG_SQLITE_PRAGMAS)
+    values = {}
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute("PRAGMA %s" % name)
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    return values
+
+
+# a consistent copy of the "source" SQLite file into "target", even while other processes write to the source
+# ("backup" API of sqlite, page by page). The readers of "target" see either the old or the new copy.
+def copy_sqlite_database(source, target):
+    source_db, target_db = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        source_db.backup(target_db)
+    finally:
+        source_db.close()
+        target_db.close()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.utils.http import http_date, quote_etag
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_safe
+
+from personal_app.middleware import site_state, uses_site_state
+from personal_app.models import Post
+
+
+# Syndication feeds (RSS 2.0, Atom and JSON Feed) of the published posts, for the whole blog or for one author.
+# The feeds contain the whole archive, so they are never built in memory: the posts are read from the database
+# "FEED_CHUNK_SIZE" rows at a time (".iterator()") and every post is written to the response as soon as it is read
+# ("StreamingHttpResponse" over a generator).
+# ("django.contrib.syndication" would load every post and build the whole document before sending it.)
+
+FEED_CHUNK_SIZE = 500
+
+
+# what the writers need to know about the feed itself.
+class FeedInfo:
+    def __init__(self, request, title, link, updated):
+        self.request = request
+        self.title = title
+        self.link = request.build_absolute_uri(link)
+        self.feed_url = request.build_absolute_uri()
+        self.updated = updated
+
+    def post_url(self, post):
+        return self.request.build_absolute_uri(reverse("personal_app:post_detail", kwargs={"pk": post.pk}))
+
+
+# A writer turns the feed into text in three steps: "start()" once, "item()" for every post, "end()" once.
+# Every step returns the text written by it, which is sent to the client right away.
+class XmlFeedWriter:
+    def __init__(self):
+        self.buffer = StringIO()
+        self.handler = SimplerXMLGenerator(self.buffer, "utf-8")
+
+    # the text written since the last call.
+    def drain(self):
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+
+class RssFeedWriter(XmlFeedWriter):
+    content_type = "application/rss+xml; charset=utf-8"
+
+    def start(self, feed):
+        handler = self.handler
+        handler.startDocument()
+        handler.startElement("rss", {"version": "2.0", "xmlns:atom": "http://www.w3.org/2005/Atom",
+                                     "xmlns:dc": "http://purl.org/dc/elements/1.1/"})
+        handler.startElement("channel", {})
+        handler.addQuickElement("title", feed.title)
+        handler.addQuickElement("link", feed.link)
+        handler.addQuickElement("description", feed.title)
+        handler.addQuickElement("atom:link", None, {"rel": "self", "href": feed.feed_url})
+        handler.addQuickElement("lastBuildDate", rfc2822_date(feed.updated))
+        return self.drain()
+
+    def item(self, feed, post):
+        handler = self.handler
+        url = feed.post_url(post)
+        handler.startElement("item", {})
+        handler.addQuickElement("title", post.title)
+        handler.addQuickElement("link", url)
+        handler.addQuickElement("guid", url, {"isPermaLink": "true"})
+        handler.addQuickElement("dc:creator", post.author.username)
+        handler.addQuickElement("pubDate", rfc2822_date(post.published_date))
+        handler.addQuickElement("description", post.body_html)
+        handler.endElement("item")
+        return self.drain()
+
+    def end(self, feed):
+        self.handler.endElement("channel")
+        self.handler.endElement("rss")
+        return self.drain()
+
+
+class AtomFeedWriter(XmlFeedWriter):
+    content_type = "application/atom+xml; charset=utf-8"
+
+    def start(self, feed):
+        handler = self.handler
+        handler.startDocument()
+        handler.startElement("feed", {"xmlns": "http://www.w3.org/2005/Atom"})
+        handler.addQuickElement("title", feed.title)
+        handler.addQuickElement("link", None, {"rel": "alternate", "href": feed.link})
+        handler.addQuickElement("link", None, {"rel": "self", "href": feed.feed_url})
+        handler.addQuickElement("id", feed.feed_url)
+        handler.addQuickElement("updated", rfc3339_date(feed.updated))
+        return self.drain()
+
+    def item(self, feed, post):
+        handler = self.handler
+        url = feed.post_url(post)
+        handler.startElement("entry", {})
+        handler.addQuickElement("title", post.title)
+        handler.addQuickElement("link", None, {"rel": "alternate", "href": url})
+        handler.addQuickElement("id", url)
+        handler.addQuickElement("published", rfc3339_date(post.published_date))
+        handler.addQuickElement("updated", rfc3339_date(post.published_date))
+        handler.startElement("author", {})
+        handler.addQuickElement("name", post.author.username)
+        handler.endElement("author")
+        handler.addQuickElement("content", post.body_html, {"type": "html"})
+        handler.endElement("entry")
+        return self.drain()
+
+    def end(self, feed):
+        self.handler.endElement("feed")
+        return self.drain()
+
+
+# https://www.jsonfeed.org/version/1.1/ ; the "items" list is written one item at a time.
+class JsonFeedWriter:
+    content_type = "application/feed+json; charset=utf-8"
+
+    def __init__(self):
+        self.first_item = True
+
+    def start(self, feed):
+        header = json.dumps({
+            "version": "https://jsonfeed.org/version/1.1",
+            "title": feed.title,
+            "home_page_url": feed.link,
+            "feed_url": feed.feed_url,
+        }, separators=(",", ":"))
+        # the header object is left open, the items are added to it.
+        return header[:-1] + ',"items":['
+
+    def item(self, feed, post):
+        url = feed.post_url(post)
+        text = json.dumps({
+            "id": url,
+            "url": url,
+            "title": post.title,
+            "content_html": post.body_html,
+            "date_published": rfc3339_date(post.published_date),
+            "authors": [{"name": post.author.username}],
+        }, separators=(",", ":"))
+        separator = "" if self.first_item else ","
+        self.first_item = False
+        return separator + text
+
+    def end(self, feed):
+        return "]}"
+
+
+FEED_WRITERS = {
+    "rss": RssFeedWriter,
+    "atom": AtomFeedWriter,
+    "json": JsonFeedWriter,
+}
+
+
+def stream_feed(writer, feed, posts):
+    yield writer.start(feed)
+    for post in posts.iterator(chunk_size=FEED_CHUNK_SIZE):
+        yield writer.item(feed, post)
+    yield writer.end(feed)
+
+
+# GET /feeds/<format>/ and /feeds/<username>/<format>/ --> the published posts, newest first.
+@gzip_page
+@require_safe
+def post_feed(request, feed_format, username=None):
+    writer_class = FEED_WRITERS.get(feed_format)
+    if writer_class is None:
+        raise Http404("Unknown feed format.")
+
+    posts = Post.objects.published().filter(published_date__lte=timezone.now())
+    title, link = "My Tech blog", reverse("personal_app:post_list")
+    if username is not None:
+        author = get_object_or_404(User, username=username)
+        posts = posts.filter(author=author)
+        title = "My Tech blog - %s" % author.username
+
+    # the feed changes when a new post is published (Last-Modified); the ETag also changes when a published post is
+    # edited, because every change of the public content gives the site a new state ("middleware.py"); without a
+    # shared page cache there is no site state, and no ETag.
+    updated = posts.aggregate(latest=Max("published_date"))["latest"] or timezone.now()
+    last_modified = int(updated.timestamp())
+    etag = None
+    if uses_site_state():
+        digest = hashlib.md5(("%s|%s|%s" % (site_state()["stamp"], updated.isoformat(), request.get_full_path()))
+                             .encode())
+        etag = quote_etag(digest.hexdigest())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        posts = (posts.select_related("author")
+                 .only("id", "title", "body_html", "published_date", "author__username")
+                 .order_by("-published_date", "-pk"))
+        writer = writer_class()
+        response = StreamingHttpResponse(stream_feed(writer, FeedInfo(request, title, link, updated), posts),
+                                         content_type=writer.content_type)
+        if etag is not None:
+            response.headers["ETag"] = etag
+        response.headers["Last-Modified"] = http_date(last_modified)
+    # the feed readers may keep the feed, but they have to check with us before using it.
+    patch_cache_control(response, no_cache=True)
+    return response
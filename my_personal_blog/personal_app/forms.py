@@ -1,5 +1,3 @@
-from dataclasses import fields
-from tkinter import Widget
 from django import forms
 from personal_app.models import Post, Comment
 from django.contrib.auth.models import User
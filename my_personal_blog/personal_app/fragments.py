@@ -0,0 +1,96 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from personal_app.replica import reads_from_replica
+
+
+# Cache of the rendered parts ("fragments") of the post detail page.
+# Every post has a version stamp; the key of a fragment contains the stamp, e.g. "post:12:<stamp>:comments:public".
+# When the post or one of its comments changes, the signals in "signals.py" give the post a new stamp,
+# so the old fragments are never read again (they simply expire).
+# A fragment rendered from the read replica is not stored: the replica may not have the change of the new stamp yet.
+
+FRAGMENT_CACHE_ALIAS = "fragments"
+HITS_KEY = "fragment-stats:hits"
+MISSES_KEY = "fragment-stats:misses"
+
+
+def fragment_cache():
+    return caches[FRAGMENT_CACHE_ALIAS]
+
+
+def _new_stamp():
+    return str(time.time_ns())
+
+
+def post_version(post_id):
+    cache = fragment_cache()
+    key = "post-version:%s" % post_id
+    version = cache.get(key)
+    if version is None:
+        # "add" does nothing if another process stored a stamp in the meantime, so we read it back.
+        cache.add(key, _new_stamp(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_post(post_id):
+    fragment_cache().set("post-version:%s" % post_id, _new_stamp(), None)
+
+
+def _count(key):
+    cache = fragment_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the counter does not exist yet (or it was evicted).
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+# return the cached html of the fragment "name" of the post, or render it with "render()" and cache it.
+# "variant" separates the versions of a fragment shown to different readers (e.g. "public"/"owner").
+def get_or_render(post_id, name, variant, render):
+    cache = fragment_cache()
+    key = "post:%s:%s:%s:%s" % (post_id, post_version(post_id), name, variant)
+    html = cache.get(key)
+    if html is None:
+        _count(MISSES_KEY)
+        html = render()
+        if not reads_from_replica():
+            cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    else:
+        _count(HITS_KEY)
+    return html
+
+
+# the same for the async views, "render" is a coroutine function.
+# The cache is still called directly: the local memory and file caches never touch the database, and the "aget()" of
+# django 4.2 would only run the same call in the (single) sync thread, making the requests wait for each other.
+async def aget_or_render(post_id, name, variant, render):
+    cache = fragment_cache()
+    key = "post:%s:%s:%s:%s" % (post_id, post_version(post_id), name, variant)
+    html = cache.get(key)
+    if html is None:
+        _count(MISSES_KEY)
+        html = await render()
+        if not reads_from_replica():
+            cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    else:
+        _count(HITS_KEY)
+    return html
+
+
+def fragment_stats():
+    cache = fragment_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "backend": settings.CACHES[FRAGMENT_CACHE_ALIAS]["BACKEND"],
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else None,
+    }
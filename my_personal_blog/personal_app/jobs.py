@@ -0,0 +1,117 @@
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from personal_app.caching import is_shared_cache
+from personal_app.models import DeadLetterJob, Job
+
+
+# A small job queue kept in the database (the "Job" table), so no broker (redis, rabbitmq...) is needed.
+# - "enqueue()" saves a job; the view returns right away and the "run_jobs" worker runs the job later.
+# - a worker "claims" a job with a conditional UPDATE (only one worker can win it), then runs its handler.
+# - a failed job is retried after a growing delay ("backoff"); after "max_attempts" it is moved to "DeadLetterJob".
+# - with "settings.BLOG_JOBS_EAGER" the jobs run in the process right after the commit (development, tests).
+# The handlers are registered with "@register(name)" in "tasks.py".
+# (Without a worker, e.g. in development, set "BLOG_JOBS_EAGER=1".)
+
+JOB_HANDLERS = {}
+# job name --> the alias of the cache the job fills (e.g. the fragments rendered ahead of time).
+JOB_CACHES = {}
+
+
+# "cache": the job only fills that cache. It is worth running only if the web workers read the same cache: with a
+# cache private to each process ("locmem") the worker would fill its own memory, so "enqueue()" skips such jobs.
+def register(name, cache=None):
+    def decorator(function):
+        JOB_HANDLERS[name] = function
+        if cache is not None:
+            JOB_CACHES[name] = cache
+        return function
+    return decorator
+
+
+# returns the new job, or None when the job was skipped (see "register()").
+def enqueue(name, max_attempts=5, **payload):
+    if name in JOB_CACHES and not is_shared_cache(caches[JOB_CACHES[name]]):
+        return None
+    job = Job.objects.create(name=name, payload=payload, max_attempts=max_attempts)
+    if settings.BLOG_JOBS_EAGER:
+        # "on_commit" runs it right away when we are not in a transaction. The job is not claimed ("locked_by" is
+        # empty), if it fails it is left in the queue for a worker to retry.
+        transaction.on_commit(lambda: run_job(job, worker=""))
+    return job
+
+
+# seconds to wait before the next attempt: 10s, 20s, 40s, ... at most an hour.
+def backoff(attempts):
+    return min(settings.BLOG_JOBS_RETRY_DELAY * 2 ** (attempts - 1), 60 * 60)
+
+
+def default_worker_name():
+    return "%s:%s" % (socket.gethostname(), os.getpid())
+
+
+def _claimable(now):
+    return Q(run_at__lte=now) & (Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+
+
+# lock up to "limit" due jobs for "worker". Another worker may claim one of them at the same moment; the UPDATE
+# only matches while the job is still free, so exactly one of them changes the row and gets the job.
+def claim_jobs(worker, limit=10):
+    now = timezone.now()
+    candidates = list(Job.objects.filter(_claimable(now)).order_by("run_at", "id").values_list("id", flat=True)[:limit])
+    locked_until = now + timedelta(seconds=settings.BLOG_JOBS_LEASE)
+    claimed = [pk for pk in candidates
+               if Job.objects.filter(_claimable(now), pk=pk).update(locked_by=worker, locked_until=locked_until)]
+    return list(Job.objects.filter(pk__in=claimed, locked_by=worker).order_by("run_at", "id"))
+
+
+# run one claimed job. It returns True when the job succeeded (and was removed from the queue).
+def run_job(job, worker):
+    handler = JOB_HANDLERS.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError("No handler is registered for the job %r." % job.name)
+        # the work of the handler and the removal of the job are committed together.
+        with transaction.atomic():
+            handler(**job.payload)
+            Job.objects.filter(pk=job.pk).delete()
+        return True
+    except Exception:
+        _failed(job, worker, traceback.format_exc(), retry=handler is not None)
+        return False
+
+
+def _failed(job, worker, error, retry=True):
+    attempts = job.attempts + 1
+    if not retry or attempts >= job.max_attempts:
+        with transaction.atomic():
+            DeadLetterJob.objects.create(name=job.name, payload=job.payload, created_date=job.created_date,
+                                         attempts=attempts, last_error=error)
+            Job.objects.filter(pk=job.pk).delete()
+        return
+    Job.objects.filter(pk=job.pk, locked_by=worker).update(
+        attempts=attempts, last_error=error, locked_by="", locked_until=None,
+        run_at=timezone.now() + timedelta(seconds=backoff(attempts)),
+    )
+
+
+# run the due jobs until there are none left (or "limit" jobs ran). It returns the number of jobs which ran.
+def run_pending(worker=None, limit=None, batch_size=10):
+    worker = worker or default_worker_name()
+    count = 0
+    while limit is None or count < limit:
+        jobs = claim_jobs(worker, batch_size if limit is None else min(batch_size, limit - count))
+        if not jobs:
+            break
+        for job in jobs:
+            run_job(job, worker)
+            count += 1
+    return count
@@ -0,0 +1,59 @@
+import gzip
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+
+from personal_app.benchmarks import benchmark_client, bulk_create_posts, measure, summarize
+from personal_app.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = ("Compare the latency and the size (raw and gzipped) of the html pages with the json api. "
+            "The synthetic posts are created inside a transaction which is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=1000)
+        parser.add_argument("--comments", type=int, default=50, help="Approved comments on the benchmarked post.")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            author = User.objects.create_user(username="benchmark-api-user")
+            bulk_create_posts(author, options["posts"])
+            post_object = Post.objects.filter(author=author).latest("published_date")
+            comments = [
+                Comment(post=post_object, author="Reader %s" % number, text="Benchmark comment %s" % number,
+                        approved_comment=True)
+                for number in range(options["comments"])
+            ]
+            for comment in comments:
+                comment.render_html()
+            Comment.objects.bulk_create(comments)
+            Post.objects.filter(pk=post_object.pk).refresh_comment_counts()
+            self.report(post_object.pk, options["repeat"])
+            # nothing created by the benchmark is kept.
+            transaction.set_rollback(True)
+
+    def report(self, pk, repeat):
+        client = benchmark_client()
+        urls = {
+            "html list": reverse("personal_app:post_list"),
+            "api list": reverse("personal_app:api_post_list"),
+            "html detail": reverse("personal_app:post_detail", kwargs={"pk": pk}),
+            "api detail": reverse("personal_app:api_post_detail", kwargs={"pk": pk}),
+            "api comments": reverse("personal_app:api_comment_list", kwargs={"pk": pk}),
+        }
+        for name, url in urls.items():
+            # the caches would hide the rendering cost, every request is measured cold.
+            def fetch():
+                for alias in ("fragments", "pages"):
+                    caches[alias].clear()
+                return client.get(url)
+
+            content = fetch().content
+            summary = summarize(measure(fetch, repeat))
+            self.stdout.write("%-13s median=%8.3fms  p95=%8.3fms  bytes=%7s  gzipped=%6s" % (
+                name, summary["median_ms"], summary["p95_ms"], len(content), len(gzip.compress(content))))
@@ -0,0 +1,108 @@
+import multiprocessing
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+
+from personal_app.benchmarks import percentile
+from personal_app.database import copy_sqlite_database
+from personal_app.models import Comment, Post
+from personal_app.pagination import KeysetPaginator
+from personal_app.views import published_posts_for
+
+
+# the SQLite defaults (rollback journal, a sync of the disk at every commit, the 5 seconds lock timeout of python's
+# sqlite3 module) against "BLOG_SQLITE_PRAGMAS".
+DEFAULT_PRAGMAS = {"journal_mode": "delete", "synchronous": "full", "busy_timeout": 5000}
+
+
+class Command(BaseCommand):
+    help = ("Run many worker processes against one SQLite database file, reading the post list and adding comments "
+            "(like add_comment_to_post) at the same time, with the default SQLite settings and with "
+            "BLOG_SQLITE_PRAGMAS, and report the reads/writes per second and the lock errors. "
+            "It works on a copy of the project database, which is deleted at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", default="1,4,16", help="Comma separated numbers of worker processes.")
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per run.")
+        parser.add_argument("--write-ratio", type=float, default=0.2, help="Part of the operations which are writes.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark is for SQLite only.")
+        if not Post.objects.filter(published_date__lte=timezone.now()).exists():
+            raise CommandError("There are no published posts, run seed_blog first.")
+        post_ids = list(Post.objects.filter(published_date__lte=timezone.now()).values_list("pk", flat=True)[:1000])
+        source = Path(connection.settings_dict["NAME"])
+
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, pragmas in (("default", DEFAULT_PRAGMAS), ("tuned", settings.BLOG_SQLITE_PRAGMAS)):
+                for processes in [int(number) for number in options["processes"].split(",")]:
+                    database = Path(directory) / ("%s-%s.sqlite3" % (mode, processes))
+                    copy_sqlite_database(source, database)
+                    result = self.run(database, pragmas, processes, post_ids, options)
+                    self.stdout.write(
+                        "%-7s processes=%-3s reads/s=%8.1f  writes/s=%8.1f  read p99=%8.3fms  write p99=%8.3fms  "
+                        "locked=%s" % (mode, processes, result["reads"], result["writes"], result["read_p99_ms"],
+                                       result["write_p99_ms"], result["locked"]))
+
+    def run(self, database, pragmas, processes, post_ids, options):
+        # the child processes must open their own connections, never share the parent's.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        start_at = time.time() + 0.5
+        workers = [
+            context.Process(target=worker, args=(number, str(database), pragmas, post_ids, options["write_ratio"],
+                                                 start_at, options["duration"], results))
+            for number in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        outcomes = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        read_timings = [timing for outcome in outcomes for timing in outcome["read_timings"]]
+        write_timings = [timing for outcome in outcomes for timing in outcome["write_timings"]]
+        return {
+            "reads": len(read_timings) / options["duration"],
+            "writes": len(write_timings) / options["duration"],
+            "read_p99_ms": percentile(read_timings, 99),
+            "write_p99_ms": percentile(write_timings, 99),
+            "locked": sum(outcome["locked"] for outcome in outcomes),
+        }
+
+
+# one worker process: until "duration" is over, read the first page of the post list or add a comment.
+def worker(number, database, pragmas, post_ids, write_ratio, start_at, duration, results):
+    # the pragmas are run by the "connection_created" receiver, which reads them from the settings.
+    settings.BLOG_SQLITE_PRAGMAS = pragmas
+    connections["default"].settings_dict["NAME"] = database
+    # the python "timeout" option also sets the busy timeout of the connection, so it gets the same value.
+    connections["default"].settings_dict["OPTIONS"] = {"timeout": pragmas.get("busy_timeout", 0) / 1000}
+    rng = random.Random(number)
+    outcome = {"read_timings": [], "write_timings": [], "locked": 0}
+    time.sleep(max(0, start_at - time.time()))
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        write = rng.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if write:
+                Comment.objects.create(post_id=rng.choice(post_ids), author="Benchmark %s" % number,
+                                       text="Concurrent comment")
+            else:
+                KeysetPaginator(published_posts_for(AnonymousUser()), "published_date", 10,
+                                upper_bound=timezone.now()).page()
+        except OperationalError:
+            outcome["locked"] += 1
+            continue
+        outcome["write_timings" if write else "read_timings"].append((time.perf_counter() - start) * 1000)
+    connections.close_all()
+    results.put(outcome)
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from personal_app.benchmarks import bulk_create_posts, measure, summarize
+from personal_app.models import Post
+from personal_app.pagination import KeysetPaginator
+
+
+class Command(BaseCommand):
+    help = ("Measure the latency of the post list pages (keyset vs OFFSET) at several archive sizes. "
+            "The synthetic posts are created inside a transaction which is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000,1000000",
+                            help="Comma separated archive sizes, e.g. 10000,100000,1000000")
+        parser.add_argument("--page-size", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options["sizes"].split(","))
+        page_size = options["page_size"]
+
+        with transaction.atomic():
+            author = User.objects.create_user(username="benchmark-pagination-user")
+            # the posts already in the database are a part of the archive: only the missing ones are created.
+            existing = self.published_posts().count()
+            for size in sizes:
+                existing += bulk_create_posts(author, size - existing)
+                self.report(page_size, options["repeat"])
+            # nothing created by the benchmark is kept.
+            transaction.set_rollback(True)
+
+    def published_posts(self):
+        return Post.objects.select_related("author").filter(published_date__isnull=False)
+
+    def report(self, page_size, repeat):
+        queryset = self.published_posts()
+        paginator = KeysetPaginator(queryset, "published_date", page_size, upper_bound=timezone.now())
+        size = queryset.count()
+
+        # the cursor of a row near the end of the archive: the page after it holds the "page_size" oldest posts,
+        # the last page, which the OFFSET query reads too.
+        deep_row = queryset.order_by("published_date", "pk")[page_size]
+        deep_cursor = paginator.encode_cursor(deep_row)
+        deep_offset = size - page_size
+
+        results = {
+            "keyset first page": summarize(measure(lambda: paginator.page(), repeat)),
+            "keyset deep page": summarize(measure(lambda: paginator.page(after=deep_cursor), repeat)),
+            "offset deep page": summarize(measure(
+                lambda: list(queryset.order_by("-published_date", "-pk")[deep_offset:deep_offset + page_size]), repeat)),
+        }
+        self.stdout.write("posts=%s" % size)
+        for name, summary in results.items():
+            self.stdout.write("  %-18s median=%8.3fms  p95=%8.3fms" % (name, summary["median_ms"], summary["p95_ms"]))
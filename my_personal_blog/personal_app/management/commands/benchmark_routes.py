@@ -0,0 +1,136 @@
+import json
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from personal_app import urls as personal_urls
+from personal_app.benchmarks import benchmark_client, percentile
+from personal_app.models import Comment, Post
+
+
+# the urls which change data on GET, they are not benchmarked.
+SKIPPED_ROUTES = {"approve_comment", "remove_comment", "publish_post"}
+
+
+class Command(BaseCommand):
+    help = ("Request every route of personal_app/urls.py through the test client (as an anonymous reader and as the "
+            "author of the newest post) against the current database, e.g. after seed_blog, and report the "
+            "throughput, the latency percentiles and the number of queries. --output stores the results as json, "
+            "--compare prints the change against a previous result file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50, help="Measured requests per route and user.")
+        parser.add_argument("--cold", action="store_true", help="Clear the caches before every request.")
+        parser.add_argument("--output", help="Write the results to this json file.")
+        parser.add_argument("--compare", help="A json file written by an earlier run (e.g. on another commit).")
+
+    def handle(self, *args, **options):
+        post_object = (Post.objects.select_related("author").filter(published_date__lte=timezone.now())
+                       .order_by("-published_date", "-pk").first())
+        if post_object is None:
+            raise CommandError("There are no published posts, run seed_blog first.")
+
+        routes = {}
+        for reader, user in (("anonymous", None), ("author", post_object.author)):
+            client = benchmark_client()
+            if user is not None:
+                client.force_login(user)
+            for pattern in personal_urls.urlpatterns:
+                if pattern.name in SKIPPED_ROUTES:
+                    continue
+                url = reverse("personal_app:%s" % pattern.name, kwargs=self.url_kwargs(pattern, post_object))
+                routes["%s %s" % (reader, pattern.name)] = self.measure(client, url, options)
+
+        results = {"meta": self.meta(options), "routes": routes}
+        for name, result in routes.items():
+            self.stdout.write("%-32s %s  rps=%8.1f  p50=%8.3fms  p95=%8.3fms  p99=%8.3fms  queries=%3s  bytes=%s" % (
+                name, result["status"], result["rps"], result["p50_ms"], result["p95_ms"], result["p99_ms"], result["queries"],
+                result["bytes"]))
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        if options["compare"]:
+            with open(options["compare"]) as previous:
+                self.compare(json.load(previous), results)
+
+    def url_kwargs(self, pattern, post_object):
+        values = {"pk": post_object.pk, "username": post_object.author.username, "feed_format": "rss",
+                  "year": post_object.published_date.year, "month": post_object.published_date.month}
+        missing = set(pattern.pattern.converters) - set(values)
+        if missing:
+            raise CommandError("No value for the parameters %s of the route %s" % (", ".join(missing), pattern.name))
+        return {name: values[name] for name in pattern.pattern.converters}
+
+    def fetch(self, client, url, cold):
+        if cold:
+            for cache in caches.all():
+                cache.clear()
+        response = client.get(url)
+        # a streamed response (the feeds) does its work while it is read.
+        return response.status_code, b"".join(response.streaming_content) if response.streaming else response.content
+
+    def measure(self, client, url, options):
+        # the first request warms up the caches and the database connection, it is only used for the query count.
+        # (with DEBUG the query log is full after 9000 queries and would not grow any more, so it is emptied first.)
+        reset_queries()
+        with CaptureQueriesContext(connection) as context:
+            status, content = self.fetch(client, url, options["cold"])
+        # counted right away: the next requests empty the query log.
+        queries = len(context.captured_queries)
+        timings = []
+        start = time.perf_counter()
+        for _ in range(options["repeat"]):
+            request_start = time.perf_counter()
+            self.fetch(client, url, options["cold"])
+            timings.append((time.perf_counter() - request_start) * 1000)
+        elapsed = time.perf_counter() - start
+        return {
+            "url": url,
+            "status": status,
+            "rps": round(len(timings) / elapsed, 1),
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "queries": queries,
+            "bytes": len(content),
+        }
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "date": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "repeat": options["repeat"],
+            "cold": options["cold"],
+            "posts": Post.objects.count(),
+            "comments": Comment.objects.count(),
+        }
+
+    def compare(self, previous, current):
+        self.stdout.write("compared with %s:" % (previous["meta"].get("commit") or "the previous run"))
+        for name, result in current["routes"].items():
+            before = previous["routes"].get(name)
+            if before is None:
+                self.stdout.write("%-32s new route" % name)
+                continue
+            self.stdout.write("%-32s p50 %+8.1f%%  p95 %+8.1f%%  queries %+d" % (
+                name, self.change(before["p50_ms"], result["p50_ms"]), self.change(before["p95_ms"], result["p95_ms"]),
+                result["queries"] - before["queries"]))
+
+    def change(self, before, after):
+        return (after - before) / before * 100 if before else 0.0
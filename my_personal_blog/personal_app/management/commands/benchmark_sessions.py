@@ -0,0 +1,65 @@
+import re
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from personal_app.benchmarks import benchmark_client, measure, summarize
+
+
+# the session/user layers compared: django's defaults against the cached ones of settings.py.
+SESSION_SETUPS = {
+    "db": {"SESSION_ENGINE": "django.contrib.sessions.backends.db",
+           "AUTHENTICATION_BACKENDS": ["django.contrib.auth.backends.ModelBackend"]},
+    "cached": {"SESSION_ENGINE": "django.contrib.sessions.backends.cached_db",
+               "AUTHENTICATION_BACKENDS": ["personal_app.auth.CachedModelBackend"]},
+}
+ROUTES = ["post_create", "draft_list", "moderation", "post_list"]
+# the table a query reads from.
+FROM_TABLE = re.compile(r'\bFROM "(\w+)"')
+
+
+class Command(BaseCommand):
+    help = ("Compare the queries and the latency of the pages of a logged in user with the database sessions and "
+            "users (django's defaults) and with the cached ones (SESSION_ENGINE cached_db, CachedModelBackend, "
+            "with a shared file cache for the sessions like BLOG_CACHE_BACKEND=file). "
+            "The user is created inside a transaction which is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), tempfile.TemporaryDirectory() as directory:
+            user = User.objects.create_user(username="benchmark-session-user")
+            # the cached setup needs a cache shared by the worker processes ("caching.py").
+            shared_caches = dict(settings.CACHES, **{settings.SESSION_CACHE_ALIAS: {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory}})
+            for name, setup in SESSION_SETUPS.items():
+                if name == "cached":
+                    setup = dict(setup, CACHES=shared_caches)
+                with override_settings(**setup):
+                    caches[settings.SESSION_CACHE_ALIAS].clear()
+                    self.report(name, user, options["repeat"])
+            transaction.set_rollback(True)
+
+    def report(self, name, user, repeat):
+        # a new client, so its middlewares (SessionMiddleware reads SESSION_ENGINE once) use the setup.
+        client = benchmark_client()
+        client.force_login(user)
+        for route in ROUTES:
+            url = reverse("personal_app:%s" % route)
+            # the first request fills the caches; the second one is counted.
+            client.get(url)
+            reset_queries()
+            with CaptureQueriesContext(connection) as context:
+                client.get(url)
+            tables = [FROM_TABLE.search(query["sql"]) for query in context.captured_queries]
+            overhead = sum(1 for table in tables if table and table[1] in ("django_session", "auth_user"))
+            summary = summarize(measure(lambda: client.get(url), repeat))
+            self.stdout.write("%-7s %-12s queries=%3s  session/user queries=%s  median=%8.3fms  p95=%8.3fms" % (
+                name, route, len(context.captured_queries), overhead, summary["median_ms"], summary["p95_ms"]))
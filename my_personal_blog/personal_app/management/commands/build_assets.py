@@ -0,0 +1,47 @@
+from pathlib import Path
+from urllib.error import URLError
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_app.assets import VENDOR_ASSETS, download_vendor_asset, vendor_path
+
+
+class Command(BaseCommand):
+    help = ("Build the static files for production: download the css/js/fonts of base.html from the CDNs into "
+            "personal_app/static/vendor/ (once; --refresh downloads them again), then run collectstatic, which "
+            "minifies the css, adds content hashes to the file names and writes the gzip/brotli copies into "
+            "STATIC_ROOT.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--refresh", action="store_true", help="Download the vendor assets again.")
+        parser.add_argument("--skip-vendor", action="store_true",
+                            help="Do not download anything (no network); base.html keeps the CDN for the missing ones.")
+
+    def handle(self, *args, **options):
+        if not options["skip_vendor"]:
+            for name, asset in VENDOR_ASSETS.items():
+                if vendor_path(name).is_file() and not options["refresh"]:
+                    continue
+                try:
+                    integrity = download_vendor_asset(name)
+                except (URLError, OSError, ValueError) as error:
+                    raise CommandError("Could not download %s: %s (use --skip-vendor to build without it)."
+                                       % (asset["url"], error))
+                self.stdout.write("downloaded %s (%s)" % (asset["path"], integrity))
+
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.report(Path(settings.STATIC_ROOT))
+
+    def report(self, root):
+        files, raw, compressed = 0, 0, 0
+        for path in root.rglob("*"):
+            if not path.is_file() or path.suffix in (".gz", ".br"):
+                continue
+            files += 1
+            raw += path.stat().st_size
+            gzipped = Path(str(path) + ".gz")
+            compressed += gzipped.stat().st_size if gzipped.is_file() else path.stat().st_size
+        self.stdout.write(self.style.SUCCESS("Built %s files in %s: %s bytes, %s bytes gzipped." % (
+            files, root, raw, compressed)))
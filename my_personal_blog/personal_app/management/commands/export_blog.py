@@ -0,0 +1,25 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from personal_app.transfer import export_blog
+
+
+class Command(BaseCommand):
+    help = ("Write the authors, posts and comments into a gzipped json lines file (streamed, in constant memory), "
+            "for import_blog on another server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The file to write, e.g. blog.jsonl.gz")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows read from the database at a time.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = export_blog(options["path"], options["chunk_size"])
+        elapsed = time.perf_counter() - start
+        rows = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            "Exported %s users, %s posts and %s comments to %s (%s bytes) in %.1fs, %.0f rows/s." % (
+                counts["user"], counts["post"], counts["comment"], options["path"], Path(options["path"]).stat().st_size,
+                elapsed, rows / elapsed if elapsed else 0)))
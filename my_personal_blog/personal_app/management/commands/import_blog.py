@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_app.archive import rebuild_archive
+from personal_app.fragments import fragment_cache
+from personal_app.middleware import purge_pages
+from personal_app.transfer import InvalidExportFile, import_blog
+
+
+class Command(BaseCommand):
+    help = ("Import a file written by export_blog, with bulk_create in batches (one transaction per batch). "
+            "The rows get new primary keys and existing users (same username) are reused. Run it again with the "
+            "same file to continue an import which stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=2000, help="Rows per bulk_create and transaction.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            counts = import_blog(options["path"], options["batch_size"],
+                                 log=lambda message: self.stdout.write("  " + message))
+        except (InvalidExportFile, OSError) as error:
+            raise CommandError(error)
+        elapsed = time.perf_counter() - start
+
+        # "bulk_create" sends no signals: the archive and the caches are brought up to date once here.
+        # (the search index is filled by its database triggers.)
+        if any(counts.values()):
+            rebuild_archive()
+            fragment_cache().clear()
+            purge_pages()
+        rows = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %s users, %s posts and %s comments in %.1fs, %.0f rows/s." % (
+                counts["user"], counts["post"], counts["comment"], elapsed, rows / elapsed if elapsed else 0)))
@@ -0,0 +1,120 @@
+import http.client
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from personal_app.benchmarks import percentile
+from personal_app.models import Post
+
+
+# the two deployments: the same project served by uvicorn as a WSGI app (sync views in a thread pool)
+# and as an ASGI app (the async views of "async_views.py" on the event loop).
+DEPLOYMENTS = {
+    "wsgi": {"app": "my_personal_blog.wsgi:application", "options": ["--interface", "wsgi"], "async_views": "0"},
+    "asgi": {"app": "my_personal_blog.asgi:application", "options": ["--interface", "asgi3"], "async_views": "1"},
+}
+
+
+class Command(BaseCommand):
+    help = ("Load test the read-only pages under WSGI and under ASGI (uvicorn against the SQLite database of the "
+            "project) and report the requests/sec and the latency percentiles at increasing concurrency. "
+            "Needs uvicorn: pip install uvicorn.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--deployments", default="wsgi,asgi")
+        parser.add_argument("--concurrency", default="1,8,32,64", help="Comma separated numbers of parallel clients.")
+        parser.add_argument("--requests", type=int, default=500, help="Requests per concurrency level.")
+        parser.add_argument("--paths", default="", help="Comma separated paths; by default the home page, the about "
+                                                        "page and the newest post with its comments.")
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec("uvicorn") is None:
+            raise CommandError("uvicorn is not installed: pip install uvicorn")
+        deployments = options["deployments"].split(",")
+        unknown = [name for name in deployments if name not in DEPLOYMENTS]
+        if unknown:
+            raise CommandError("Unknown deployments: %s" % ", ".join(unknown))
+        paths = options["paths"].split(",") if options["paths"] else self.default_paths()
+        levels = [int(level) for level in options["concurrency"].split(",")]
+
+        for name in deployments:
+            process = self.start_server(DEPLOYMENTS[name], options["port"])
+            try:
+                # one round to fill the caches and open the database, which is not measured.
+                self.run_level(options["port"], paths, 1, len(paths))
+                for level in levels:
+                    result = self.run_level(options["port"], paths, level, options["requests"])
+                    self.stdout.write("%s concurrency=%-4s rps=%8.1f  p50=%8.3fms  p99=%8.3fms  errors=%s" % (
+                        name, level, result["rps"], result["p50_ms"], result["p99_ms"], result["errors"]))
+            finally:
+                process.terminate()
+                process.wait()
+
+    def default_paths(self):
+        paths = [reverse("personal_app:post_list"), reverse("personal_app:about")]
+        newest = Post.objects.filter(published_date__lte=timezone.now()).order_by("-published_date").first()
+        if newest is not None:
+            paths.append(reverse("personal_app:post_detail", kwargs={"pk": newest.pk}))
+            paths.append(reverse("personal_app:comment_list", kwargs={"pk": newest.pk}))
+        return paths
+
+    def start_server(self, deployment, port):
+        env = dict(os.environ, BLOG_ASYNC_VIEWS=deployment["async_views"])
+        command = [sys.executable, "-m", "uvicorn", deployment["app"], "--port", str(port),
+                   "--log-level", "warning", "--no-access-log"] + deployment["options"]
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError("The server stopped: %s" % " ".join(command))
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                connection.request("GET", "/about/")
+                connection.getresponse().read()
+                return process
+            except OSError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError("The server did not start on port %s" % port)
+
+    # "concurrency" clients (threads), each with its own keep-alive connection, share "total" requests.
+    def run_level(self, port, paths, concurrency, total):
+        def client(number):
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            timings, errors = [], 0
+            for index in range(number, total, concurrency):
+                start = time.perf_counter()
+                try:
+                    connection.request("GET", paths[index % len(paths)])
+                    response = connection.getresponse()
+                    response.read()
+                    # a redirect (e.g. to the login page) or a 404 is not the page being measured: it is an error too.
+                    if response.status not in (200, 304):
+                        errors += 1
+                except (OSError, http.client.HTTPException):
+                    errors += 1
+                    connection.close()
+                timings.append((time.perf_counter() - start) * 1000)
+            connection.close()
+            return timings, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(client, range(concurrency)))
+        elapsed = time.perf_counter() - start
+        timings = [timing for client_timings, _ in results for timing in client_timings]
+        return {
+            "rps": len(timings) / elapsed,
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "errors": sum(errors for _, errors in results),
+        }
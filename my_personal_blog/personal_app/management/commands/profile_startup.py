@@ -0,0 +1,54 @@
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_app.startup import STARTUP_MODULES, cold_start
+
+
+class Command(BaseCommand):
+    help = ("Start new python processes like a freshly spawned worker: import wsgi.py/asgi.py and answer one request. "
+            "Report the time of the imports and of the first response (the median of --runs processes), the import "
+            "time of the settings, urls, views, forms and admin modules, the slowest imports, and the modules a web "
+            "worker should not load. --check fails when the cold start is over BLOG_COLD_START_BUDGET_MS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", default="wsgi,asgi")
+        parser.add_argument("--path", default="/", help="The path of the first request.")
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--top", type=int, default=10, help="Number of slowest imports shown.")
+        parser.add_argument("--check", action="store_true", help="Fail when over the budget.")
+
+    def handle(self, *args, **options):
+        budget = settings.BLOG_COLD_START_BUDGET_MS
+        over_budget = []
+        for entry in options["entries"].split(","):
+            try:
+                runs = [cold_start(entry, options["path"]) for _ in range(options["runs"])]
+            except (ValueError, RuntimeError) as error:
+                raise CommandError(str(error))
+            # the run whose cold start is the median one, for the details.
+            runs.sort(key=lambda run: run["cold_start_ms"])
+            median = runs[len(runs) // 2]
+
+            cold_start_ms = statistics.median(run["cold_start_ms"] for run in runs)
+            self.stdout.write("%s %s --> %s  cold start=%.1fms (imports=%.1fms, first response=%.1fms), "
+                              "whole process=%.1fms, budget=%sms" % (
+                                  entry, options["path"], median["status"], cold_start_ms, median["import_ms"],
+                                  median["first_response_ms"], median["process_ms"], budget))
+            for name in STARTUP_MODULES:
+                if name in median["modules"]:
+                    self.stdout.write("  import %-28s %8.1fms" % (name, median["modules"][name]))
+                else:
+                    self.stdout.write("  import %-28s not imported" % name)
+            self.stdout.write("  slowest imports (without the modules they import):")
+            for name, self_ms in median["slowest"][:options["top"]]:
+                self.stdout.write("    %-45s %8.1fms" % (name, self_ms))
+            if median["unwanted"]:
+                self.stdout.write(self.style.WARNING("  loaded but not needed by a web worker: %s"
+                                                     % ", ".join(median["unwanted"])))
+            if cold_start_ms > budget:
+                over_budget.append(entry)
+
+        if options["check"] and over_budget:
+            raise CommandError("Cold start over the budget of %sms: %s" % (budget, ", ".join(over_budget)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from personal_app.archive import rebuild_archive
+from personal_app.middleware import purge_pages
+
+
+class Command(BaseCommand):
+    help = ("Recompute the archive rollup (posts per author and month) from the published posts, in batches of "
+            "authors, e.g. after posts were created or changed with bulk_create/update().")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Authors per transaction.")
+
+    def handle(self, *args, **options):
+        written = rebuild_archive(options["batch_size"])
+        purge_pages()
+        self.stdout.write(self.style.SUCCESS("Wrote %s archive rows." % written))
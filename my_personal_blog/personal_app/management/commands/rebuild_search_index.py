@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_app.search import install_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of the posts (SQLite FTS5), in batches of posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not install_search_index():
+            raise CommandError("The database does not support FTS5; the search uses the plain database filters.")
+        indexed = 0
+        for indexed in rebuild_search_index(batch_size=options["batch_size"]):
+            self.stdout.write("indexed %s posts" % indexed)
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt (%s posts)." % indexed))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from personal_app.fragments import fragment_cache
+from personal_app.middleware import purge_pages
+from personal_app.models import Comment, Post
+from personal_app.rendering import render_comment_html, render_html_columns, render_post_html
+
+
+class Command(BaseCommand):
+    help = ("Render the stored html of the posts (body_html) and comments (text_html) again, in batches, e.g. after "
+            "installing markdown or changing the allowed tags in rendering.py. Only the rows whose html changed "
+            "are written.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = render_html_columns(Post.objects.all(), "body", "body_html", render_post_html, options["batch_size"])
+        comments = render_html_columns(Comment.objects.all(), "text", "text_html", render_comment_html,
+                                       options["batch_size"])
+        if posts or comments:
+            # "bulk_update" sends no signals, so the cached fragments and pages are dropped here.
+            fragment_cache().clear()
+            purge_pages()
+        self.stdout.write(self.style.SUCCESS("Rendered the html of %s posts and %s comments." % (posts, comments)))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from personal_app.models import Post
+
+
+class Command(BaseCommand):
+    help = ("Recompute the stored number of approved comments (Post.approved_comment_count) of every post, "
+            "in batches of posts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report the posts whose counter is wrong.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk, checked, wrong = 0, 0, 0
+        while True:
+            batch = list(Post.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                break
+            posts = Post.objects.filter(pk__gt=last_pk, pk__lte=batch[-1])
+            with transaction.atomic():
+                wrong += posts.with_comment_counts().exclude(approved_comment_count=F("approved_comment_total")).count()
+                if not options["dry_run"]:
+                    posts.refresh_comment_counts()
+            checked += len(batch)
+            last_pk = batch[-1]
+
+        action = "found" if options["dry_run"] else "repaired"
+        self.stdout.write(self.style.SUCCESS("Checked %s posts, %s %s wrong counters." % (checked, action, wrong)))
@@ -0,0 +1,34 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from personal_app.database import copy_sqlite_database
+from personal_app.replica import REPLICA_ALIAS
+
+
+class Command(BaseCommand):
+    help = ("Copy the primary SQLite database ('default') into the read replica ('replica', see BLOG_DB_REPLICA), "
+            "once or every --interval seconds. It stands in for real database replication when trying the replica "
+            "routing locally; the interval is the replication lag.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Seconds between two copies; 0 (the default) copies once.")
+
+    def handle(self, *args, **options):
+        if REPLICA_ALIAS not in connections.settings:
+            raise CommandError("There is no '%s' database, set BLOG_DB_REPLICA." % REPLICA_ALIAS)
+        source, target = (Path(connections[alias].settings_dict["NAME"]) for alias in ("default", REPLICA_ALIAS))
+        if connections["default"].vendor != "sqlite" or connections[REPLICA_ALIAS].vendor != "sqlite":
+            raise CommandError("replicate_sqlite only copies SQLite databases.")
+        while True:
+            start = time.perf_counter()
+            copy_sqlite_database(source, target)
+            self.stdout.write("%s copied %s to %s in %.1fms" % (
+                timezone.now().isoformat(timespec="seconds"), source.name, target, (time.perf_counter() - start) * 1000))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
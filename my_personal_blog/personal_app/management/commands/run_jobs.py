@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from personal_app.jobs import default_worker_name, run_pending
+
+
+class Command(BaseCommand):
+    help = ("Run the background jobs (see personal_app/jobs.py). Several workers can run at the same time, "
+            "every job is run by one of them only.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the due jobs and exit.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--batch-size", type=int, default=10, help="Jobs claimed at a time.")
+        parser.add_argument("--worker", default=None, help="Name of the worker (default: host:pid).")
+
+    def handle(self, *args, **options):
+        worker = options["worker"] or default_worker_name()
+        try:
+            while True:
+                count = run_pending(worker, batch_size=options["batch_size"])
+                if count:
+                    self.stdout.write("%s ran %s jobs" % (worker, count))
+                if options["once"]:
+                    break
+                if not count:
+                    time.sleep(options["sleep"])
+        except KeyboardInterrupt:
+            # a job interrupted in the middle is rolled back and picked up again after its lease.
+            self.stdout.write("%s stopped" % worker)
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from personal_app.benchmarks import SEED_USERNAME_PREFIX, seed_dataset
+from personal_app.middleware import purge_pages
+from personal_app.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with a deterministic synthetic blog (users, posts with realistic body sizes, drafts, "
+            "comments concentrated on a few popular posts), using bulk_create in batches. "
+            "The same --seed always gives the same data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=10000)
+        parser.add_argument("--comments", type=int, default=100000)
+        parser.add_argument("--draft-ratio", type=float, default=0.1)
+        parser.add_argument("--approved-ratio", type=float, default=0.8)
+        parser.add_argument("--skew", type=float, default=1.1,
+                            help="How much the comments concentrate on the popular posts (0 = evenly).")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--flush", action="store_true", help="Delete the previously generated data first.")
+
+    def handle(self, *args, **options):
+        seeded_users = User.objects.filter(username__startswith=SEED_USERNAME_PREFIX)
+        if seeded_users.exists():
+            if not options["flush"]:
+                raise CommandError("The database already contains generated data, use --flush to replace it.")
+            self.flush(seeded_users, options["batch_size"])
+
+        with transaction.atomic():
+            counts = seed_dataset(
+                users=options["users"], posts=options["posts"], comments=options["comments"],
+                draft_ratio=options["draft_ratio"], approved_ratio=options["approved_ratio"], skew=options["skew"],
+                seed=options["seed"], batch_size=options["batch_size"],
+                log=lambda message: self.stdout.write("  " + message),
+            )
+        # "bulk_create" sends no signals, so the cached pages are purged once here.
+        purge_pages()
+        self.stdout.write(self.style.SUCCESS(
+            "Created %(users)s users, %(posts)s posts (%(published)s published) and %(comments)s comments." % counts))
+
+    # the comments go with one DELETE; the posts in batches, so their "post_delete" signals never load them all at once.
+    def flush(self, seeded_users, batch_size):
+        Comment.objects.filter(post__author__in=seeded_users).delete()
+        posts = Post.objects.filter(author__in=seeded_users)
+        while True:
+            batch = list(posts.values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                break
+            Post.objects.filter(pk__in=batch).delete()
+        seeded_users.delete()
@@ -0,0 +1,49 @@
+import threading
+from collections import defaultdict, deque
+
+
+# Timings of the recent requests, per url name, recorded by "RequestMetricsMiddleware" ("middleware.py").
+# They are kept in the memory of the process (the last "METRICS_WINDOW" requests of every url name), so every
+# worker process of the server has its own numbers.
+
+METRICS_WINDOW = 1000
+METRIC_NAMES = ["wall_ms", "db_ms", "db_queries", "template_ms", "response_bytes"]
+
+_records = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+_lock = threading.Lock()
+
+
+# "percent" (0-100) of the sorted values; also used by the "benchmark_*" commands (imported from "benchmarks.py").
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def record(view_name, **values):
+    with _lock:
+        _records[view_name].append(values)
+
+
+def reset():
+    with _lock:
+        _records.clear()
+
+
+# count and p50/p95/p99 of every metric, per url name.
+def summary():
+    with _lock:
+        records = {view_name: list(rows) for view_name, rows in _records.items()}
+    result = {}
+    for view_name, rows in sorted(records.items()):
+        result[view_name] = {"count": len(rows)}
+        for name in METRIC_NAMES:
+            values = [row[name] for row in rows]
+            result[view_name][name] = {
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "p99": round(percentile(values, 99), 3),
+            }
+    return result
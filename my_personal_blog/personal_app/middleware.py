@@ -0,0 +1,239 @@
+import hashlib
+import math
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.models import Min
+from django.template.base import Template
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import http_date, quote_etag
+
+from personal_app import metrics
+from personal_app.caching import is_shared_cache
+from personal_app.models import Post
+from personal_app.replica import reads_from_replica
+
+
+PAGE_CACHE_ALIAS = "pages"
+SITE_STATE_KEY = "site-state"
+
+
+# The "site state" says when the public content (published posts, approved comments) changed for the last time.
+# Its "stamp" is a part of every page cache key and of every ETag, so "purge_pages()" only has to store a new state.
+# A post with a future "published_date" shows up without any purge: the state expires at that moment (and after
+# "PAGE_STATE_TIMEOUT" seconds at most), and a new one is made, as if the pages were purged.
+# Every worker has to see the same state, so it is only used with a shared cache ("uses_site_state()").
+def uses_site_state():
+    return is_shared_cache(caches[PAGE_CACHE_ALIAS])
+
+
+def _new_state():
+    now = time.time()
+    return {"stamp": "%s-%s" % (now, time.time_ns()), "last_modified": now}
+
+
+# seconds until the next scheduled post becomes visible (read from "default", a replica could be behind).
+def _state_timeout():
+    now = timezone.now()
+    next_date = (Post.objects.using("default").filter(published_date__gt=now)
+                 .aggregate(next=Min("published_date"))["next"])
+    if next_date is None:
+        return settings.PAGE_STATE_TIMEOUT
+    return min(settings.PAGE_STATE_TIMEOUT, math.ceil((next_date - now).total_seconds()))
+
+
+def site_state():
+    cache = caches[PAGE_CACHE_ALIAS]
+    state = cache.get(SITE_STATE_KEY)
+    if state is None:
+        # nothing is cached yet (or it expired): another worker may be storing a state at the same time, the first
+        # one stored is used by everybody.
+        state = _new_state()
+        cache.add(SITE_STATE_KEY, state, _state_timeout())
+        state = cache.get(SITE_STATE_KEY, state)
+    return state
+
+
+def purge_pages():
+    if uses_site_state():
+        caches[PAGE_CACHE_ALIAS].set(SITE_STATE_KEY, _new_state(), _state_timeout())
+
+
+# Full page cache for the anonymous readers of the pages listed in "settings.ANONYMOUS_CACHE_VIEWS".
+# A logged in user (or any request other than GET/HEAD) always goes to the view.
+# Every cached page gets an ETag and a Last-Modified header, so the browsers can ask "did it change?" and get a 304.
+# Without a shared page cache a worker would keep serving (or answering 304 for) a page purged by another worker, so
+# django removes it from the chain ("MiddlewareNotUsed").
+class AnonymousPageCacheMiddleware(MiddlewareMixin):
+
+    def __init__(self, get_response):
+        if not uses_site_state():
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return None
+        if request.resolver_match.view_name not in settings.ANONYMOUS_CACHE_VIEWS:
+            return None
+        # without a session cookie this does not touch the database.
+        if request.user.is_authenticated:
+            return None
+
+        state = site_state()
+        path = request.get_full_path()
+        digest = hashlib.md5(("%s|%s" % (state["stamp"], path)).encode()).hexdigest()
+        request.page_cache = {
+            "key": "page:%s" % digest,
+            "etag": quote_etag(digest),
+            "last_modified": int(state["last_modified"]),
+        }
+
+        not_modified = get_conditional_response(request, etag=request.page_cache["etag"],
+                                                last_modified=request.page_cache["last_modified"])
+        if not_modified is not None:
+            request.page_cache["served"] = True
+            return self.add_headers(request, not_modified)
+
+        response = caches[PAGE_CACHE_ALIAS].get(request.page_cache["key"])
+        if response is not None:
+            request.page_cache["served"] = True
+            return self.add_headers(request, response)
+        return None
+
+    def process_response(self, request, response):
+        page_cache = getattr(request, "page_cache", None)
+        if page_cache is None or page_cache.get("served"):
+            return response
+        # pages setting cookies (e.g. a csrf token) are personal, they are never cached.
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return response
+        # a page read from the replica may be older than the state: it gets neither the cache nor the ETag.
+        if reads_from_replica():
+            return response
+        self.add_headers(request, response)
+        caches[PAGE_CACHE_ALIAS].set(page_cache["key"], response, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    def add_headers(self, request, response):
+        response.headers["ETag"] = request.page_cache["etag"]
+        response.headers["Last-Modified"] = http_date(request.page_cache["last_modified"])
+        # the browser may keep the page, but it has to check with us (If-None-Match) before using it.
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+# Measures every request: the wall time, the number and the time of the database queries, the time spent rendering
+# the template of a "TemplateResponse" (the class based views) and the size of the response.
+# The numbers are recorded per url name ("metrics.py", see the "request_metrics" view) and sent back to the browser
+# in a "Server-Timing" header, which the developer tools of the browsers show next to the request.
+# It should be the first middleware, so that its wall time includes all the others (and the page cache hits).
+# With "settings.BLOG_REQUEST_METRICS" off, django removes it from the chain ("MiddlewareNotUsed"), so it costs nothing.
+# It works both ways: under ASGI django calls it as a coroutine, so the async views behind it stay in the event loop
+# (a sync only middleware would make django run the whole chain after it in a thread).
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.BLOG_REQUEST_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        if not getattr(Template.render, "timed", False):
+            Template.render = timed_render(Template.render)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = self.start(request)
+        token = _rendering_metrics.set(request.request_metrics)
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, request)
+                response = self.get_response(request)
+        finally:
+            _rendering_metrics.reset(token)
+        return self.finish(request, response, start)
+
+    async def __acall__(self, request):
+        start = self.start(request)
+        # "sync_to_async" copies the context into its thread, so the templates rendered there are counted too.
+        token = _rendering_metrics.set(request.request_metrics)
+        # the connections belong to a thread, and the queries of an async request run in its "sync_to_async" thread:
+        # the wrappers are added (and removed) in that thread.
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _rendering_metrics.reset(token)
+        return self.finish(request, response, start)
+
+    def start(self, request):
+        request.request_metrics = {"db_ms": 0.0, "db_queries": 0, "template_ms": 0.0}
+        return time.perf_counter()
+
+    def wrap_connections(self, stack, request):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self.time_query(request)))
+
+    def finish(self, request, response, start):
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        values = request.request_metrics
+        values["wall_ms"] = wall_ms
+        values["response_bytes"] = 0 if response.streaming else len(response.content)
+        match = request.resolver_match
+        metrics.record(match.view_name if match else "<unresolved>", **values)
+        response.headers["Server-Timing"] = (
+            'total;dur=%.3f, db;dur=%.3f;desc="%s queries", template;dur=%.3f'
+            % (wall_ms, values["db_ms"], values["db_queries"], values["template_ms"])
+        )
+        return response
+
+    def time_query(self, request):
+        def wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                request.request_metrics["db_ms"] += (time.perf_counter() - start) * 1000
+                request.request_metrics["db_queries"] += 1
+        return wrapper
+
+
+# The metrics of the request being answered (None outside of a request), and whether a template is being rendered:
+# an "{% include %}" or "{% extends %}" renders a template inside another one, only the outer one is timed.
+_rendering_metrics = ContextVar("blog_rendering_metrics", default=None)
+_rendering = ContextVar("blog_rendering", default=False)
+
+
+# Wraps "Template.render" (called by "render()", by "TemplateResponse" and by the fragments alike), so the time spent
+# rendering is measured for every view, the function views included. It is installed by the middleware, only when
+# the metrics are on.
+def timed_render(render):
+    def wrapper(self, context):
+        values = _rendering_metrics.get()
+        if values is None or _rendering.get():
+            return render(self, context)
+        token = _rendering.set(True)
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            values["template_ms"] += (time.perf_counter() - start) * 1000
+            _rendering.reset(token)
+    wrapper.timed = True
+    return wrapper
@@ -0,0 +1,65 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+# the FTS5 table and its triggers exist only on SQLite, see "personal_app/search.py".
+# The SQL is written here as it was when this migration was made: a later change of "search.py" must not change
+# what this migration does.
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS personal_app_post_fts USING fts5("
+    "title, body, content='personal_app_post', content_rowid='id', tokenize='porter unicode61')"
+)
+TRIGGERS_SQL = [
+    """CREATE TRIGGER IF NOT EXISTS personal_app_post_fts_ai AFTER INSERT ON personal_app_post BEGIN
+        INSERT INTO personal_app_post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS personal_app_post_fts_ad AFTER DELETE ON personal_app_post BEGIN
+        INSERT INTO personal_app_post_fts(personal_app_post_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS personal_app_post_fts_au AFTER UPDATE OF title, body ON personal_app_post BEGIN
+        INSERT INTO personal_app_post_fts(personal_app_post_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO personal_app_post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS personal_app_post_fts_ai",
+    "DROP TRIGGER IF EXISTS personal_app_post_fts_ad",
+    "DROP TRIGGER IF EXISTS personal_app_post_fts_au",
+    "DROP TABLE IF EXISTS personal_app_post_fts",
+]
+
+
+# the existing posts are indexed with the FTS5 "rebuild" command (the migration runs in one transaction anyway).
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(CREATE_TABLE_SQL)
+        except OperationalError:
+            # SQLite without the FTS5 extension, the "icontains" fallback will be used.
+            return
+        for statement in TRIGGERS_SQL:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO personal_app_post_fts(personal_app_post_fts) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_app', '0004_comment_visibility_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
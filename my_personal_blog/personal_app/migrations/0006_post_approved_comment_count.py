@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# fill the new counter for the existing posts with one UPDATE statement.
+def count_approved_comments(apps, schema_editor):
+    Post = apps.get_model("personal_app", "Post")
+    Comment = apps.get_model("personal_app", "Comment")
+    approved_comments = (
+        Comment.objects.filter(post=OuterRef("pk"), approved_comment=True)
+        .order_by()
+        .values("post")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Post.objects.update(approved_comment_count=Coalesce(Subquery(approved_comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_app', '0005_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_approved_comments, migrations.RunPython.noop),
+    ]
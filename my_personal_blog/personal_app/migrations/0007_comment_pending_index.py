@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_app', '0006_post_approved_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('approved_comment', False)), fields=['post', 'created_date', 'id'], name='comment_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,168 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:58
+
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+from django.utils.text import normalize_newlines
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+
+# A copy of "personal_app/rendering.py" as it was when this migration was made: a later change of "rendering.py"
+# must not change what this migration does ("python manage.py render_html" renders with the current rules).
+
+ALLOWED_TAGS = {
+    "a", "abbr", "b", "blockquote", "br", "code", "del", "div", "em", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i",
+    "img", "li", "ol", "p", "pre", "s", "span", "strong", "sub", "sup", "table", "tbody", "td", "th", "thead", "tr",
+    "u", "ul",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "abbr": {"title"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+}
+URL_ATTRIBUTES = {"href", "src"}
+URL_SCHEMES = {"", "http", "https", "mailto"}
+# the tags which can not have content ("<br>", not "<br></br>").
+VOID_TAGS = {"br", "hr", "img"}
+# the tags whose content is dropped with them (not shown as text).
+DROPPED_CONTENT_TAGS = {"script", "style", "template", "iframe", "object", "embed", "noscript", "textarea"}
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables", "sane_lists", "nl2br"]
+
+
+def _allowed_url(value):
+    # the browsers ignore the spaces and the control characters inside a scheme ("java\tscript:").
+    cleaned = "".join(character for character in value if character > " ")
+    try:
+        return urlsplit(cleaned).scheme.lower() in URL_SCHEMES
+    except ValueError:
+        return False
+
+
+class HtmlSanitizer(HTMLParser):
+
+    def __init__(self, nofollow=False):
+        super().__init__(convert_charrefs=True)
+        self.nofollow = nofollow
+        self.output = []
+        self.open_tags = []
+        # > 0 while inside a tag of DROPPED_CONTENT_TAGS.
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = [(name, value) for name, value in attrs
+                if name in allowed and value is not None and (name not in URL_ATTRIBUTES or _allowed_url(value))]
+        if tag == "a" and self.nofollow:
+            kept.append(("rel", "nofollow noopener"))
+        self.output.append("<%s%s>" % (tag, "".join(' %s="%s"' % (name, escape(value)) for name, value in kept)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # the tags opened inside this one and never closed are closed here.
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.output.append("</%s>" % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(escape(data, quote=False))
+
+    # comments, "<!DOCTYPE>" and processing instructions are dropped (HTMLParser ignores them by default).
+
+    def result(self):
+        self.close()
+        self.output.extend("</%s>" % tag for tag in reversed(self.open_tags))
+        self.open_tags = []
+        return "".join(self.output)
+
+
+def sanitize_html(html, nofollow=False):
+    sanitizer = HtmlSanitizer(nofollow=nofollow)
+    sanitizer.feed(html)
+    return sanitizer.result()
+
+
+# like the "linebreaksbr" filter the templates used before: every new line becomes a "<br>".
+def _linebreaks(text):
+    return normalize_newlines(text).replace("\n", "<br>")
+
+
+# a post body: markdown (when installed; html written in the body passes through it) or the text with its line
+# breaks, then sanitized.
+def render_post_html(body):
+    if markdown is not None:
+        html = markdown.markdown(body, extensions=MARKDOWN_EXTENSIONS)
+    else:
+        html = _linebreaks(body)
+    return sanitize_html(html)
+
+
+# a comment: no markdown, the links get rel="nofollow" (anybody can write a comment).
+def render_comment_html(text):
+    return sanitize_html(_linebreaks(text), nofollow=True)
+
+
+# render the html of the existing posts and comments, 500 rows (by pk) at a time.
+def render_column(model, source, target, render, batch_size=500):
+    last_pk = 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by("pk").only("pk", source)[:batch_size])
+        if not batch:
+            return
+        for row in batch:
+            setattr(row, target, render(getattr(row, source)))
+        model.objects.bulk_update(batch, [target])
+        last_pk = batch[-1].pk
+
+
+def render_existing_html(apps, schema_editor):
+    render_column(apps.get_model("personal_app", "Post"), "body", "body_html", render_post_html)
+    render_column(apps.get_model("personal_app", "Comment"), "text", "text_html", render_comment_html)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_app', '0008_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='text_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(render_existing_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:04
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import ExtractMonth, ExtractYear
+import django.db.models.deletion
+
+
+# fill the archive for the existing published posts (one GROUP BY, then one UPDATE for the newest posts).
+def fill_archive(apps, schema_editor):
+    Post = apps.get_model("personal_app", "Post")
+    ArchiveRollup = apps.get_model("personal_app", "ArchiveRollup")
+    months = (Post.objects.filter(published_date__isnull=False)
+              .annotate(year=ExtractYear("published_date"), month=ExtractMonth("published_date"))
+              .values("author_id", "year", "month")
+              .annotate(post_count=Count("pk"), latest_published_date=Max("published_date"))
+              .order_by())
+    ArchiveRollup.objects.bulk_create([ArchiveRollup(**row) for row in months], batch_size=1000)
+    ArchiveRollup.objects.update(latest_post=Subquery(
+        Post.objects.filter(author=OuterRef("author"), published_date=OuterRef("latest_published_date"))
+        .order_by("-pk").values("pk")[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('personal_app', '0009_rendered_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('latest_published_date', models.DateTimeField(blank=True, null=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('latest_post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='personal_app.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['year', 'month'], name='archive_month_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='archiverollup',
+            constraint=models.UniqueConstraint(fields=('author', 'year', 'month'), name='archive_author_month_unique'),
+        ),
+        migrations.RunPython(fill_archive, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_app', '0011_import_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
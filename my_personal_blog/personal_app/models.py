@@ -1,23 +1,165 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from django.utils import timezone
 from django.urls import reverse
 
+from personal_app.rendering import render_comment_html, render_post_html
+
 # Create your models here.
 
+# sent when comments change through "update()" (which sends no "post_save"), e.g. "Comment.approve()".
+# The receivers in "signals.py" get "post_ids" (the posts whose comments changed) and "approved" (whether approved
+# comments, which everybody can see, were touched).
+comments_changed = Signal()
+
+# sent by "Post.publish()" with "post" (the published post) and "previous_published_date" (None for a first publish).
+# "signals.py" updates the archive ("archive.py") and queues the follow-up work ("jobs.py").
+post_published = Signal()
+
+# A custom queryset keeps the commonly used filters/annotations in one place, so that the views do not repeat them.
+class PostQuerySet(models.QuerySet):
+
+    # the posts which have a published date; the views add the "published_date <= now" part themselves
+    # (the paginators give it as "upper_bound", see "pagination.py").
+    def published(self):
+        return self.filter(published_date__isnull=False)
+
+    # the number of approved comments of every post, counted by the database with a correlated subquery.
+    @staticmethod
+    def approved_comments_subquery():
+        approved_comments = (
+            Comment.objects.filter(post=OuterRef("pk"), approved_comment=True)
+            .order_by()
+            .values("post")
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        return Coalesce(Subquery(approved_comments), 0)
+
+    # "approved_comment_total" is calculated by the database in the same query which loads the posts.
+    # The pages read the stored "approved_comment_count" instead; this one is used to check/repair that counter.
+    def with_comment_counts(self):
+        return self.annotate(approved_comment_total=self.approved_comments_subquery())
+
+    # count the approved comments again and store the result in "approved_comment_count" (one UPDATE statement).
+    def refresh_comment_counts(self):
+        return self.update(approved_comment_count=self.approved_comments_subquery())
+
+
+class CommentQuerySet(models.QuerySet):
+
+    # the comments of "post" which "user" is allowed to see, oldest first.
+    # Everybody sees the approved comments; only the author of the post also sees the comments waiting for approval.
+    def visible_to(self, user, post):
+        comments = self.filter(post=post).order_by("created_date", "pk")
+        if not post.is_written_by(user):
+            comments = comments.filter(approved_comment=True)
+        return comments
+
+    # the comments waiting for approval on all the posts of "user" (the moderation queue).
+    def pending_for(self, user):
+        return self.filter(post__author=user, approved_comment=False)
+
+    # approve all the pending comments of this queryset with one UPDATE statement (only "approved_comment" is written),
+    # then the counters of the touched posts are recounted with one more UPDATE.
+    def approve(self):
+        pending = self.filter(approved_comment=False)
+        post_ids = list(pending.order_by().values_list("post_id", flat=True).distinct())
+        if not post_ids:
+            return 0
+        with transaction.atomic():
+            approved = pending.update(approved_comment=True)
+            Post.objects.filter(pk__in=post_ids).refresh_comment_counts()
+        comments_changed.send(sender=Comment, post_ids=post_ids, approved=True)
+        return approved
+
+    # delete all the pending comments of this queryset with one DELETE statement. Pending comments are not counted
+    # in "approved_comment_count", so the counters do not change. "delete()" sends "comments_changed".
+    def reject(self):
+        rejected, _ = self.filter(approved_comment=False).delete()
+        return rejected
+
+    # a queryset delete (e.g. the "delete selected" action of the admin) does not call "Comment.delete()", so the
+    # counters of the posts which lose approved comments are recounted here, in the same transaction as the DELETE.
+    def delete(self):
+        post_ids = list(self.order_by().values_list("post_id", flat=True).distinct())
+        if not post_ids:
+            return 0, {}
+        approved_post_ids = list(self.filter(approved_comment=True).order_by().values_list("post_id", flat=True)
+                                 .distinct())
+        with transaction.atomic():
+            result = super().delete()
+            if approved_post_ids:
+                Post.objects.filter(pk__in=approved_post_ids).refresh_comment_counts()
+        comments_changed.send(sender=Comment, post_ids=post_ids, approved=bool(approved_post_ids))
+        return result
+
+
 class Post(models.Model):
     # when we give foreign key, remember that the Model name should not be "a string" in the django latest version.
     author = models.ForeignKey(User, on_delete=models.CASCADE)
 
     title = models.CharField(max_length=200)
     body = models.TextField()
+    # the body as sanitized html, rendered by "save()" ("rendering.py"); the pages show this one.
+    body_html = models.TextField(blank=True, default="", editable=False)
     created_date = models.DateTimeField(default=timezone.now)
     published_date = models.DateTimeField(blank=True, null=True)
 
+    # number of approved comments, kept up to date by "Comment.save()", "Comment.approve()", "Comment.delete()" and the
+    # "CommentQuerySet" methods, so the post list does not count the comments for every post on every request.
+    # "repair_comment_counts" recomputes it if needed.
+    # It is not in the forms ("editable=False") and "save()" never writes it: the value in memory may be old.
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    # indexes matching the queries of the views:-
+    # "PostListView" --> published_date <= now (and author = user for the logged in user), ordered by -published_date, -id.
+    # "DraftListView" --> published_date is null and author = user, ordered by -created_date, -id. Only the drafts are
+    # kept in this index ("condition"), so it stays small.
+    # The "id" is the last column because the keyset pagination orders by it to break ties.
+    class Meta:
+        indexes = [
+            models.Index(fields=["published_date", "id"], name="post_published_idx"),
+            models.Index(fields=["author", "published_date", "id"], name="post_author_published_idx"),
+            models.Index(fields=["author", "created_date", "id"], name="post_author_draft_idx",
+                         condition=models.Q(published_date__isnull=True)),
+        ]
+
+    # "bulk_create" does not call "save()", so the code creating posts in bulk calls this itself.
+    def render_html(self):
+        self.body_html = render_post_html(self.body)
+
+    # the html is rendered again only when the body can have changed ("publish()" saves all the fields, so it does).
+    # Saving an existing post writes every field except the comment counter: a post loaded before a comment was
+    # approved would put the old number back. Only the F() updates and "refresh_comment_counts()" change it.
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "body" in update_fields:
+            self.render_html()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "body_html"}
+        if update_fields is None and not self._state.adding and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != "approved_comment_count"]
+        super().save(*args, **kwargs)
+
     # let us keep a button, when the button is hit for "publish", the below function gets executed.
+    # The archive is updated by the "refresh_archive" job, queued by a receiver of "post_published" with the post.
     def publish(self):
+        previous_published_date = self.published_date
         self.published_date = timezone.now()
-        self.save()
+        with transaction.atomic():
+            self.save()
+            post_published.send(sender=Post, post=self, previous_published_date=previous_published_date)
+
+    # "user" can be the "AnonymousUser" also; it has no primary key.
+    def is_written_by(self, user):
+        return user.is_authenticated and self.author_id == user.pk
 
     # the below function will return only the approved comments as a list.
     # This function gives "a list of all approved comments" for a particular "post/blog".
@@ -50,16 +192,93 @@ class Comment(models.Model):
     # Note:- Database shows only the IDs as described above. But django provides the full object for the ORM purpose.
     
     # when we mention the model name in foreign key, we should not make it "a string" in the latest django versions.
-    post = models.ForeignKey(Post, related_name= "comments", on_delete=models.CASCADE)
+    # "db_index=False" because the "comment_post_created_idx" index below starts with "post" and covers the same lookups.
+    post = models.ForeignKey(Post, related_name= "comments", on_delete=models.CASCADE, db_index=False)
     author = models.CharField(max_length=200)
     text = models.TextField()
+    # the text as sanitized html, rendered by "save()" like "Post.body_html".
+    text_html = models.TextField(blank=True, default="", editable=False)
     created_date = models.DateTimeField(default=timezone.now)
     approved_comment = models.BooleanField(default=False)
 
+    objects = CommentQuerySet.as_manager()
+
+    # comments are always looked up by post, oldest first (the comments of a post, the comment counts).
+    # The approved comments get their own partial index: SQLite filters "approved_comment" as a plain expression,
+    # not as "= value", so a column of the index can not be used for it, but the condition of a partial index can.
+    # The pending comments (the moderation queue) also have a small partial index, so the queue never reads the
+    # approved comments of the author's posts.
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "created_date", "id"], name="comment_post_created_idx"),
+            models.Index(fields=["post", "created_date", "id"], name="comment_post_approved_idx",
+                         condition=models.Q(approved_comment=True)),
+            models.Index(fields=["post", "created_date", "id"], name="comment_pending_idx",
+                         condition=models.Q(approved_comment=False)),
+        ]
+
+    def render_html(self):
+        self.text_html = render_comment_html(self.text)
+
+    # the counters follow "approved_comment" and "post" also when they are changed by a plain "save()" (e.g. the
+    # admin form): the stored row is read again inside the transaction, an approved comment which is
+    # not stored yet (or was not approved) adds 1 to its post, and a stored approved comment which is not approved
+    # anymore (or moved to another post) takes 1 from its old post.
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "text" in update_fields:
+            self.render_html()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "text_html"}
+        adding = self._state.adding
+        with transaction.atomic():
+            stored = None
+            if not adding:
+                stored = Comment.objects.select_for_update().filter(pk=self.pk).values_list(
+                    "post_id", "approved_comment").first()
+            old = stored or (None, False)
+            super().save(*args, **kwargs)
+            if stored is not None and update_fields is not None:
+                # the fields which are not saved keep their stored value.
+                new = (self.post_id if {"post", "post_id"} & set(update_fields) else stored[0],
+                       self.approved_comment if "approved_comment" in update_fields else stored[1])
+            else:
+                new = (self.post_id, self.approved_comment)
+            changed = old != new and (old[1] or new[1])
+            if changed:
+                if old[1]:
+                    Post.objects.filter(pk=old[0]).update(approved_comment_count=F("approved_comment_count") - 1)
+                if new[1]:
+                    Post.objects.filter(pk=new[0]).update(approved_comment_count=F("approved_comment_count") + 1)
+        # an unapproved (or moved) comment is not purged by the "post_save" receiver (it only looks at the new value).
+        if changed and not adding:
+            post_ids = {post_id for post_id in (old[0], new[0]) if post_id is not None}
+            comments_changed.send(sender=Comment, post_ids=list(post_ids), approved=True)
+
     # we keep a button for the approval, whenever the button is hit, this below function will be called. So, "approved_comment" will become "True".
+    # The UPDATE only matches while the comment is not approved yet, so if two workers approve the same comment at
+    # the same time only one of them changes a row and only that one adds 1 to the counter of the post.
     def approve(self):
+        with transaction.atomic():
+            approved = Comment.objects.filter(pk=self.pk, approved_comment=False).update(approved_comment=True)
+            if approved:
+                Post.objects.filter(pk=self.post_id).update(approved_comment_count=F("approved_comment_count") + 1)
         self.approved_comment = True
-        self.save()
+        if approved:
+            comments_changed.send(sender=Comment, post_ids=[self.post_id], approved=True)
+
+    # the approval is taken back with the same kind of conditional UPDATE before the row is deleted, so the counter
+    # goes down exactly once even if the comment was approved by another worker after we loaded it.
+    # There is no "post_delete" receiver for comments: with one, django could not delete a queryset of comments
+    # (e.g. "reject()", or the comments of a deleted post) with a single DELETE statement. "comments_changed" is sent instead.
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            unapproved = Comment.objects.filter(pk=self.pk, approved_comment=True).update(approved_comment=False)
+            if unapproved:
+                Post.objects.filter(pk=self.post_id).update(approved_comment_count=F("approved_comment_count") - 1)
+            result = super().delete(*args, **kwargs)
+        comments_changed.send(sender=Comment, post_ids=[self.post_id], approved=bool(unapproved))
+        return result
 
     # writing the function "get_absolute_url" to redirect the response to other page.
     def get_absolute_url(self):
@@ -68,3 +287,101 @@ class Comment(models.Model):
     # string representation of the object. Text content of the comment will be shown here.
     def __str__(self):
         return self.text
+
+
+# A job is a piece of follow-up work which runs outside of the request, in the "run_jobs" worker (see "jobs.py").
+# "name" chooses the handler and "payload" holds its keyword arguments. The row is saved in the same transaction
+# as the change which needs it, so a job is never lost, and never runs for a change which was rolled back.
+class Job(models.Model):
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_date = models.DateTimeField(default=timezone.now)
+    # the job is not run before "run_at"; a failed job is retried later by moving "run_at" forward.
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # the worker running the job, and until when the other workers must leave it alone (if that worker dies,
+    # the job is picked up again after "locked_until").
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    # the workers look for the jobs which are due, oldest first.
+    class Meta:
+        indexes = [
+            models.Index(fields=["run_at", "id"], name="job_run_at_idx"),
+        ]
+
+    def __str__(self):
+        return "%s %s" % (self.name, self.payload)
+
+
+# the jobs which failed "max_attempts" times. They are kept (with the last error) until somebody looks at them.
+class DeadLetterJob(models.Model):
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_date = models.DateTimeField()
+    failed_date = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField()
+    last_error = models.TextField(blank=True)
+
+    # put the job back in the queue, e.g. after the bug which made it fail is fixed.
+    def requeue(self):
+        with transaction.atomic():
+            job = Job.objects.create(name=self.name, payload=self.payload, created_date=self.created_date)
+            self.delete()
+        return job
+
+    def __str__(self):
+        return "%s %s" % (self.name, self.payload)
+
+
+# The archive pages ("archive.py") read this table instead of grouping the posts by month every time:
+# one row per (author, year, month) with the number of published posts and the newest of them.
+# It is kept up to date when a post is published or deleted ("signals.py"); "rebuild_archive" recomputes all of it.
+class ArchiveRollup(models.Model):
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    post_count = models.PositiveIntegerField(default=0)
+    latest_post = models.ForeignKey(Post, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    latest_published_date = models.DateTimeField(null=True, blank=True)
+
+    # the unique constraint also serves the author page (author first); the month index serves the month pages.
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["author", "year", "month"], name="archive_author_month_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["year", "month"], name="archive_month_idx"),
+        ]
+
+    def __str__(self):
+        return "%s %04d-%02d: %s posts" % (self.author_id, self.year, self.month, self.post_count)
+
+
+# One import of an export file ("import_blog"), found again by the "export_id" written in the file, so an import
+# which stopped (crash, ctrl-c) continues after "line", the last line of the last committed batch.
+class ImportRun(models.Model):
+    export_id = models.CharField(max_length=64, unique=True)
+    source = models.CharField(max_length=500)
+    line = models.PositiveBigIntegerField(default=0)
+    started_date = models.DateTimeField(default=timezone.now)
+    finished_date = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s (line %s)" % (self.source, self.line)
+
+
+# primary key in the export file --> primary key given by this database, for the users and the posts of an import
+# which is not finished; the posts/comments imported later point to the new keys. Deleted when the import finishes.
+class ImportMapping(models.Model):
+    run = models.ForeignKey(ImportRun, on_delete=models.CASCADE, related_name="mappings")
+    model = models.CharField(max_length=20)
+    old_id = models.BigIntegerField()
+    new_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["run", "model", "old_id"], name="import_mapping_unique"),
+        ]
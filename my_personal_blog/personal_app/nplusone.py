@@ -0,0 +1,123 @@
+import logging
+import re
+import sys
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+# N+1 query detector:-
+# An "N+1" is the same query run once per row of a list, e.g. "{{ post.comments.count }}" inside a "{% for %}" loop.
+# Every query is reduced to its "shape" (the SQL with the values and the lists of values taken out); when one shape
+# is run "threshold" times within one request (or one "with detect_nplusone():" block), the detector raises
+# "NPlusOneError" or logs a warning, naming the template line and the line of our code which ran the query.
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = str(Path(__file__).resolve().parent)
+# the middlewares wrap every request, they are never the interesting line.
+SKIPPED_FILES = {str(Path(APP_DIR) / name) for name in ("nplusone.py", "middleware.py")}
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+VALUE_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def query_shape(sql):
+    sql = STRING_LITERAL.sub("?", sql)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    return VALUE_LIST.sub("(...)", sql)
+
+
+# where the query comes from: the innermost template node being rendered ("name.html:12") and the innermost line of
+# our own code ("views.py:80 in get_context_data").
+def query_origin():
+    template, code = None, None
+    frame = sys._getframe(1)
+    while frame is not None and (template is None or code is None):
+        if template is None and frame.f_code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            origin, token = getattr(node, "origin", None), getattr(node, "token", None)
+            if origin is not None and token is not None:
+                template = "%s:%s" % (origin.template_name or origin.name, token.lineno)
+        filename = frame.f_code.co_filename
+        if code is None and filename.startswith(APP_DIR) and filename not in SKIPPED_FILES:
+            code = "%s:%s in %s" % (Path(filename).relative_to(APP_DIR), frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return template, code
+
+
+class QueryShapeCounter:
+    def __init__(self, threshold, action, label=""):
+        self.threshold = threshold
+        self.action = action
+        self.label = label
+        self.counts = {}
+        # one entry per shape which crossed the threshold: (shape, template line, code line).
+        self.offenders = []
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = query_shape(sql)
+        count = self.counts.get(shape, 0) + 1
+        self.counts[shape] = count
+        if count == self.threshold:
+            self.report(shape)
+        return execute(sql, params, many, context)
+
+    def report(self, shape):
+        template, code = query_origin()
+        self.offenders.append((shape, template, code))
+        message = "N+1 queries%s: %s identical queries from template %s, code %s: %s" % (
+            " in %s" % self.label if self.label else "", self.threshold, template or "-", code or "-", shape)
+        if self.action == "raise":
+            raise NPlusOneError(message)
+        logger.warning(message)
+
+
+# count the query shapes of every database connection inside the block.
+@contextmanager
+def detect_nplusone(threshold=None, action="raise", label=""):
+    counter = QueryShapeCounter(threshold or settings.BLOG_NPLUSONE_THRESHOLD, action, label)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+# runs every request inside "detect_nplusone", with "settings.BLOG_NPLUSONE" ("raise" or "log"; "off" removes it).
+# Like "RequestMetricsMiddleware" it can be called as a coroutine, so it does not push the async views into a thread.
+class NPlusOneMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.BLOG_NPLUSONE not in ("raise", "log"):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with detect_nplusone(action=settings.BLOG_NPLUSONE, label=request.path):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # the queries of an async request run in its "sync_to_async" thread, with the connections of that thread:
+        # the detector is started and stopped there.
+        stack = ExitStack()
+        await sync_to_async(stack.enter_context)(detect_nplusone(action=settings.BLOG_NPLUSONE, label=request.path))
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
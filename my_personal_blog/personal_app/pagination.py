@@ -0,0 +1,162 @@
+import base64
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+# Keyset (cursor) pagination:-
+# Instead of "OFFSET n" (the database reads and throws away n rows), we remember the last row of the page we showed
+# and ask for the rows that come after it: "WHERE (published_date, id) < (last_date, last_id) ORDER BY ... LIMIT n".
+# With an index on (published_date, id) every page costs the same, the 1st page and the 10000th page.
+# The "pk" is always added as the second key, so rows having the same date are never skipped or repeated.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    # "upper_bound" limits the rows to "field <= upper_bound" (e.g. only the posts published up to now).
+    # It is given to the paginator instead of being filtered in the queryset because SQLite uses only the first
+    # "field <= ?" term of the WHERE clause for the index range, so the paginator has to emit the tighter one itself.
+    def __init__(self, queryset, field, per_page, descending=True, upper_bound=None):
+        self.queryset = queryset
+        self.field = field
+        self.per_page = per_page
+        self.descending = descending
+        self.upper_bound = upper_bound
+
+    # cursor is "<value>|<pk>" encoded with urlsafe base64, so that it can be put in the url as it is.
+    # "obj" is a model instance, or a dictionary when the queryset uses ".values()" (it must contain the field and "id").
+    def encode_cursor(self, obj):
+        if isinstance(obj, dict):
+            value, pk = obj[self.field], obj[self.queryset.model._meta.pk.attname]
+        else:
+            value, pk = getattr(obj, self.field), obj.pk
+        value = value.isoformat() if hasattr(value, "isoformat") else str(value)
+        raw = "%s|%s" % (value, pk)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            value, pk = raw.rsplit("|", 1)
+            model_meta = self.queryset.model._meta
+            value = model_meta.get_field(self.field).to_python(value)
+            pk = model_meta.pk.to_python(pk)
+        except (ValueError, UnicodeDecodeError, ValidationError):
+            raise InvalidCursor("Invalid cursor: %r" % cursor)
+        if value is None:
+            raise InvalidCursor("Invalid cursor: %r" % cursor)
+        return value, pk
+
+    # the queryset of one page: the range on "field" first (so the index range scan uses it), then the tie breaker on "pk".
+    def _page_queryset(self, cursor=None, forward=True):
+        older = self.descending == forward
+        lower, upper = None, self.upper_bound
+        tie_breaker = Q()
+        if cursor is not None:
+            value, pk = cursor
+            lookup = "lt" if older else "gt"
+            tie_breaker = Q(**{"%s__%s" % (self.field, lookup): value}) | Q(**{self.field: value, "pk__%s" % lookup: pk})
+            if older:
+                upper = value if upper is None else min(upper, value)
+            else:
+                lower = value
+
+        range_filter = {}
+        if lower is not None:
+            range_filter[self.field + "__gte"] = lower
+        if upper is not None:
+            range_filter[self.field + "__lte"] = upper
+        queryset = self.queryset.filter(**range_filter).filter(tie_breaker)
+
+        if older:
+            return queryset.order_by("-" + self.field, "-pk")
+        return queryset.order_by(self.field, "pk")
+
+    # the (sliced) queryset of the page asked for, and whether it reads the rows backwards.
+    def _page_slice(self, after=None, before=None):
+        if before:
+            # we read the previous page backwards and then reverse it, one extra row tells us whether there is more.
+            return self._page_queryset(self.decode_cursor(before), forward=False)[:self.per_page + 1], True
+        cursor = self.decode_cursor(after) if after else None
+        return self._page_queryset(cursor, forward=True)[:self.per_page + 1], False
+
+    def _make_page(self, rows, backwards, after=None):
+        has_more = len(rows) > self.per_page
+        if backwards:
+            rows = rows[:self.per_page][::-1]
+            has_next, has_previous = True, has_more
+        else:
+            rows = rows[:self.per_page]
+            has_next, has_previous = has_more, bool(after)
+
+        if not rows:
+            return KeysetPage([])
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_next else None,
+            previous_cursor=self.encode_cursor(rows[0]) if has_previous else None,
+        )
+
+    def page(self, after=None, before=None):
+        queryset, backwards = self._page_slice(after, before)
+        return self._make_page(list(queryset), backwards, after)
+
+    # the same page for the async views, the rows are read with the async ORM ("async for").
+    async def apage(self, after=None, before=None):
+        queryset, backwards = self._page_slice(after, before)
+        return self._make_page([row async for row in queryset], backwards, after)
+
+
+# Mixin for the "ListView" classes. The "after"/"before" GET parameters carry the cursors.
+# It replaces the "object_list" in the context with the rows of the current page and adds "page_obj".
+class KeysetPaginationMixin:
+    keyset_field = None
+    keyset_page_size = 10
+    keyset_descending = True
+
+    def get_keyset_upper_bound(self):
+        return None
+
+    def paginate_keyset(self, queryset):
+        paginator = KeysetPaginator(queryset, self.keyset_field, self.keyset_page_size,
+                                    descending=self.keyset_descending, upper_bound=self.get_keyset_upper_bound())
+        try:
+            return paginator.page(after=self.request.GET.get("after"), before=self.request.GET.get("before"))
+        except InvalidCursor:
+            raise Http404("Invalid page.")
+
+    def get_context_data(self, **kwargs):
+        page = self.paginate_keyset(self.object_list)
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context["page_obj"] = page
+        context["is_paginated"] = page.has_other_pages
+        return context
@@ -0,0 +1,151 @@
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.utils.text import normalize_newlines
+
+try:
+    import markdown
+except ImportError:  # optional: "pip install markdown" turns on markdown for the post bodies.
+    markdown = None
+
+
+# Html of the post bodies and of the comments, rendered once when they are saved ("Post.save()", "Comment.save()")
+# and stored in "body_html"/"text_html", so the pages only print the stored column.
+# The bodies (written with the medium editor, or in markdown) and the comments (written by anybody) can contain html;
+# only the tags and attributes listed below are kept, everything else is escaped or dropped ("sanitize_html").
+
+ALLOWED_TAGS = {
+    "a", "abbr", "b", "blockquote", "br", "code", "del", "div", "em", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i",
+    "img", "li", "ol", "p", "pre", "s", "span", "strong", "sub", "sup", "table", "tbody", "td", "th", "thead", "tr",
+    "u", "ul",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "abbr": {"title"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+}
+URL_ATTRIBUTES = {"href", "src"}
+URL_SCHEMES = {"", "http", "https", "mailto"}
+# the tags which can not have content ("<br>", not "<br></br>").
+VOID_TAGS = {"br", "hr", "img"}
+# the tags whose content is dropped with them (not shown as text).
+DROPPED_CONTENT_TAGS = {"script", "style", "template", "iframe", "object", "embed", "noscript", "textarea"}
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables", "sane_lists", "nl2br"]
+
+
+def _allowed_url(value):
+    # the browsers ignore the spaces and the control characters inside a scheme ("java\tscript:").
+    cleaned = "".join(character for character in value if character > " ")
+    try:
+        return urlsplit(cleaned).scheme.lower() in URL_SCHEMES
+    except ValueError:
+        return False
+
+
+class HtmlSanitizer(HTMLParser):
+
+    def __init__(self, nofollow=False):
+        super().__init__(convert_charrefs=True)
+        self.nofollow = nofollow
+        self.output = []
+        self.open_tags = []
+        # > 0 while inside a tag of DROPPED_CONTENT_TAGS.
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = [(name, value) for name, value in attrs
+                if name in allowed and value is not None and (name not in URL_ATTRIBUTES or _allowed_url(value))]
+        if tag == "a" and self.nofollow:
+            kept.append(("rel", "nofollow noopener"))
+        self.output.append("<%s%s>" % (tag, "".join(' %s="%s"' % (name, escape(value)) for name, value in kept)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # the tags opened inside this one and never closed are closed here.
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.output.append("</%s>" % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(escape(data, quote=False))
+
+    # comments, "<!DOCTYPE>" and processing instructions are dropped (HTMLParser ignores them by default).
+
+    def result(self):
+        self.close()
+        self.output.extend("</%s>" % tag for tag in reversed(self.open_tags))
+        self.open_tags = []
+        return "".join(self.output)
+
+
+def sanitize_html(html, nofollow=False):
+    sanitizer = HtmlSanitizer(nofollow=nofollow)
+    sanitizer.feed(html)
+    return sanitizer.result()
+
+
+# like the "linebreaksbr" filter the templates used before: every new line becomes a "<br>".
+def _linebreaks(text):
+    return normalize_newlines(text).replace("\n", "<br>")
+
+
+# a post body: markdown (when installed; html written in the body passes through it) or the text with its line
+# breaks, then sanitized.
+def render_post_html(body):
+    if markdown is not None:
+        html = markdown.markdown(body, extensions=MARKDOWN_EXTENSIONS)
+    else:
+        html = _linebreaks(body)
+    return sanitize_html(html)
+
+
+# a comment: no markdown, the links get rel="nofollow" (anybody can write a comment).
+def render_comment_html(text):
+    return sanitize_html(_linebreaks(text), nofollow=True)
+
+
+# render "source" into "target" for the rows of "queryset" in batches of "batch_size" (ordered by pk), writing only
+# the rows whose html changed with one "bulk_update" per batch. Used by the "render_html" command.
+# Returns the number of rows written.
+def render_html_columns(queryset, source, target, render, batch_size=500):
+    written, last_pk = 0, None
+    while True:
+        batch = queryset.order_by("pk").only("pk", source, target)
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return written
+        changed = []
+        for row in batch:
+            html = render(getattr(row, source))
+            if html != getattr(row, target):
+                setattr(row, target, html)
+                changed.append(row)
+        queryset.model._default_manager.bulk_update(changed, [target])
+        written += len(changed)
+        last_pk = batch[-1].pk
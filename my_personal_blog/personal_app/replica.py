@@ -0,0 +1,105 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+
+# Read replica routing:-
+# "ReplicaRoutingMiddleware" decides for every request which database its reads go to, and keeps it in a context
+# variable (one per request, also under ASGI) which "ReadReplicaRouter" reads:
+#   - GET/HEAD requests of the views in "settings.BLOG_REPLICA_VIEWS" read from the "replica" database,
+#   - unless the browser wrote something in the last "BLOG_REPLICA_PIN_SECONDS" ("pin" cookie), then they read
+#     from "default", which already has the change ("read your writes"),
+#   - all the other requests, and every write, use "default".
+# Outside of a request (management commands, the job worker) nothing changes: everything uses "default".
+
+REPLICA_ALIAS = "replica"
+PIN_COOKIE = "blog_primary"
+
+# {"alias": where the reads of the request go, "wrote": the request wrote to the database}, None outside a request.
+_routing = ContextVar("blog_database_routing", default=None)
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is not None and state["alias"] in settings.DATABASES:
+            return state["alias"]
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state["wrote"] = True
+        return "default"
+
+    # an object read from the replica is the same row as in "default", so the relations between them are fine.
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    # the replica is a copy of "default" ("replicate_sqlite"), it is never migrated on its own.
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+class ReplicaRoutingMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.BLOG_READ_REPLICA:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = {"alias": "default", "wrote": False}
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        if state["wrote"]:
+            response.set_signed_cookie(PIN_COOKIE, "1", max_age=settings.BLOG_REPLICA_PIN_SECONDS, httponly=True,
+                                       samesite="Lax")
+        if response.streaming:
+            # a streamed response (the feeds) reads the database after this middleware returned.
+            response.streaming_content = routed(response.streaming_content, state)
+        return response
+
+    # "request.resolver_match" is known from here on; the session and the user are read lazily, after this.
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _routing.get()
+        if (request.method in ("GET", "HEAD") and request.resolver_match.view_name in settings.BLOG_REPLICA_VIEWS
+                and not self.pinned(request)):
+            state["alias"] = REPLICA_ALIAS
+        request.read_database = state["alias"]
+        return None
+
+    def pinned(self, request):
+        try:
+            request.get_signed_cookie(PIN_COOKIE, max_age=settings.BLOG_REPLICA_PIN_SECONDS)
+        except (KeyError, signing.BadSignature):
+            return False
+        return True
+
+
+# the reads of the current request go to the replica, which can be behind "default". What they return must not be
+# stored under the current version stamps (fragment cache, page cache, ETags): the old content would be served as
+# the new one until the next change.
+def reads_from_replica():
+    state = _routing.get()
+    return state is not None and state["alias"] == REPLICA_ALIAS and REPLICA_ALIAS in settings.DATABASES
+
+
+# every chunk is produced with the routing of the request which made the response.
+def routed(content, state):
+    iterator = iter(content)
+    while True:
+        token = _routing.set(state)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _routing.reset(token)
+        yield chunk
@@ -0,0 +1,221 @@
+import re
+
+from django.db import connection as default_connection, connections, router, transaction
+from django.db.models import Q
+from django.db.utils import OperationalError
+from django.utils import timezone
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from personal_app.models import Post
+
+
+# Full text search over the title and the body of the published posts.
+# On SQLite we use an FTS5 virtual table ("external content" table: it keeps only the index, the text stays in
+# "personal_app_post"). The triggers below keep it in sync with every INSERT/UPDATE/DELETE on the post table,
+# including "bulk_create" and "update()" which send no django signals.
+# On the other databases (or when SQLite is built without FTS5) we fall back to "icontains" filters.
+
+FTS_TABLE = "personal_app_post_fts"
+POST_TABLE = "personal_app_post"
+SEARCH_RESULTS_LIMIT = 50
+
+# characters which never appear in a post, used to find the matches in the snippets before escaping them.
+MATCH_START, MATCH_END = "\x02", "\x03"
+
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+    "title, body, content='{post}', content_rowid='id', tokenize='porter unicode61')"
+)
+# every trigger with the row it looks at ("new"/"old"); "{when}" is empty, except during "rebuild_search_index".
+TRIGGERS_SQL = [
+    ("new", """CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {post}{when} BEGIN
+        INSERT INTO {fts}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END"""),
+    ("old", """CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {post}{when} BEGIN
+        INSERT INTO {fts}({fts}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END"""),
+    ("old", """CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF title, body ON {post}{when} BEGIN
+        INSERT INTO {fts}({fts}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO {fts}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END"""),
+]
+DROP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS {fts}_ai",
+    "DROP TRIGGER IF EXISTS {fts}_ad",
+    "DROP TRIGGER IF EXISTS {fts}_au",
+]
+DROP_SQL = DROP_TRIGGERS_SQL + [
+    "DROP TABLE IF EXISTS {fts}_rebuild",
+    "DROP TABLE IF EXISTS {fts}",
+]
+# during a rebuild, the id of the last post indexed again; the triggers only touch the posts up to it.
+REBUILD_TABLE_SQL = "CREATE TABLE IF NOT EXISTS {fts}_rebuild (last_id INTEGER NOT NULL)"
+REBUILD_WHEN_SQL = " WHEN {row}.id <= (SELECT last_id FROM {fts}_rebuild)"
+
+
+def _sql(statement, **values):
+    return statement.format(fts=FTS_TABLE, post=POST_TABLE, **values)
+
+
+def _create_triggers(cursor, during_rebuild=False):
+    for row, statement in TRIGGERS_SQL:
+        cursor.execute(_sql(statement, when=_sql(REBUILD_WHEN_SQL, row=row) if during_rebuild else ""))
+
+
+def fts_available(connection=default_connection):
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        return FTS_TABLE in connection.introspection.table_names(cursor)
+
+
+# create the FTS table (if FTS5 is compiled in) and its triggers. It returns False when FTS5 can not be used.
+def install_search_index(connection=default_connection):
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(_sql(CREATE_TABLE_SQL))
+        except OperationalError:
+            # SQLite without the FTS5 extension, the "icontains" fallback will be used.
+            return False
+        _create_triggers(cursor)
+    return True
+
+
+def drop_search_index(connection=default_connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(_sql(statement))
+
+
+# index all the existing posts again, "batch_size" posts (by id) per transaction, so a big table does not keep the
+# other writers waiting for the whole rebuild. It yields the number of posts indexed so far after every batch.
+# The posts saved by other processes meanwhile must not be indexed twice (by their trigger and by their batch) or
+# taken out of the index before they are in it, which would corrupt an external content index. So while it runs, the
+# triggers only look at the posts already indexed again (id <= "last_id" of the "_rebuild" table); the other posts
+# are indexed by their batch, with their text as it is then. The last transaction puts the normal triggers back.
+# (If it is stopped in the middle, the index stays partial, and running it again repairs it.)
+def rebuild_search_index(batch_size=1000, connection=default_connection):
+    install_search_index(connection)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(_sql(REBUILD_TABLE_SQL))
+        cursor.execute(_sql("DELETE FROM {fts}_rebuild"))
+        cursor.execute(_sql("INSERT INTO {fts}_rebuild (last_id) VALUES (0)"))
+        for statement in DROP_TRIGGERS_SQL:
+            cursor.execute(_sql(statement))
+        _create_triggers(cursor, during_rebuild=True)
+        cursor.execute(_sql("INSERT INTO {fts}({fts}) VALUES ('delete-all')"))
+    last_id, indexed = 0, 0
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # the INSERT comes first: from there on this transaction holds the write lock, nobody changes the batch.
+            cursor.execute(_sql("INSERT INTO {fts}(rowid, title, body) "
+                                "SELECT id, title, body FROM {post} WHERE id > %s ORDER BY id LIMIT %s"),
+                           [last_id, batch_size])
+            cursor.execute(_sql("SELECT MAX(id), COUNT(*) FROM (SELECT id FROM {post} WHERE id > %s ORDER BY id LIMIT %s)"),
+                           [last_id, batch_size])
+            batch_last_id, count = cursor.fetchone()
+            if not count:
+                # every post is indexed: the normal triggers again, in the same transaction as this last check.
+                for statement in DROP_TRIGGERS_SQL:
+                    cursor.execute(_sql(statement))
+                _create_triggers(cursor)
+                cursor.execute(_sql("DROP TABLE {fts}_rebuild"))
+                break
+            cursor.execute(_sql("UPDATE {fts}_rebuild SET last_id = %s"), [batch_last_id])
+        last_id = batch_last_id
+        indexed += count
+        yield indexed
+    with connection.cursor() as cursor:
+        cursor.execute(_sql("INSERT INTO {fts}({fts}) VALUES ('optimize')"))
+
+
+# the FTS5 "integrity-check" command fails with "database disk image is malformed" when the index does not match
+# the posts (rank 1: it is compared with the content table too).
+def check_search_index(connection=default_connection):
+    with connection.cursor() as cursor:
+        cursor.execute(_sql("INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)"))
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query or "")
+
+
+# "django cach" --> '"django" "cach"*' ; every term is quoted so that the user can not use the FTS5 query syntax,
+# and the last term is a prefix, so the results already show up while the user is typing.
+def fts_query(terms):
+    quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+# the text is escaped and the matches (between MATCH_START and MATCH_END) are wrapped in <mark> tags.
+def highlight(text):
+    text = escape(strip_tags(text))
+    return mark_safe(text.replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
+
+
+class SearchResult:
+    def __init__(self, post, title_html, snippet_html, rank=None):
+        self.post = post
+        self.title_html = title_html
+        self.snippet_html = snippet_html
+        self.rank = rank
+
+
+# the raw FTS queries go to the database the router chooses for reading posts (the replica for the search page, see
+# "replica.py"), the same one which "in_bulk" then loads the posts from.
+def search_posts(query, limit=SEARCH_RESULTS_LIMIT):
+    terms = search_terms(query)
+    if not terms:
+        return []
+    connection = connections[router.db_for_read(Post)]
+    if fts_available(connection):
+        return _fts_search(terms, limit, connection)
+    return _fallback_search(terms, limit)
+
+
+# best matches first ("bm25", a match in the title counts 10 times more than in the body).
+def _fts_search(terms, limit, connection):
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(_sql(
+            "SELECT p.id, bm25({fts}, 10.0, 1.0) AS rank, "
+            "highlight({fts}, 0, %s, %s), snippet({fts}, 1, %s, %s, '...', 24) "
+            "FROM {fts} JOIN {post} p ON p.id = {fts}.rowid "
+            "WHERE {fts} MATCH %s AND p.published_date <= %s "
+            "ORDER BY rank LIMIT %s"
+        ), [MATCH_START, MATCH_END, MATCH_START, MATCH_END, fts_query(terms), now, limit])
+        rows = cursor.fetchall()
+    posts = Post.objects.using(connection.alias).select_related("author").in_bulk([row[0] for row in rows])
+    return [SearchResult(posts[post_id], highlight(title), highlight(snippet), rank)
+            for post_id, rank, title, snippet in rows if post_id in posts]
+
+
+def _fallback_search(terms, limit):
+    matches = Q()
+    for term in terms:
+        matches &= Q(title__icontains=term) | Q(body__icontains=term)
+    posts = (Post.objects.select_related("author")
+             .filter(matches, published_date__lte=timezone.now())
+             .order_by("-published_date", "-pk")[:limit])
+    return [SearchResult(post, _mark_terms(post.title, terms), _mark_terms(_snippet(post.body, terms), terms))
+            for post in posts]
+
+
+def _snippet(text, terms, width=160):
+    text = strip_tags(text)
+    positions = [text.lower().find(term.lower()) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions, default=0) - width // 4)
+    snippet = text[start:start + width]
+    return ("..." if start else "") + snippet + ("..." if start + width < len(text) else "")
+
+
+def _mark_terms(text, terms):
+    pattern = re.compile("(%s)" % "|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    return highlight(pattern.sub(MATCH_START + r"\1" + MATCH_END, text))
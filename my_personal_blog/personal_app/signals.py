@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from personal_app.auth import forget_user
+from personal_app.database import configure_connection
+from personal_app.fragments import invalidate_post
+from personal_app.jobs import enqueue
+from personal_app.middleware import purge_pages
+from personal_app.models import Comment, Post, comments_changed, post_published
+from personal_app.search import fts_available, install_search_index
+
+
+# "Post.publish()" and "Comment.approve()" call "save()", so they also send "post_save".
+# The anonymous page cache is purged only for the changes which the anonymous readers can see:
+# published posts and approved comments. Drafts and new (pending) comments do not touch it.
+
+
+@receiver([post_save, post_delete], sender=Post)
+def post_changed(sender, instance, **kwargs):
+    invalidate_post(instance.pk)
+    if instance.published_date is not None:
+        purge_pages()
+
+
+# comment deletes are announced with "comments_changed" (see "Comment.delete()").
+# a new comment also queues its follow-up work ("tasks.py"), so "add_comment_to_post" returns right away. It only
+# warms the fragment cache, so "enqueue()" skips it when that cache is private to each process ("jobs.py").
+@receiver(post_save, sender=Comment)
+def comment_changed(sender, instance, created=False, **kwargs):
+    invalidate_post(instance.post_id)
+    if instance.approved_comment:
+        purge_pages()
+    if created:
+        enqueue("comment_created", comment_id=instance.pk)
+
+
+@receiver(post_published)
+def post_was_published(sender, post, **kwargs):
+    enqueue("post_published", post_id=post.pk)
+
+
+# the archive months of the post are counted again by the "refresh_archive" job ("tasks.py"), so the request does
+# not wait for the COUNT queries: the new month, and the old one when a published post is published again.
+def queue_archive_refresh(author_id, *published_dates):
+    dates = [date.isoformat() for date in published_dates if date is not None]
+    if dates:
+        enqueue("refresh_archive", author_id=author_id, published_dates=dates)
+
+
+@receiver(post_published)
+def update_archive_on_publish(sender, post, previous_published_date=None, **kwargs):
+    queue_archive_refresh(post.author_id, previous_published_date, post.published_date)
+
+
+# also sent for the posts deleted together (a queryset, the posts of a deleted user).
+@receiver(post_delete, sender=Post)
+def update_archive_on_delete(sender, instance, **kwargs):
+    queue_archive_refresh(instance.author_id, instance.published_date)
+
+
+@receiver(comments_changed)
+def comments_updated(sender, post_ids, approved, **kwargs):
+    for post_id in post_ids:
+        invalidate_post(post_id)
+    if approved:
+        purge_pages()
+
+
+# On SQLite, django changes some columns by creating a new table and dropping the old one, which also drops the
+# triggers of the search index. After every "migrate" we create them again (they are "IF NOT EXISTS").
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == "personal_app" and fts_available(connections[using]):
+        install_search_index(connections[using])
+
+
+# the SQLite settings (WAL, busy timeout, cache...) of every new database connection, see "database.py".
+@receiver(connection_created)
+def configure_new_connection(sender, connection, **kwargs):
+    configure_connection(connection)
+
+
+# the cached user of the sessions ("auth.py") is dropped whenever it changes, and at logout.
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def user_logged_out_of_session(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
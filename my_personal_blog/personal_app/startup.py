@@ -0,0 +1,155 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+# Cold start of a worker process ("profile_startup" command and "StartupTests"):-
+# a new python process imports "wsgi.py" or "asgi.py" (the settings, the apps, the admin modules) and answers one
+# request (the first request also imports the urls, the views and the forms). We get back how long the imports and
+# the first response took, the import time of every module, and which modules we do not want in a web worker were
+# loaded anyway.
+# "python -X importtime" does not see the modules django imports with "importlib.import_module" (the settings, the
+# urls, the admin modules...), so the new process times the imports itself ("ImportTimer").
+# Only the standard library is imported at the top of this file: the new process measures its own imports.
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# the modules of the project whose import time is reported.
+STARTUP_MODULES = ["my_personal_blog.settings", "my_personal_blog.urls", "personal_app.views", "personal_app.forms",
+                   "personal_app.admin"]
+# the modules a web worker never needs: the GUI toolkit, the test client and the benchmark helpers.
+UNWANTED_MODULES = ["tkinter", "django.test", "personal_app.benchmarks"]
+
+
+# A finder which finds nothing itself: it asks the other finders of "sys.meta_path" and wraps the loader they return,
+# to time the code of the module (its "exec_module", with the imports it makes).
+class ImportTimer:
+
+    def __init__(self):
+        # module --> {"self_ms": without the modules it imported, "cumulative_ms": with them}
+        self.times = {}
+        # the modules being imported: [name, start, time spent in the modules they imported]
+        self.stack = []
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, "exec_module"):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def start(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def stop(self):
+        name, started, children = self.stack.pop()
+        cumulative = time.perf_counter() - started
+        if self.stack:
+            self.stack[-1][2] += cumulative
+        self.times[name] = {"self_ms": (cumulative - children) * 1000, "cumulative_ms": cumulative * 1000}
+
+
+class TimedLoader:
+
+    def __init__(self, loader, timer):
+        self.loader = loader
+        self.timer = timer
+
+    def exec_module(self, module):
+        self.timer.start(module.__name__)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.stop()
+
+    # everything else ("create_module", "get_resource_reader"...) is the real loader's.
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+# start a new process which imports "entry" ("wsgi" or "asgi") and requests "path"; "environment" is added to the
+# environment variables of the process (e.g. {"BLOG_DB_PATH": ...}).
+def cold_start(entry="wsgi", path="/", environment=None):
+    if entry not in ("wsgi", "asgi"):
+        raise ValueError("entry must be 'wsgi' or 'asgi', not %r." % entry)
+    env = dict(os.environ, **(environment or {}))
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-m", "personal_app.startup", entry, path],
+                             cwd=PROJECT_DIR, env=env, capture_output=True, text=True)
+    process_ms = (time.perf_counter() - started) * 1000
+    if process.returncode != 0:
+        raise RuntimeError("The %s cold start failed:\n%s" % (entry, process.stderr[-3000:]))
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    imports = result.pop("imports")
+    result.update(
+        entry=entry,
+        process_ms=process_ms,
+        cold_start_ms=result["import_ms"] + result["first_response_ms"],
+        modules={name: imports[name]["cumulative_ms"] for name in STARTUP_MODULES if name in imports},
+        slowest=sorted(((name, times["self_ms"]) for name, times in imports.items()),
+                       key=lambda item: item[1], reverse=True),
+    )
+    return result
+
+
+def _host():
+    from django.conf import settings
+    return next((host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"), "localhost")
+
+
+def _wsgi_request(application, path):
+    from wsgiref.util import setup_testing_defaults
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "HTTP_HOST": _host()}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b"".join(response)
+    finally:
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+def _asgi_request(application, path):
+    import asyncio
+    host = _host()
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"host", host.encode())], "client": ("127.0.0.1", 0), "server": (host, 80)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return messages[0]["status"]
+
+
+# what the new process runs ("python -m personal_app.startup wsgi /"): one json line on stdout.
+def main(entry, path):
+    timer = ImportTimer()
+    sys.meta_path.insert(0, timer)
+    started = time.perf_counter()
+    application = importlib.import_module("my_personal_blog.%s" % entry).application
+    imported = time.perf_counter()
+    status = (_wsgi_request if entry == "wsgi" else _asgi_request)(application, path)
+    answered = time.perf_counter()
+    sys.meta_path.remove(timer)
+    print(json.dumps({"status": status, "import_ms": (imported - started) * 1000,
+                      "first_response_ms": (answered - imported) * 1000, "imports": timer.times,
+                      "unwanted": [name for name in UNWANTED_MODULES if name in sys.modules]}))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+from personal_app.assets import compress_file, minify_css
+
+
+# "collectstatic" with this storage (see STORAGES in settings.py):-
+# 1. the css files which are not minified yet ("*.min.css" are) are minified in STATIC_ROOT,
+# 2. ManifestStaticFilesStorage adds the md5 of the content to every file name, fixes the "url()"s inside the css and
+#    writes the "staticfiles.json" manifest which "{% static %}" reads,
+# 3. a gzip (and brotli) copy is written next to every hashed file, for "serve_static" (or nginx "gzip_static").
+class BlogStaticFilesStorage(ManifestStaticFilesStorage):
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            for name in paths:
+                if name.endswith(".css") and not name.endswith(".min.css"):
+                    path = Path(self.path(name))
+                    path.write_text(minify_css(path.read_text(encoding="utf-8")), encoding="utf-8")
+                    # the hashed copy is made from the file given here: the minified one, not the source file.
+                    paths[name] = (self, name)
+
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run=dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if not dry_run:
+            for hashed_name in sorted(hashed_names):
+                compress_file(self.path(hashed_name))
+
+    # a file which was never collected (while developing, in the tests) keeps its plain name instead of raising.
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
@@ -0,0 +1,48 @@
+from django.contrib.auth.models import AnonymousUser
+from django.utils.dateparse import parse_datetime
+
+from personal_app.archive import refresh_post_archive
+from personal_app.fragments import FRAGMENT_CACHE_ALIAS, get_or_render
+from personal_app.jobs import register
+from personal_app.middleware import purge_pages
+from personal_app.models import Comment, Post
+from personal_app.views import comment_paginator, render_comment_list, render_post_body
+
+
+# The handlers of the background jobs ("jobs.py"). They are queued by the receivers in "signals.py", so the
+# request which published the post / added the comment does not wait for them.
+# "refresh_archive" updates the database; the others only warm the fragment cache, so they are queued only when that
+# cache is shared by the web workers.
+
+
+# render the fragments of the detail page ahead of time, so the first reader after a change gets a cache hit.
+def warm_post_fragments(post_id):
+    post_object = Post.objects.select_related("author").filter(pk=post_id).first()
+    if post_object is None:
+        return
+    get_or_render(post_id, "body", "all", lambda: render_post_body(post_object))
+    readers = {"public": AnonymousUser(), "owner": post_object.author}
+    for variant, reader in readers.items():
+        get_or_render(post_id, "comments", variant,
+                      lambda: render_comment_list(post_object, comment_paginator(reader, post_object).page()))
+
+
+@register("post_published", cache=FRAGMENT_CACHE_ALIAS)
+def post_published(post_id):
+    warm_post_fragments(post_id)
+
+
+# the comment may be gone already (rejected by the author before the job ran).
+@register("comment_created", cache=FRAGMENT_CACHE_ALIAS)
+def comment_created(comment_id):
+    post_id = Comment.objects.filter(pk=comment_id).values_list("post_id", flat=True).first()
+    if post_id is not None:
+        warm_post_fragments(post_id)
+
+
+# the months are counted again from the posts as they are when the job runs, so running it twice does no harm.
+# The archive pages cached before are purged.
+@register("refresh_archive")
+def refresh_archive(author_id, published_dates):
+    refresh_post_archive(author_id, *[parse_datetime(date) for date in published_dates])
+    purge_pages()
@@ -0,0 +1,31 @@
+from functools import lru_cache
+
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from personal_app.assets import VENDOR_ASSETS, vendor_path
+
+
+register = template.Library()
+
+
+# the file is looked up once per process; "build_assets" is run before the server starts.
+@lru_cache(maxsize=None)
+def vendored(name):
+    return vendor_path(name).is_file()
+
+
+# "{% vendor_asset 'bootstrap_css' %}" --> the <link>/<script> tag of a vendor asset ("assets.py"): our own copy when
+# "build_assets" downloaded it, the CDN (with its integrity hash when we know it) until then.
+@register.simple_tag
+def vendor_asset(name):
+    asset = VENDOR_ASSETS[name]
+    if vendored(name):
+        url, integrity = static(asset["path"]), None
+    else:
+        url, integrity = asset["url"], asset.get("integrity")
+    extra = format_html(' integrity="{}" crossorigin="anonymous"', integrity) if integrity else ""
+    if asset["path"].endswith(".js"):
+        return format_html('<script src="{}"{}></script>', url, extra)
+    return format_html('<link rel="stylesheet" href="{}"{}>', url, extra)
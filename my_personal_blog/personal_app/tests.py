@@ -1,3 +1,1863 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Count, F, Q, QuerySet
+from django.http import Http404, HttpResponse
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from personal_app import async_views, metrics, rendering, transfer, urls as personal_urls
+from personal_app.archive import rebuild_archive
+from personal_app.assets import VENDOR_ASSETS, minify_css, parse_accept_encoding
+from personal_app.auth import user_cache
+from personal_app.async_views import AsyncAboutView, AsyncPostDetailView, AsyncPostListView
+from personal_app.database import configure_connection, copy_sqlite_database, current_pragmas
+from personal_app.fragments import fragment_cache, fragment_stats, get_or_render, invalidate_post
+from personal_app.jobs import JOB_HANDLERS, claim_jobs, enqueue, run_pending
+from personal_app.middleware import PAGE_CACHE_ALIAS, SITE_STATE_KEY, RequestMetricsMiddleware, purge_pages
+from personal_app.models import ArchiveRollup, Post, Comment, DeadLetterJob, ImportMapping, ImportRun, Job
+from personal_app.nplusone import NPlusOneError, NPlusOneMiddleware, detect_nplusone, query_shape
+from personal_app.pagination import KeysetPaginator
+from personal_app.rendering import render_comment_html, render_post_html, sanitize_html
+from personal_app.replica import PIN_COOKIE, REPLICA_ALIAS, ReadReplicaRouter
+from personal_app.search import check_search_index, fts_available, rebuild_search_index, search_posts
+from personal_app.startup import STARTUP_MODULES, cold_start
+from personal_app.templatetags.vendor_assets import vendor_asset
+from personal_app.transfer import export_blog, import_blog
+from personal_app.views import COMMENT_PAGE_SIZE, ModerationView
 
 # Create your tests here.
+
+
+# the database is rolled back after every test (and the primary keys are reused), so the caches are cleared too.
+class BlogTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for cache in caches.all():
+            cache.clear()
+
+
+# The caches of "shared_caches" are file caches (shared by the worker processes, like BLOG_CACHE_BACKEND=file) for
+# the tests of the class; the other ones stay "locmem".
+class SharedCacheMixin:
+    shared_caches = []
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_directory = tempfile.TemporaryDirectory()
+        cls.shared_cache_settings = override_settings(CACHES=dict(settings.CACHES, **{
+            alias: {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": os.path.join(cls.cache_directory.name, alias)}
+            for alias in cls.shared_caches}))
+        cls.shared_cache_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.shared_cache_settings.disable()
+        cls.cache_directory.cleanup()
+
+
+# small helpers to create the rows needed by the tests.
+def make_post(author, title="Post", published=True, **kwargs):
+    published_date = timezone.now() - timedelta(minutes=1) if published else None
+    return Post.objects.create(author=author, title=title, body="Body of " + title,
+                               published_date=published_date, **kwargs)
+
+
+def make_comments(post, approved=0, pending=0):
+    comments = [Comment(post=post, author="reader", text="approved", approved_comment=True) for _ in range(approved)]
+    comments += [Comment(post=post, author="reader", text="pending") for _ in range(pending)]
+    for comment in comments:
+        comment.render_html()
+    Comment.objects.bulk_create(comments)
+    # "bulk_create" does not go through "Comment.approve()", so the stored counter is recomputed.
+    Post.objects.filter(pk=post.pk).refresh_comment_counts()
+
+
+# The list and detail pages should run a fixed number of queries, no matter how many posts/comments exist.
+class QueryCountTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+
+    def create_posts(self, count):
+        for number in range(count):
+            post = make_post(self.author, title="Post %s" % number)
+            make_comments(post, approved=2, pending=1)
+        return post
+
+    def test_post_list_query_count_is_constant(self):
+        self.create_posts(2)
+        with self.assertNumQueries(1):
+            small_response = self.client.get(reverse("personal_app:post_list"))
+
+        self.create_posts(20)
+        with self.assertNumQueries(1):
+            large_response = self.client.get(reverse("personal_app:post_list"))
+
+        self.assertEqual(len(small_response.context["list_of_post_objects"]), 2)
+        self.assertEqual(len(large_response.context["list_of_post_objects"]), 10)
+        self.assertContains(large_response, "Comments: 2")
+
+    def test_post_list_counts_only_approved_comments(self):
+        post = make_post(self.author)
+        make_comments(post, approved=0, pending=3)
+        response = self.client.get(reverse("personal_app:post_list"))
+        self.assertContains(response, "No Approved Comments")
+
+    def test_post_detail_query_count_is_constant(self):
+        post = self.create_posts(1)
+        with self.assertNumQueries(2):
+            self.client.get(reverse("personal_app:post_detail", kwargs={"pk": post.pk}))
+
+        make_comments(post, approved=30, pending=30)
+        # "bulk_create" sends no signals, so we throw the cached fragments away ourselves.
+        invalidate_post(post.pk)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("personal_app:post_detail", kwargs={"pk": post.pk}))
+        self.assertContains(response, "author: author")
+
+
+class KeysetPaginationTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        now = timezone.now()
+        # 25 posts, the last 5 have the same published date so the "pk" has to break the tie.
+        for number in range(25):
+            Post.objects.create(author=cls.author, title="Post %02d" % number, body="body",
+                                published_date=now - timedelta(hours=min(number, 20)))
+
+    def titles(self, response, key="list_of_post_objects"):
+        return [post.title for post in response.context[key]]
+
+    def test_walks_forward_and_backward_without_gaps(self):
+        url = reverse("personal_app:post_list")
+        first = self.client.get(url)
+        self.assertFalse(first.context["page_obj"].has_previous)
+        second = self.client.get(url, {"after": first.context["page_obj"].next_cursor})
+        third = self.client.get(url, {"after": second.context["page_obj"].next_cursor})
+        self.assertFalse(third.context["page_obj"].has_next)
+
+        seen = self.titles(first) + self.titles(second) + self.titles(third)
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+        back = self.client.get(url, {"before": third.context["page_obj"].previous_cursor})
+        self.assertEqual(self.titles(back), self.titles(second))
+        back = self.client.get(url, {"before": back.context["page_obj"].previous_cursor})
+        self.assertEqual(self.titles(back), self.titles(first))
+        self.assertFalse(back.context["page_obj"].has_previous)
+
+    def test_pages_never_use_offset(self):
+        url = reverse("personal_app:post_list")
+        first = self.client.get(url)
+        with self.assertNumQueries(1) as queries:
+            self.client.get(url, {"after": first.context["page_obj"].next_cursor})
+        self.assertNotIn("OFFSET", queries.captured_queries[0]["sql"])
+
+    def test_posts_published_in_the_future_are_not_listed(self):
+        future = Post.objects.create(author=self.author, title="Future", body="body",
+                                     published_date=timezone.now() + timedelta(days=1))
+        url = reverse("personal_app:post_list")
+        self.assertNotContains(self.client.get(url), "Future")
+        # even a cursor pointing after the future post must not leak it.
+        cursor = KeysetPaginator(Post.objects.all(), "published_date", 10).encode_cursor(future)
+        self.assertNotContains(self.client.get(url, {"before": cursor}), "Future")
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse("personal_app:post_list"), {"after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_draft_list_is_paginated(self):
+        for number in range(12):
+            make_post(self.author, title="Draft %s" % number, published=False)
+        self.client.force_login(self.author)
+        url = reverse("personal_app:draft_list")
+        first = self.client.get(url)
+        second = self.client.get(url, {"after": first.context["page_obj"].next_cursor})
+        drafts = self.titles(first, "list_of_draft_objects") + self.titles(second, "list_of_draft_objects")
+        self.assertEqual(sorted(drafts), sorted("Draft %s" % number for number in range(12)))
+        self.assertContains(first, "?after=")
+
+
+# "EXPLAIN QUERY PLAN" of every query a view runs on our tables; "SCAN" means SQLite reads the whole table/index
+# and "TEMP B-TREE" means it sorts the rows itself, both of them should not happen on our access paths.
+class IndexUsageTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        for number in range(3):
+            make_comments(make_post(cls.author, title="Post %s" % number), approved=2, pending=1)
+        cls.draft = make_post(cls.author, title="Draft", published=False)
+
+    def query_plans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        for query in context.captured_queries:
+            if "personal_app_" not in query["sql"]:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plans.append([row[-1] for row in cursor.fetchall()])
+        self.assertTrue(plans)
+        return plans
+
+    def assertUsesIndexes(self, url, index_name=None):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN output is SQLite specific.")
+        plans = self.query_plans(url)
+        for plan in plans:
+            for step in plan:
+                self.assertFalse(step.startswith("SCAN personal_app_"), plan)
+                self.assertNotIn("TEMP B-TREE", step, plan)
+        if index_name:
+            self.assertTrue(any(index_name in step for plan in plans for step in plan), plans)
+
+    def test_public_feed_uses_published_index(self):
+        self.assertUsesIndexes(reverse("personal_app:post_list"), "post_published_idx")
+
+    def test_next_page_uses_published_index_range(self):
+        first = self.client.get(reverse("personal_app:post_list"))
+        cursor = KeysetPaginator(Post.objects.all(), "published_date", 1).encode_cursor(first.context["page_obj"].object_list[0])
+        self.assertUsesIndexes(reverse("personal_app:post_list") + "?after=" + cursor, "post_published_idx")
+
+    def test_author_feed_uses_author_index(self):
+        self.client.force_login(self.author)
+        self.assertUsesIndexes(reverse("personal_app:post_list"), "post_author_published_idx")
+
+    def test_draft_list_uses_partial_index(self):
+        self.client.force_login(self.author)
+        self.assertUsesIndexes(reverse("personal_app:draft_list"), "post_author_draft_idx")
+
+    # the recount of "approved_comment_count" ("repair_comment_counts").
+    def test_comment_counts_use_comment_index(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN output is SQLite specific.")
+        sql, params = Post.objects.with_comment_counts().filter(pk=self.draft.pk).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(any("comment_post_approved_idx" in step for step in plan), plan)
+
+    def test_post_detail_uses_indexes(self):
+        post = Post.objects.exclude(pk=self.draft.pk).first()
+        self.assertUsesIndexes(reverse("personal_app:post_detail", kwargs={"pk": post.pk}), "comment_post_approved_idx")
+
+    def test_comment_pages_use_indexes(self):
+        post = Post.objects.exclude(pk=self.draft.pk).first()
+        cursor = KeysetPaginator(Comment.objects.all(), "created_date", 1).encode_cursor(post.comments.first())
+        url = reverse("personal_app:comment_list", kwargs={"pk": post.pk}) + "?after=" + cursor
+        self.assertUsesIndexes(url, "comment_post_approved_idx")
+        self.client.force_login(self.author)
+        self.assertUsesIndexes(url, "comment_post_created_idx")
+
+
+class PostDetailCommentTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.reader = User.objects.create_user(username="reader", password="secret-pass-123")
+        cls.post = make_post(cls.author)
+        Comment.objects.create(post=cls.post, author="first", text="Approved one", approved_comment=True)
+        Comment.objects.create(post=cls.post, author="second", text="Waiting one")
+        Comment.objects.create(post=cls.post, author="third", text="Approved two", approved_comment=True)
+
+    def get_detail(self):
+        return self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+
+    def test_anonymous_reader_sees_only_approved_comments_in_order(self):
+        response = self.get_detail()
+        comments = response.context["comment_page"]
+        self.assertEqual([comment.text for comment in comments], ["Approved one", "Approved two"])
+        self.assertNotContains(response, "Waiting one")
+        self.assertNotContains(response, "Approve Comment")
+
+    def test_other_users_do_not_see_pending_comments(self):
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.get_detail(), "Waiting one")
+
+    def test_post_author_sees_pending_comments_with_moderation_links(self):
+        self.client.force_login(self.author)
+        response = self.get_detail()
+        comments = response.context["comment_page"]
+        self.assertEqual([comment.text for comment in comments], ["Approved one", "Waiting one", "Approved two"])
+        self.assertContains(response, "Approve Comment", count=1)
+
+    def test_pending_comments_are_not_loaded_for_anonymous_readers(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get_detail()
+        comment_queries = [query["sql"] for query in context.captured_queries if "personal_app_comment" in query["sql"]]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertIn('"approved_comment"', comment_queries[0].split("WHERE", 1)[1])
+
+
+class CommentPagesTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.post = make_post(cls.author)
+        start = timezone.now() - timedelta(days=1)
+        comments = [
+            Comment(post=cls.post, author="reader", text="Comment %02d" % number, approved_comment=True,
+                    created_date=start + timedelta(minutes=number))
+            for number in range(45)
+        ] + [Comment(post=cls.post, author="reader", text="Pending comment")]
+        for comment in comments:
+            comment.render_html()
+        Comment.objects.bulk_create(comments)
+
+    def test_detail_page_renders_only_the_first_page(self):
+        response = self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+        self.assertEqual(len(response.context["comment_page"]), COMMENT_PAGE_SIZE)
+        self.assertContains(response, "Comment 00")
+        self.assertNotContains(response, "Comment %02d" % COMMENT_PAGE_SIZE)
+        self.assertContains(response, "Load more comments")
+
+    def test_fragment_pages_continue_where_the_detail_page_stopped(self):
+        response = self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+        texts = [comment.text for comment in response.context["comment_page"]]
+        cursor = response.context["comment_page"].next_cursor
+        url = reverse("personal_app:comment_list", kwargs={"pk": self.post.pk})
+        while cursor:
+            with self.assertNumQueries(2):
+                fragment = self.client.get(url, {"after": cursor})
+            self.assertNotContains(fragment, "<html")
+            texts += [comment.text for comment in fragment.context["comment_page"]]
+            cursor = fragment.context["comment_page"].next_cursor
+        self.assertEqual(texts, ["Comment %02d" % number for number in range(45)])
+
+    def test_json_pages(self):
+        url = reverse("personal_app:comment_list", kwargs={"pk": self.post.pk})
+        data = self.client.get(url, {"format": "json"}).json()
+        self.assertEqual(len(data["comments"]), COMMENT_PAGE_SIZE)
+        self.assertEqual(data["comments"][0]["text"], "Comment 00")
+        data = self.client.get(data["next"]).json()
+        self.assertEqual(data["comments"][0]["text"], "Comment %02d" % COMMENT_PAGE_SIZE)
+        data = self.client.get(data["next"]).json()
+        self.assertIsNone(data["next"])
+        self.assertNotIn("Pending comment", [comment["text"] for comment in data["comments"]])
+
+    def test_missing_post_and_bad_cursor_return_404(self):
+        self.assertEqual(self.client.get(reverse("personal_app:comment_list", kwargs={"pk": 999})).status_code, 404)
+        url = reverse("personal_app:comment_list", kwargs={"pk": self.post.pk})
+        self.assertEqual(self.client.get(url, {"after": "bad"}).status_code, 404)
+
+
+class FragmentCacheTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.staff = User.objects.create_user(username="staff", password="secret-pass-123", is_staff=True)
+        cls.post = make_post(cls.author, title="Cached")
+
+    def get_detail(self):
+        return self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+
+    def test_second_request_is_served_from_the_cache(self):
+        self.get_detail()
+        with self.assertNumQueries(1):
+            response = self.get_detail()
+        self.assertContains(response, "Body of Cached")
+        self.assertEqual(fragment_stats()["hits"], 2)
+        self.assertEqual(fragment_stats()["misses"], 2)
+
+    def test_new_and_approved_comments_invalidate_the_fragments(self):
+        self.get_detail()
+        self.client.post(reverse("personal_app:add_comment", kwargs={"pk": self.post.pk}),
+                         {"author": "reader", "text": "Fresh comment"})
+        self.assertNotContains(self.get_detail(), "Fresh comment")
+
+        self.client.force_login(self.author)
+        self.assertContains(self.get_detail(), "Fresh comment")
+        comment = self.post.comments.get()
+        self.client.get(reverse("personal_app:approve_comment", kwargs={"pk": comment.pk}))
+        self.client.logout()
+        self.assertContains(self.get_detail(), "Fresh comment")
+
+        self.client.force_login(self.author)
+        self.client.get(reverse("personal_app:remove_comment", kwargs={"pk": comment.pk}))
+        self.assertNotContains(self.get_detail(), "Fresh comment")
+
+    def test_post_update_and_publish_invalidate_the_fragments(self):
+        self.get_detail()
+        self.post.body = "Changed body"
+        self.post.save()
+        self.assertContains(self.get_detail(), "Changed body")
+
+        draft = make_post(self.author, title="Draft", published=False)
+        self.client.get(reverse("personal_app:post_detail", kwargs={"pk": draft.pk}))
+        self.client.force_login(self.author)
+        version = caches["fragments"].get("post-version:%s" % draft.pk)
+        self.client.get(reverse("personal_app:publish_post", kwargs={"pk": draft.pk}))
+        self.assertNotEqual(caches["fragments"].get("post-version:%s" % draft.pk), version)
+
+    def test_cache_stats_are_staff_only(self):
+        url = reverse("personal_app:cache_stats")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        self.get_detail()
+        self.assertEqual(self.client.get(url).json()["fragments"]["misses"], 2)
+
+
+class AnonymousPageCacheTests(SharedCacheMixin, BlogTestCase):
+    shared_caches = ["pages", "fragments"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.post = make_post(cls.author, title="Cached post")
+
+    def test_anonymous_pages_are_served_from_the_cache(self):
+        url = reverse("personal_app:post_list")
+        first = self.client.get(url)
+        self.assertTrue(first.has_header("ETag"))
+        self.assertTrue(first.has_header("Last-Modified"))
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_conditional_get_returns_304(self):
+        url = reverse("personal_app:about")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        last_modified = self.client.get(url)["Last-Modified"]
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_logged_in_users_and_other_pages_are_not_cached(self):
+        self.client.force_login(self.author)
+        self.assertFalse(self.client.get(reverse("personal_app:post_list")).has_header("ETag"))
+        self.client.logout()
+        self.assertFalse(self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk})).has_header("ETag"))
+        self.assertFalse(self.client.get(reverse("personal_app:register")).has_header("ETag"))
+
+    def test_publishing_and_moderation_purge_the_cache(self):
+        url = reverse("personal_app:post_list")
+        etag = self.client.get(url)["ETag"]
+
+        draft = make_post(self.author, title="Brand new post", published=False)
+        comment = Comment.objects.create(post=self.post, author="reader", text="Nice")
+        # a draft and a pending comment are not visible to anonymous readers, the cached page stays.
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_login(self.author)
+        self.client.get(reverse("personal_app:publish_post", kwargs={"pk": draft.pk}))
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Brand new post")
+        etag = response["ETag"]
+
+        self.client.force_login(self.author)
+        self.client.get(reverse("personal_app:approve_comment", kwargs={"pk": comment.pk}))
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Comments: 1")
+        etag = response["ETag"]
+
+        self.client.force_login(self.author)
+        self.client.get(reverse("personal_app:remove_comment", kwargs={"pk": comment.pk}))
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "No Approved Comments")
+        etag = response["ETag"]
+
+        self.client.force_login(self.author)
+        self.client.post(reverse("personal_app:post_delete", kwargs={"pk": draft.pk}))
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotContains(response, "Brand new post")
+
+    # a scheduled post becomes visible without any purge: the state expires at that moment.
+    def test_the_state_expires_when_a_scheduled_post_shows_up(self):
+        cache = caches[PAGE_CACHE_ALIAS]
+        with mock.patch.object(cache, "set", wraps=cache.set) as stored:
+            scheduled = Post.objects.create(author=self.author, title="Scheduled", body="Later",
+                                            published_date=timezone.now() + timedelta(seconds=30))
+            Post.objects.filter(pk=scheduled.pk).update(published_date=None)
+            purge_pages()
+        timeouts = [call.args[2] for call in stored.call_args_list if call.args[0] == SITE_STATE_KEY]
+        self.assertEqual(len(timeouts), 2)
+        self.assertTrue(0 < timeouts[0] <= 30)
+        self.assertEqual(timeouts[1], settings.PAGE_STATE_TIMEOUT)
+
+    # with "locmem" every worker would have its own state, never purged by the others.
+    def test_no_page_cache_nor_etags_without_a_shared_cache(self):
+        local_caches = {alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": alias}
+                        for alias in settings.CACHES}
+        urls = [reverse("personal_app:post_list"), reverse("personal_app:api_post_list"),
+                reverse("personal_app:api_post_detail", kwargs={"pk": self.post.pk}),
+                reverse("personal_app:post_feed", kwargs={"feed_format": "rss"})]
+        with self.settings(CACHES=local_caches):
+            for url in urls:
+                with self.subTest(url=url):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotIn("ETag", response)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(urls[0])
+            self.assertTrue(queries.captured_queries)
+
+
+class SearchTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.in_title = make_post(cls.author, title="Caching with Django")
+        cls.in_body = Post.objects.create(author=cls.author, title="Performance notes",
+                                          body="Some <b>words</b> about caching pages.",
+                                          published_date=timezone.now() - timedelta(hours=1))
+        cls.draft = Post.objects.create(author=cls.author, title="Secret caching draft", body="caching")
+
+    def search(self, query):
+        return self.client.get(reverse("personal_app:search"), {"q": query})
+
+    def test_ranked_results_with_highlighted_snippets(self):
+        response = self.search("caching")
+        posts = [result.post for result in response.context["results"]]
+        self.assertEqual(posts, [self.in_title, self.in_body])
+        self.assertContains(response, "<mark>Caching</mark> with Django", html=False)
+        # the html of the body is not rendered in the snippet.
+        self.assertNotContains(response, "<b>words</b>")
+
+    def test_drafts_and_unknown_words_are_not_found(self):
+        self.assertNotContains(self.search("secret"), "Secret caching draft")
+        self.assertContains(self.search("nonexistentword"), "No posts match your search.")
+
+    def test_query_syntax_is_not_interpreted(self):
+        response = self.search('caching" OR body:* NEAR(')
+        self.assertEqual(response.status_code, 200)
+
+    def test_prefix_of_the_last_word_matches(self):
+        posts = [result.post for result in self.search("djan").context["results"]]
+        self.assertEqual(posts, [self.in_title])
+
+    def test_index_follows_updates_and_deletes(self):
+        if not fts_available():
+            self.skipTest("SQLite FTS5 is not available.")
+        self.in_body.title = "Renamed about databases"
+        self.in_body.save()
+        self.assertEqual([result.post for result in self.search("databases").context["results"]], [self.in_body])
+        self.in_title.delete()
+        self.assertEqual([result.post for result in self.search("django").context["results"]], [])
+
+    def test_fallback_without_fts(self):
+        with mock.patch("personal_app.search.fts_available", return_value=False):
+            response = self.search("caching")
+        self.assertEqual({result.post for result in response.context["results"]}, {self.in_title, self.in_body})
+        self.assertContains(response, "<mark>Caching</mark> with Django", html=False)
+
+    def test_rebuild_command(self):
+        if not fts_available():
+            self.skipTest("SQLite FTS5 is not available.")
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO personal_app_post_fts(personal_app_post_fts) VALUES ('delete-all')")
+        self.assertEqual(list(search_posts("caching")), [])
+        output = StringIO()
+        call_command("rebuild_search_index", batch_size=2, stdout=output)
+        self.assertIn("indexed 2 posts", output.getvalue())
+        self.assertIn("Search index rebuilt (3 posts)", output.getvalue())
+        self.assertEqual([result.post for result in search_posts("caching")], [self.in_title, self.in_body])
+        check_search_index()
+
+    # an index which already has the posts is emptied first, not filled twice.
+    def test_rebuild_of_an_up_to_date_index(self):
+        if not fts_available():
+            self.skipTest("SQLite FTS5 is not available.")
+        list(rebuild_search_index())
+        list(rebuild_search_index(batch_size=1))
+        check_search_index()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM personal_app_post_fts WHERE personal_app_post_fts MATCH 'caching'")
+            self.assertEqual(sorted(row[0] for row in cursor.fetchall()), sorted([self.in_title.pk, self.in_body.pk, self.draft.pk]))
+
+    # the posts written between two batches: the ones already indexed go through the triggers, the others are
+    # indexed by their batch; none of them is indexed twice or taken out before being indexed.
+    def test_writes_during_a_rebuild(self):
+        if not fts_available():
+            self.skipTest("SQLite FTS5 is not available.")
+        batches = rebuild_search_index(batch_size=1)
+        self.assertEqual(next(batches), 1)
+        Post.objects.filter(pk=self.in_title.pk).update(title="Caching with Django, edited")
+        Post.objects.filter(pk=self.in_body.pk).update(body="Nothing about that anymore.")
+        self.draft.delete()
+        new_post = make_post(self.author, title="Caching again")
+        self.assertEqual(list(batches), [2, 3])
+        check_search_index()
+        self.assertEqual({result.post for result in search_posts("caching")}, {self.in_title, new_post})
+        self.assertEqual([result.post for result in search_posts("edited")], [self.in_title])
+
+        # the normal triggers are back.
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name LIKE 'personal_app_post_fts_%%'")
+            self.assertFalse(any("WHEN" in sql for sql, in cursor.fetchall()))
+        Post.objects.filter(pk=new_post.pk).update(title="Renamed")
+        check_search_index()
+        self.assertEqual([result.post for result in search_posts("renamed")], [new_post])
+
+
+class ApprovedCommentCounterTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.post = make_post(cls.author)
+
+    def assertCounterIsExact(self, expected):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.approved_comment_count, expected)
+        self.assertEqual(self.post.approved_comment_count, self.post.approve_comments().count())
+
+    def test_approve_and_delete_keep_the_counter(self):
+        first = Comment.objects.create(post=self.post, author="reader", text="one")
+        second = Comment.objects.create(post=self.post, author="reader", text="two")
+        self.assertCounterIsExact(0)
+        first.approve()
+        second.approve()
+        self.assertCounterIsExact(2)
+        first.delete()
+        self.assertCounterIsExact(1)
+        Comment.objects.create(post=self.post, author="reader", text="pending").delete()
+        self.assertCounterIsExact(1)
+
+    # two workers holding their own copy of the same comment, one after the other (or at the same time).
+    def test_double_approval_counts_once(self):
+        comment = Comment.objects.create(post=self.post, author="reader", text="one")
+        worker_one = Comment.objects.get(pk=comment.pk)
+        worker_two = Comment.objects.get(pk=comment.pk)
+        worker_one.approve()
+        worker_two.approve()
+        self.assertCounterIsExact(1)
+
+    def test_delete_of_a_stale_copy_after_approval(self):
+        comment = Comment.objects.create(post=self.post, author="reader", text="one")
+        stale = Comment.objects.get(pk=comment.pk)
+        comment.approve()
+        # "stale" still says "not approved", the row is approved; the counter must still go down.
+        stale.delete()
+        self.assertCounterIsExact(0)
+
+    def test_double_delete_counts_once(self):
+        comment = Comment.objects.create(post=self.post, author="reader", text="one")
+        comment.approve()
+        worker_one = Comment.objects.get(pk=comment.pk)
+        worker_two = Comment.objects.get(pk=comment.pk)
+        worker_one.delete()
+        worker_two.delete()
+        self.assertCounterIsExact(0)
+
+    def test_approve_after_delete_does_not_count(self):
+        comment = Comment.objects.create(post=self.post, author="reader", text="one")
+        stale = Comment.objects.get(pk=comment.pk)
+        comment.delete()
+        stale.approve()
+        self.assertCounterIsExact(0)
+
+    def test_views_keep_the_counter(self):
+        comments = [Comment.objects.create(post=self.post, author="reader", text=str(number)) for number in range(3)]
+        self.client.force_login(self.author)
+        for comment in comments:
+            self.client.get(reverse("personal_app:approve_comment", kwargs={"pk": comment.pk}))
+        self.client.get(reverse("personal_app:remove_comment", kwargs={"pk": comments[0].pk}))
+        self.assertCounterIsExact(2)
+        self.client.logout()
+        self.assertContains(self.client.get(reverse("personal_app:post_list")), "Comments: 2")
+
+    def test_creating_an_approved_comment_counts(self):
+        Comment.objects.create(post=self.post, author="reader", text="one", approved_comment=True)
+        Comment.objects.create(post=self.post, author="reader", text="two")
+        self.assertCounterIsExact(1)
+
+    # a plain "save()" which changes "approved_comment" (the admin form does it), and one which does not.
+    def test_save_of_a_changed_approval_counts(self):
+        comment = Comment.objects.create(post=self.post, author="reader", text="one")
+        comment.approved_comment = True
+        comment.save()
+        self.assertCounterIsExact(1)
+        comment.text = "edited"
+        comment.save()
+        comment.save(update_fields=["text"])
+        self.assertCounterIsExact(1)
+        comment.approved_comment = False
+        comment.save(update_fields=["approved_comment"])
+        self.assertCounterIsExact(0)
+
+    def test_admin_form_keeps_the_counter(self):
+        comment = Comment.objects.create(post=self.post, author="reader", text="one", approved_comment=True)
+        admin = User.objects.create_superuser(username="admin", password="secret-pass-123")
+        self.client.force_login(admin)
+        url = reverse("admin:personal_app_comment_change", args=[comment.pk])
+        data = {"post": self.post.pk, "author": "reader", "text": "one", "created_date_0": "2024-01-01",
+                "created_date_1": "10:00:00"}
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertCounterIsExact(0)
+        self.client.post(url, dict(data, approved_comment="on"))
+        self.assertCounterIsExact(1)
+
+        # the "delete selected" action deletes a queryset.
+        make_comments(self.post, approved=2, pending=1)
+        response = self.client.post(reverse("admin:personal_app_comment_changelist"), {
+            "action": "delete_selected", "post": "yes",
+            "_selected_action": list(Comment.objects.values_list("pk", flat=True)[:2])})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertCounterIsExact(self.post.approve_comments().count())
+
+    # a copy of the post loaded before the approval is saved ("publish()", the edit form): the counter stays.
+    def test_saving_a_stale_post_keeps_the_counter(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, author="reader", text="one").approve()
+        stale.publish()
+        self.assertCounterIsExact(1)
+        stale.title = "Edited"
+        stale.save()
+        self.assertCounterIsExact(1)
+        self.assertFalse(Post._meta.get_field("approved_comment_count").editable)
+
+    def test_moving_a_comment_moves_the_count(self):
+        other = make_post(self.author, title="Other")
+        comment = Comment.objects.create(post=self.post, author="reader", text="one", approved_comment=True)
+        pending = Comment.objects.create(post=self.post, author="reader", text="two")
+        comment.post = other
+        comment.save()
+        pending.post = other
+        pending.save(update_fields=["post"])
+        self.assertCounterIsExact(0)
+        other.refresh_from_db()
+        self.assertEqual(other.approved_comment_count, 1)
+
+    def test_queryset_delete_recounts_the_posts(self):
+        other = make_post(self.author, title="Other")
+        make_comments(self.post, approved=3, pending=2)
+        make_comments(other, approved=2, pending=0)
+        picked = [self.post.comments.filter(approved_comment=approved).first().pk for approved in (True, False)]
+        deleted, _ = Comment.objects.filter(Q(post=other) | Q(pk__in=picked)).delete()
+        self.assertEqual(deleted, 4)
+        self.assertCounterIsExact(2)
+        other.refresh_from_db()
+        self.assertEqual(other.approved_comment_count, 0)
+        self.assertEqual(Comment.objects.filter(pk=-1).delete(), (0, {}))
+
+    def test_repair_command(self):
+        make_comments(self.post, approved=3, pending=2)
+        other = make_post(self.author, title="Other")
+        Post.objects.update(approved_comment_count=7)
+        out = StringIO()
+        call_command("repair_comment_counts", batch_size=1, stdout=out)
+        self.assertIn("repaired 2 wrong counters", out.getvalue())
+        self.assertCounterIsExact(3)
+        other.refresh_from_db()
+        self.assertEqual(other.approved_comment_count, 0)
+
+
+class ModerationTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.other = User.objects.create_user(username="other", password="secret-pass-123")
+        cls.post = make_post(cls.author, title="Mine")
+        cls.second_post = make_post(cls.author, title="Also mine")
+        cls.other_post = make_post(cls.other, title="Not mine")
+        make_comments(cls.post, approved=1, pending=3)
+        make_comments(cls.second_post, pending=2)
+        make_comments(cls.other_post, pending=2)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.author)
+        self.url = reverse("personal_app:moderation")
+
+    def pending_ids(self, post):
+        return list(post.comments.filter(approved_comment=False).values_list("pk", flat=True))
+
+    def test_queue_lists_pending_comments_of_own_posts_only(self):
+        response = self.client.get(self.url)
+        listed = {comment.pk for comment in response.context["list_of_pending_comments"]}
+        self.assertEqual(listed, set(self.pending_ids(self.post) + self.pending_ids(self.second_post)))
+
+    def test_queue_is_paginated(self):
+        with mock.patch.object(ModerationView, "keyset_page_size", 2):
+            first = self.client.get(self.url)
+            self.assertEqual(len(first.context["list_of_pending_comments"]), 2)
+            self.assertTrue(first.context["page_obj"].has_next)
+
+    def test_bulk_approve_is_one_update_of_approved_comment(self):
+        ids = self.pending_ids(self.post) + self.pending_ids(self.second_post)[:1] + self.pending_ids(self.other_post)
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(self.url, {"action": "approve", "comment_ids": ids})
+        comment_updates = [query["sql"] for query in context.captured_queries
+                           if query["sql"].startswith('UPDATE "personal_app_comment"')]
+        self.assertEqual(len(comment_updates), 1)
+        self.assertIn('SET "approved_comment" = ', comment_updates[0])
+        self.assertNotIn('"text"', comment_updates[0].split("WHERE")[0])
+
+        self.assertEqual(self.pending_ids(self.post), [])
+        self.assertEqual(len(self.pending_ids(self.second_post)), 1)
+        # comments on another author's post are never touched.
+        self.assertEqual(len(self.pending_ids(self.other_post)), 2)
+        for post, expected in ((self.post, 4), (self.second_post, 1), (self.other_post, 0)):
+            post.refresh_from_db()
+            self.assertEqual(post.approved_comment_count, expected)
+
+    def test_bulk_reject_is_one_delete(self):
+        ids = self.pending_ids(self.post) + self.pending_ids(self.other_post)
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(self.url, {"action": "reject", "comment_ids": ids})
+        deletes = [query["sql"] for query in context.captured_queries if query["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(self.pending_ids(self.post), [])
+        self.assertEqual(len(self.pending_ids(self.other_post)), 2)
+        # the approved comment stays.
+        self.assertEqual(self.post.comments.count(), 1)
+
+    def test_moderation_invalidates_cached_pages(self):
+        detail_url = reverse("personal_app:post_detail", kwargs={"pk": self.post.pk})
+        self.client.logout()
+        self.assertContains(self.client.get(reverse("personal_app:post_list")), "Comments: 1")
+        self.client.get(detail_url)
+        self.client.force_login(self.author)
+        self.client.post(self.url, {"action": "approve", "comment_ids": self.pending_ids(self.post)})
+        self.client.logout()
+        self.assertContains(self.client.get(reverse("personal_app:post_list")), "Comments: 4")
+        self.assertContains(self.client.get(detail_url), "pending", count=3)
+
+    def test_single_comment_views_load_the_post_with_a_join(self):
+        comment_pk = self.pending_ids(self.post)[0]
+        self.client.get(reverse("personal_app:post_list"))  # the session and the user are loaded once here
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("personal_app:approve_comment", kwargs={"pk": comment_pk}))
+        selects = [query["sql"] for query in context.captured_queries
+                   if query["sql"].startswith("SELECT") and "personal_app_comment" in query["sql"]]
+        self.assertEqual(len(selects), 1)
+        self.assertIn("personal_app_post", selects[0])
+
+
+# The json api shows the same public content as the html pages, with only the requested fields.
+class ApiTests(SharedCacheMixin, BlogTestCase):
+    shared_caches = ["pages", "fragments"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.posts = []
+        for number in range(5):
+            post = make_post(cls.author, title="Post %s" % number)
+            Post.objects.filter(pk=post.pk).update(published_date=timezone.now() - timedelta(hours=number + 1))
+            cls.posts.append(post)
+        cls.draft = make_post(cls.author, title="Draft", published=False)
+        make_comments(cls.posts[0], approved=3, pending=2)
+
+    def test_list_is_paged_with_cursors(self):
+        url = reverse("personal_app:api_post_list")
+        first = self.client.get(url, {"limit": 3}).json()
+        self.assertEqual([row["title"] for row in first["results"]], ["Post 0", "Post 1", "Post 2"])
+        self.assertEqual(first["results"][0], {"id": self.posts[0].pk, "title": "Post 0", "author": "author",
+                                               "published_date": first["results"][0]["published_date"],
+                                               "comment_count": 3})
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        self.assertEqual([row["title"] for row in second["results"]], ["Post 3", "Post 4"])
+        self.assertIsNone(second["next"])
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+
+    def test_only_the_requested_columns_are_selected(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("personal_app:api_post_list"), {"fields": "id,title"})
+        self.assertEqual(set(response.json()["results"][0]), {"id", "title"})
+        select = [query["sql"] for query in context.captured_queries if "personal_app_post" in query["sql"]][-1]
+        self.assertNotIn('"body"', select)
+        self.assertNotIn("auth_user", select)
+
+        response = self.client.get(reverse("personal_app:api_post_list"), {"fields": "id,password"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_and_comments_show_only_public_content(self):
+        detail = self.client.get(reverse("personal_app:api_post_detail", kwargs={"pk": self.posts[0].pk})).json()
+        self.assertEqual(detail["body"], "Body of Post 0")
+        response = self.client.get(reverse("personal_app:api_post_detail", kwargs={"pk": self.draft.pk}))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response)
+
+        comments = self.client.get(reverse("personal_app:api_comment_list", kwargs={"pk": self.posts[0].pk})).json()
+        self.assertEqual([row["text"] for row in comments["results"]], ["approved"] * 3)
+        response = self.client.get(reverse("personal_app:api_comment_list", kwargs={"pk": self.draft.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    # a client holding an ETag of a post which was unpublished (or never existed) gets a 404, not a 304, and no
+    # version stamp is stored for an id nobody wrote.
+    def test_missing_and_draft_posts_are_checked_before_the_etag(self):
+        url = reverse("personal_app:api_post_detail", kwargs={"pk": self.posts[1].pk})
+        etag = self.client.get(url)["ETag"]
+        Post.objects.filter(pk=self.posts[1].pk).update(published_date=None)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+        comments_url = reverse("personal_app:api_comment_list", kwargs={"pk": self.posts[1].pk})
+        self.assertEqual(self.client.get(comments_url, HTTP_IF_NONE_MATCH="*").status_code, 404)
+
+        for name in ("api_post_detail", "api_comment_list"):
+            response = self.client.get(reverse("personal_app:%s" % name, kwargs={"pk": 999999}),
+                                       HTTP_IF_NONE_MATCH="*")
+            self.assertEqual(response.status_code, 404)
+        self.assertIsNone(fragment_cache().get("post-version:999999"))
+
+    def test_conditional_get_and_gzip(self):
+        url = reverse("personal_app:api_comment_list", kwargs={"pk": self.posts[0].pk})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        # a new approved comment gives the post a new version.
+        comment = Comment.objects.create(post=self.posts[0], author="reader", text="new")
+        comment.approve()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+        list_url = reverse("personal_app:api_post_list")
+        etag = self.client.get(list_url)["ETag"]
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.draft.publish()
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+# The feeds are streamed: the posts are read with ".iterator()" and written one by one.
+class FeedTests(SharedCacheMixin, BlogTestCase):
+    shared_caches = ["pages"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.other = User.objects.create_user(username="other")
+        make_post(cls.author, title="First <post>")
+        make_post(cls.other, title="Other post")
+        make_post(cls.author, title="Draft", published=False)
+
+    def get_feed(self, feed_format, username=None, **headers):
+        if username:
+            url = reverse("personal_app:author_feed", kwargs={"feed_format": feed_format, "username": username})
+        else:
+            url = reverse("personal_app:post_feed", kwargs={"feed_format": feed_format})
+        return self.client.get(url, **headers)
+
+    def content(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_rss_and_atom_are_streamed(self):
+        for feed_format, root in (("rss", "<rss"), ("atom", "<feed")):
+            response = self.get_feed(feed_format)
+            self.assertTrue(response.streaming)
+            content = self.content(response)
+            self.assertIn(root, content)
+            self.assertIn("First &lt;post&gt;", content)
+            self.assertIn("Other post", content)
+            self.assertNotIn("Draft", content)
+
+    def test_json_feed_and_author_feed(self):
+        feed = json.loads(self.content(self.get_feed("json", username="author")))
+        self.assertEqual(feed["version"], "https://jsonfeed.org/version/1.1")
+        self.assertEqual([item["title"] for item in feed["items"]], ["First <post>"])
+        self.assertEqual(self.get_feed("json", username="nobody").status_code, 404)
+        self.assertEqual(self.get_feed("yaml").status_code, 404)
+
+    def test_posts_are_read_with_an_iterator(self):
+        with mock.patch("personal_app.feeds.FEED_CHUNK_SIZE", 1), \
+                mock.patch.object(QuerySet, "iterator", autospec=True, side_effect=QuerySet.iterator) as iterator:
+            self.content(self.get_feed("rss"))
+        self.assertEqual(iterator.call_args.kwargs, {"chunk_size": 1})
+
+    def test_conditional_get(self):
+        response = self.get_feed("atom")
+        self.assertEqual(self.get_feed("atom", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.get_feed("atom", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+        Post.objects.get(title="Draft").publish()
+        self.assertEqual(self.get_feed("atom", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+
+# The async views run in the event loop of the test: any sync ORM call would raise "SynchronousOnlyOperation".
+class AsyncViewTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.post = make_post(cls.author, title="Async post")
+        make_post(cls.author, title="Async draft", published=False)
+        make_comments(cls.post, approved=2, pending=1)
+
+    def request(self, path, user=None):
+        request = AsyncRequestFactory().get(path)
+        if user is None:
+            request.user = AnonymousUser()
+        else:
+            # like "AuthenticationMiddleware": the user is loaded from the session only when it is used.
+            self.client.force_login(user)
+            session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+            request.session = self.client.session
+            request.user = SimpleLazyObject(lambda: get_user(request))
+        return request
+
+    async def test_post_list_and_about(self):
+        response = await AsyncPostListView.as_view()(self.request("/"))
+        self.assertContains(response, "Async post")
+        self.assertContains(response, "Comments: 2")
+        self.assertNotContains(response, "Async draft")
+        response = await AsyncAboutView.as_view()(self.request("/about/"))
+        self.assertContains(response, "About this Website")
+
+    async def test_post_detail_shows_pending_comments_to_the_author_only(self):
+        path = reverse("personal_app:post_detail", kwargs={"pk": self.post.pk})
+        response = await AsyncPostDetailView.as_view()(self.request(path), pk=self.post.pk)
+        self.assertContains(response, "Body of Async post")
+        self.assertContains(response, "approved", count=2)
+        self.assertNotContains(response, "pending")
+
+        request = await sync_to_async(self.request)(path, user=self.author)
+        response = await AsyncPostDetailView.as_view()(request, pk=self.post.pk)
+        self.assertContains(response, "pending")
+
+    async def test_comment_pages_and_missing_post(self):
+        response = await async_views.post_comments(self.request("/?format=json"), pk=self.post.pk)
+        self.assertEqual(len(json.loads(response.content)["comments"]), 2)
+        with self.assertRaises(Http404):
+            await AsyncPostDetailView.as_view()(self.request("/"), pk=self.post.pk + 100)
+
+
+# The follow-up work of a new comment / a published post is queued in the "Job" table and run by the worker.
+# the jobs only warm the fragment cache, so they are queued only when it is shared.
+class JobQueueTests(SharedCacheMixin, BlogTestCase):
+    shared_caches = ["fragments"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.post = make_post(cls.author, title="Queued")
+
+    def failing_handler(self, **payload):
+        raise RuntimeError("boom")
+
+    def test_new_comment_is_queued_and_warms_the_fragments(self):
+        self.client.post(reverse("personal_app:add_comment", kwargs={"pk": self.post.pk}),
+                         {"author": "reader", "text": "hello"})
+        comment = Comment.objects.get(text="hello")
+        self.assertEqual(list(Job.objects.values_list("name", "payload")),
+                         [("comment_created", {"comment_id": comment.pk})])
+
+        self.assertEqual(run_pending(), 1)
+        self.assertFalse(Job.objects.exists())
+        self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+        self.assertEqual(fragment_stats()["misses"], 3)  # body, public and owner comments, all rendered by the job
+        self.assertEqual(fragment_stats()["hits"], 2)
+
+    def test_publish_is_queued(self):
+        draft = make_post(self.author, title="Draft", published=False)
+        draft.publish()
+        self.assertTrue(Job.objects.filter(name="post_published", payload={"post_id": draft.pk}).exists())
+        call_command("run_jobs", "--once", stdout=StringIO())
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_jobs_are_retried_then_dead_lettered(self):
+        with mock.patch.dict(JOB_HANDLERS, {"fragile": self.failing_handler}):
+            job = enqueue("fragile", max_attempts=2, value=1)
+            self.assertEqual(run_pending(), 1)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, 1)
+            self.assertIn("RuntimeError: boom", job.last_error)
+            self.assertGreater(job.run_at, timezone.now())
+            # not due yet.
+            self.assertEqual(run_pending(), 0)
+
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            self.assertEqual(run_pending(), 1)
+        self.assertFalse(Job.objects.exists())
+        dead = DeadLetterJob.objects.get()
+        self.assertEqual((dead.name, dead.payload, dead.attempts), ("fragile", {"value": 1}, 2))
+        self.assertEqual(dead.requeue().name, "fragile")
+        self.assertFalse(DeadLetterJob.objects.exists())
+
+    def test_a_job_is_claimed_by_one_worker_only(self):
+        enqueue("post_published", post_id=self.post.pk)
+        self.assertEqual(len(claim_jobs("first")), 1)
+        self.assertEqual(claim_jobs("second"), [])
+        # the lease of a dead worker runs out.
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_jobs("second")), 1)
+
+    def test_cache_warming_is_not_queued_with_a_process_local_cache(self):
+        with override_settings(CACHES=dict(settings.CACHES, fragments={
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "local-fragments"})):
+            self.client.post(reverse("personal_app:add_comment", kwargs={"pk": self.post.pk}),
+                             {"author": "reader", "text": "hello"})
+            make_post(self.author, title="Draft", published=False).publish()
+            self.assertIsNone(enqueue("post_published", post_id=self.post.pk))
+        self.assertTrue(Comment.objects.filter(text="hello").exists())
+        # the archive refresh writes to the database: it is queued whatever the cache.
+        self.assertEqual(list(Job.objects.values_list("name", flat=True)), ["refresh_archive"])
+
+    def test_eager_mode_runs_after_the_commit(self):
+        with self.settings(BLOG_JOBS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            make_post(self.author, title="Eager", published=False).publish()
+        self.assertFalse(Job.objects.exists())
+
+
+# Every request is measured by "RequestMetricsMiddleware".
+class RequestMetricsTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.staff = User.objects.create_user(username="staff", is_staff=True)
+        cls.post = make_post(cls.author, title="Measured")
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_server_timing_header_and_summary(self):
+        response = self.client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", template;dur=[\d.]+$')
+        self.assertNotIn('desc="0 queries"', timing)
+
+        self.client.get(reverse("personal_app:post_list"))
+        self.client.force_login(self.staff)
+        views = self.client.get(reverse("personal_app:request_metrics")).json()["views"]
+        detail = views["personal_app:post_detail"]
+        self.assertEqual(detail["count"], 1)
+        self.assertGreater(detail["template_ms"]["p50"], 0)
+        self.assertGreater(detail["response_bytes"]["p99"], 0)
+        self.assertEqual(views["personal_app:post_list"]["count"], 1)
+
+    # the function views call "render()" rather than returning a "TemplateResponse": their templates are timed too.
+    def test_function_views_time_their_templates(self):
+        response = self.client.get(reverse("personal_app:search"), {"q": "Measured"})
+        self.assertNotRegex(response["Server-Timing"], r"template;dur=0\.000$")
+        self.client.force_login(self.staff)
+        views = self.client.get(reverse("personal_app:request_metrics")).json()["views"]
+        self.assertGreater(views["personal_app:search"]["template_ms"]["p50"], 0)
+
+    def test_metrics_page_is_staff_only(self):
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(reverse("personal_app:request_metrics")).status_code, 302)
+
+    def test_disabled_middleware_is_not_used(self):
+        with self.settings(BLOG_REQUEST_METRICS=False):
+            response = self.client.get(reverse("personal_app:about"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(metrics.summary(), {})
+
+    # under ASGI the middleware is a coroutine: the queries of the async views are counted in their own thread.
+    async def test_async_requests_are_measured(self):
+        async def view(request):
+            return HttpResponse(", ".join([post.title async for post in Post.objects.all()]))
+
+        middleware = RequestMetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(AsyncRequestFactory().get("/"))
+        self.assertContains(response, "Measured")
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+
+        # the whole async chain, with a sync view behind it.
+        response = await self.async_client.get(reverse("personal_app:post_detail", kwargs={"pk": self.post.pk}))
+        self.assertNotIn('desc="0 queries"', response["Server-Timing"])
+        self.assertEqual(metrics.summary()["<unresolved>"]["count"], 1)
+
+
+# Every url of "personal_app/urls.py" is visited (as an anonymous reader, as the author and as a staff user) with
+# enough rows to make a per-row query cross the threshold; a new N+1 query makes this test fail.
+class NPlusOneTests(BlogTestCase):
+
+    # the value given to every url parameter; "pk" is a comment for the comment urls, a post for all the others.
+    COMMENT_URLS = {"approve_comment", "remove_comment"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.staff = User.objects.create_user(username="staff", is_staff=True)
+        cls.posts = [make_post(cls.author, title="Post %s" % number) for number in range(12)]
+        for post in cls.posts:
+            make_comments(post, approved=6, pending=3)
+        for number in range(12):
+            make_post(cls.author, title="Draft %s" % number, published=False)
+        cls.post = cls.posts[-1]
+        cls.comment = cls.post.comments.filter(approved_comment=False).first()
+        # "make_post" does not go through "publish()", so the archive is computed here.
+        rebuild_archive()
+
+    def url_kwargs(self, pattern):
+        values = {
+            "pk": self.comment.pk if pattern.name in self.COMMENT_URLS else self.post.pk,
+            "username": self.author.username,
+            "feed_format": "rss",
+            "year": self.post.published_date.year,
+            "month": self.post.published_date.month,
+        }
+        missing = set(pattern.pattern.converters) - set(values)
+        self.assertFalse(missing, "No test value for the parameters %s of %s" % (missing, pattern.name))
+        return {name: values[name] for name in pattern.pattern.converters}
+
+    def test_no_url_runs_n_plus_one_queries(self):
+        for user in (None, self.author, self.staff):
+            if user is None:
+                self.client.logout()
+            else:
+                self.client.force_login(user)
+            for pattern in personal_urls.urlpatterns:
+                url = reverse("personal_app:%s" % pattern.name, kwargs=self.url_kwargs(pattern))
+                with self.subTest(url=url, user=user and user.username):
+                    with detect_nplusone(action="raise", label=url):
+                        response = self.client.get(url)
+                        if response.streaming:
+                            b"".join(response.streaming_content)
+
+    def test_detector_names_the_template_line_and_the_code(self):
+        template = Template("{% for post in posts %}\n{{ post.comments.count }}{% endfor %}")
+        with self.assertRaisesRegex(NPlusOneError, r"template <unknown source>:2, code tests.py:\d+"):
+            with detect_nplusone(threshold=3):
+                template.render(Context({"posts": Post.objects.all()}))
+
+    def test_log_mode_and_value_lists(self):
+        self.assertEqual(query_shape('SELECT 1 FROM "t" WHERE "id" IN (%s, %s) AND "a" = \'x\''),
+                         'SELECT ? FROM "t" WHERE "id" IN (...) AND "a" = ?')
+        with self.assertLogs("personal_app.nplusone", "WARNING"), detect_nplusone(threshold=2, action="log") as counter:
+            for post in self.posts[:3]:
+                Post.objects.filter(pk=post.pk).exists()
+        self.assertEqual(len(counter.offenders), 1)
+
+    @override_settings(BLOG_NPLUSONE="raise")
+    async def test_middleware_checks_the_async_views(self):
+        async def view(request):
+            for post in self.posts[:settings.BLOG_NPLUSONE_THRESHOLD]:
+                await Post.objects.filter(pk=post.pk).aexists()
+            return HttpResponse()
+
+        middleware = NPlusOneMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertRaisesRegex(NPlusOneError, r"N\+1 queries in /async/"):
+            await middleware(AsyncRequestFactory().get("/async/"))
+        # the detector is gone after the request.
+        await view(None)
+        self.assertFalse(iscoroutinefunction(NPlusOneMiddleware(lambda request: HttpResponse())))
+
+
+class SeedAndBenchmarkTests(BlogTestCase):
+
+    def seeded_posts(self):
+        return list(Post.objects.order_by("created_date").values_list("title", "body", "published_date",
+                                                                      "approved_comment_count"))
+
+    def test_seed_is_deterministic_and_counters_are_exact(self):
+        call_command("seed_blog", users=3, posts=60, comments=400, seed=7, batch_size=25, stdout=StringIO())
+        first = self.seeded_posts()
+        self.assertEqual(len(first), 60)
+        self.assertTrue(any(published_date is None for _, _, published_date, _ in first))
+        self.assertFalse(Post.objects.with_comment_counts()
+                         .exclude(approved_comment_count=F("approved_comment_total")).exists())
+        # the comments concentrate on a few posts.
+        counts = sorted(Post.objects.annotate(total=Count("comments")).values_list("total", flat=True))
+        self.assertGreater(counts[-1], 5 * counts[len(counts) // 2])
+
+        with self.assertRaises(CommandError):
+            call_command("seed_blog", users=3, posts=60, comments=400, seed=7, stdout=StringIO())
+        call_command("seed_blog", users=3, posts=60, comments=400, seed=7, flush=True, stdout=StringIO())
+        self.assertEqual(self.seeded_posts(), first)
+
+    def test_benchmark_routes_writes_and_compares_results(self):
+        call_command("seed_blog", users=2, posts=20, comments=50, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command("benchmark_routes", repeat=1, output=path, stdout=StringIO())
+            with open(path) as results_file:
+                results = json.load(results_file)
+            self.assertEqual(results["meta"]["posts"], 20)
+            self.assertGreaterEqual(results["routes"]["anonymous post_detail"]["queries"], 1)
+            output = StringIO()
+            call_command("benchmark_routes", repeat=1, compare=path, stdout=output)
+        self.assertIn("anonymous post_list", output.getvalue().split("compared with")[1])
+
+    def test_benchmark_pagination_counts_the_existing_posts(self):
+        author = User.objects.create_user(username="author")
+        for number in range(7):
+            make_post(author, title="Existing %s" % number)
+        pages = []
+
+        def measure(function, repeat):
+            pages.append([post.pk for post in function()])
+            return [1.0]
+
+        output = StringIO()
+        with mock.patch("personal_app.management.commands.benchmark_pagination.measure", side_effect=measure):
+            call_command("benchmark_pagination", sizes="30", page_size=5, repeat=1, stdout=output)
+        self.assertIn("posts=30", output.getvalue())
+        # the keyset and the OFFSET queries read the same deep page.
+        first_page, keyset_deep_page, offset_deep_page = pages
+        self.assertEqual(len(offset_deep_page), 5)
+        self.assertEqual(keyset_deep_page, offset_deep_page)
+
+
+# every new SQLite connection gets the pragmas of "BLOG_SQLITE_PRAGMAS".
+class SQLiteTuningTests(BlogTestCase):
+
+    def test_pragmas_are_set_on_the_connection(self):
+        values = current_pragmas(connection, ["synchronous", "busy_timeout", "cache_size", "temp_store"])
+        # synchronous: 1 = NORMAL; temp_store: 2 = MEMORY.
+        self.assertEqual(values, {"synchronous": 1, "busy_timeout": 20000, "cache_size": -20000, "temp_store": 2})
+
+    def test_wal_on_a_database_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(connection.settings_dict, NAME=os.path.join(directory, "wal.sqlite3"))
+            file_connection = connections["default"].__class__(settings_dict, alias="wal-test")
+            try:
+                self.assertEqual(current_pragmas(file_connection, ["journal_mode"]), {"journal_mode": "wal"})
+            finally:
+                file_connection.close()
+
+    def test_invalid_pragmas_are_refused(self):
+        with self.assertRaises(ValueError):
+            configure_connection(connection, {"journal_mode": "wal; DROP TABLE auth_user"})
+
+
+# without a "replica" database (as here) the router falls back to "default", so only the decision is checked.
+@override_settings(BLOG_READ_REPLICA=True)
+class ReplicaRoutingTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.post = make_post(cls.author, title="Replicated")
+
+    def read_database(self, name, **kwargs):
+        response = self.client.get(reverse("personal_app:%s" % name, kwargs=kwargs))
+        self.assertEqual(response.status_code, 200)
+        return response.wsgi_request.read_database
+
+    def test_read_views_use_the_replica(self):
+        self.assertEqual(self.read_database("post_list"), REPLICA_ALIAS)
+        self.assertEqual(self.read_database("post_detail", pk=self.post.pk), REPLICA_ALIAS)
+        self.assertEqual(self.read_database("post_feed", feed_format="rss"), REPLICA_ALIAS)
+        self.assertEqual(self.read_database("about"), "default")
+        self.assertNotIn(PIN_COOKIE, self.client.cookies)
+
+    def test_a_write_pins_the_reads_to_the_primary(self):
+        response = self.client.post(reverse("personal_app:add_comment", kwargs={"pk": self.post.pk}),
+                                    {"author": "reader", "text": "Fresh comment"})
+        self.assertEqual(response.wsgi_request.read_database, "default")
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.read_database("post_detail", pk=self.post.pk), "default")
+
+        self.client.cookies[PIN_COOKIE] = "forged"
+        self.assertEqual(self.read_database("post_detail", pk=self.post.pk), REPLICA_ALIAS)
+
+    def test_router_outside_of_a_request(self):
+        router = ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(Post))
+        self.assertEqual(router.db_for_write(Post), "default")
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, "personal_app"))
+
+    def test_copy_sqlite_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source, target = os.path.join(directory, "primary.sqlite3"), os.path.join(directory, "replica.sqlite3")
+            with closing(sqlite3.connect(source)) as primary:
+                primary.execute("CREATE TABLE post (title TEXT)")
+                primary.execute("INSERT INTO post VALUES ('copied')")
+                primary.commit()
+                copy_sqlite_database(source, target)
+            with closing(sqlite3.connect(target)) as replica:
+                self.assertEqual(replica.execute("SELECT title FROM post").fetchall(), [("copied",)])
+
+
+# the routing of "ReplicaRoutingTests" with a real "replica" database: which connection runs every query.
+@override_settings(BLOG_READ_REPLICA=True)
+class ReplicaDatabaseTests(SharedCacheMixin, TransactionTestCase):
+    shared_caches = ["pages", "fragments"]
+
+    def setUp(self):
+        super().setUp()
+        for cache in caches.all():
+            cache.clear()
+        self.author = User.objects.create_user(username="author")
+        self.post = make_post(self.author, title="Replicated")
+
+    # a real second database: a copy of the test database as it is now, so the rows written afterwards are only on
+    # "default", like a replica which is behind. (A TransactionTestCase: SQLite can not copy a database while a
+    # transaction of "TestCase" is writing to it.)
+    @contextmanager
+    def replica_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replica_settings = dict(connection.settings_dict, NAME=os.path.join(directory, "replica.sqlite3"),
+                                    TEST={})
+            connection.ensure_connection()
+            with closing(sqlite3.connect(replica_settings["NAME"])) as target:
+                connection.connection.backup(target)
+            with mock.patch.dict(settings.DATABASES, {REPLICA_ALIAS: replica_settings}), \
+                    mock.patch.dict(connections.settings, {REPLICA_ALIAS: replica_settings}):
+                try:
+                    yield connections[REPLICA_ALIAS]
+                finally:
+                    connections[REPLICA_ALIAS].close()
+                    del connections[REPLICA_ALIAS]
+
+    def queries_on(self, alias, name, **kwargs):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            response = self.client.get(reverse("personal_app:%s" % name, kwargs=kwargs.pop("url_kwargs", {})),
+                                       kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in queries.captured_queries]
+
+    def test_the_queries_run_on_the_replica(self):
+        with self.replica_database():
+            lagging = make_post(self.author, title="Lagging")
+            with CaptureQueriesContext(connections["default"]) as primary:
+                response, replica_queries = self.queries_on(REPLICA_ALIAS, "search", q="replicated")
+                self.assertEqual([result.post.pk for result in response.context["results"]], [self.post.pk])
+                # the search (FTS query included) and the post detail read the replica only.
+                self.assertTrue(any("MATCH" in sql for sql in replica_queries))
+                response, replica_queries = self.queries_on(REPLICA_ALIAS, "post_detail",
+                                                            url_kwargs={"pk": self.post.pk})
+                self.assertTrue(replica_queries)
+            self.assertEqual(primary.captured_queries, [])
+            # the replica does not have the new post yet: not found there, and not half found either.
+            response, _ = self.queries_on(REPLICA_ALIAS, "search", q="lagging")
+            self.assertEqual(response.context["results"], [])
+
+            # after a write the reads go to "default", which has the new post.
+            self.client.post(reverse("personal_app:add_comment", kwargs={"pk": self.post.pk}),
+                             {"author": "reader", "text": "Fresh comment"})
+            response, primary_queries = self.queries_on("default", "search", q="lagging")
+            self.assertEqual([result.post.pk for result in response.context["results"]], [lagging.pk])
+            self.assertTrue(any("MATCH" in sql for sql in primary_queries))
+
+    # the replica does not have the change of the new version stamps yet: what it gives is not cached under them.
+    def test_pages_read_from_the_replica_are_not_cached(self):
+        with self.replica_database():
+            self.post.body = "Edited body"
+            self.post.save()
+            response, _ = self.queries_on(REPLICA_ALIAS, "post_detail", url_kwargs={"pk": self.post.pk})
+            self.assertContains(response, "Body of Replicated")
+            self.assertEqual(get_or_render(self.post.pk, "body", "all", lambda: "from default"), "from default")
+
+            for name, url_kwargs in (("post_list", {}), ("api_post_detail", {"pk": self.post.pk})):
+                response, _ = self.queries_on(REPLICA_ALIAS, name, url_kwargs=url_kwargs)
+                self.assertNotIn("ETag", response)
+            response, replica_queries = self.queries_on(REPLICA_ALIAS, "post_list")
+            self.assertTrue(replica_queries)
+
+
+
+class RenderedHtmlTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+
+    def test_sanitize_html(self):
+        self.assertEqual(sanitize_html('<p onclick="x()">Hi <b>there</p><script>alert(1)</script>'),
+                         "<p>Hi <b>there</b></p>")
+        self.assertEqual(sanitize_html('<a href="javascript:alert(1)">a</a><a href="/about/">b</a>'),
+                         '<a>a</a><a href="/about/">b</a>')
+        self.assertEqual(sanitize_html("1 < 2 &amp; <!-- hidden --><em>3</em>"), "1 &lt; 2 &amp; <em>3</em>")
+
+    def test_html_is_rendered_on_save(self):
+        post = make_post(self.author, title="Rendered")
+        post.body = "First line\nSecond <script>steal()</script><b>line</b>"
+        post.save()
+        self.assertIn("First line", post.body_html)
+        self.assertIn("<b>line</b>", post.body_html)
+        self.assertNotIn("script", post.body_html)
+
+        comment = Comment.objects.create(post=post, author="reader", text='<a href="https://example.com">link</a>',
+                                         approved_comment=True)
+        self.assertEqual(comment.text_html, '<a href="https://example.com" rel="nofollow noopener">link</a>')
+
+        response = self.client.get(reverse("personal_app:post_detail", kwargs={"pk": post.pk}))
+        self.assertContains(response, "<b>line</b>")
+        self.assertContains(response, 'rel="nofollow noopener"')
+        self.assertNotContains(response, "steal()")
+
+    # "markdown" is optional (not installed here): a stand-in returns what markdown would, and the result is still
+    # sanitized. Without it the line breaks become "<br>".
+    def test_post_bodies_use_markdown_when_installed(self):
+        fake_markdown = mock.Mock()
+        fake_markdown.markdown.return_value = '<h1>Title</h1>\n<p><strong>bold</strong><script>steal()</script></p>'
+        with mock.patch.object(rendering, "markdown", fake_markdown):
+            html = render_post_html("# Title\n**bold**")
+        fake_markdown.markdown.assert_called_once_with("# Title\n**bold**",
+                                                       extensions=["fenced_code", "tables", "sane_lists", "nl2br"])
+        self.assertEqual(html, "<h1>Title</h1>\n<p><strong>bold</strong></p>")
+
+        with mock.patch.object(rendering, "markdown", None):
+            self.assertEqual(render_post_html("# Title\n**bold**"), "# Title<br>**bold**")
+        # the comments never use markdown.
+        with mock.patch.object(rendering, "markdown", fake_markdown):
+            self.assertEqual(render_comment_html("**bold**"), "**bold**")
+        self.assertEqual(fake_markdown.markdown.call_count, 1)
+
+    def test_html_is_kept_when_the_body_is_not_saved(self):
+        post = make_post(self.author, title="Kept")
+        Post.objects.filter(pk=post.pk).update(body_html="<p>stored</p>")
+        post.title = "Renamed"
+        post.save(update_fields=["title"])
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, "<p>stored</p>")
+
+    def test_render_html_command_backfills_the_rows(self):
+        post = make_post(self.author, title="Backfilled")
+        make_comments(post, approved=2)
+        Post.objects.update(body_html="")
+        Comment.objects.update(text_html="")
+        output = StringIO()
+        call_command("render_html", batch_size=1, stdout=output)
+        self.assertIn("1 posts and 2 comments", output.getvalue())
+        self.assertEqual(Post.objects.get(pk=post.pk).body_html, render_post_html(post.body))
+        self.assertFalse(Comment.objects.filter(text_html="").exists())
+
+
+class StaticAssetTests(BlogTestCase):
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding("gzip, BR;q=0.5, deflate;q=x, ,*;q=0"),
+                         {"gzip": 1.0, "br": 0.5, "deflate": 0.0, "*": 0.0})
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css("/* note */\n.a ,\n.b {\n  color : red;\n  margin: 0;\n}\n/*! license */"),
+                         ".a,.b{color:red;margin:0}/*! license */")
+        # the space of a descendant selector stays, the one of a declaration goes.
+        self.assertEqual(minify_css(".a :hover ,.b ::before {\n  color : red;\n}\n@media (min-width: 600px) {\n"
+                                    "  .c :first-child { margin : 0 }\n}"),
+                         ".a :hover,.b ::before{color:red}@media (min-width: 600px){.c :first-child{margin:0}}")
+
+    def test_vendor_assets_fall_back_to_the_cdn(self):
+        with mock.patch("personal_app.templatetags.vendor_assets.vendored", return_value=False):
+            self.assertEqual(vendor_asset("bootstrap_css"),
+                             '<link rel="stylesheet" href="%s" integrity="%s" crossorigin="anonymous">'
+                             % (VENDOR_ASSETS["bootstrap_css"]["url"], VENDOR_ASSETS["bootstrap_css"]["integrity"]))
+        with mock.patch("personal_app.templatetags.vendor_assets.vendored", return_value=True):
+            self.assertEqual(vendor_asset("medium_editor_js"),
+                             '<script src="/static/vendor/medium-editor-5.23.3/medium-editor.min.js"></script>')
+
+    def test_built_assets_are_hashed_compressed_and_immutable(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(STATIC_ROOT=directory):
+            call_command("build_assets", skip_vendor=True, stdout=StringIO())
+            url = static("css/blogpost.css")
+            self.assertRegex(url, r"^/static/css/blogpost\.[0-9a-f]{12}\.css$")
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+            css = gzip.decompress(b"".join(response.streaming_content)).decode()
+            self.assertTrue(css.startswith(".techfont{"))
+            response.close()
+
+            response = self.client.get("/static/css/blogpost.css")
+            self.assertNotIn("Content-Encoding", response)
+            self.assertIn("no-cache", response["Cache-Control"])
+            response.close()
+
+            # "q=0" refuses an encoding, even though its name is in the header.
+            for header in ("gzip;q=0", "br;q=0, gzip ; q=0.0", "*;q=0", "identity"):
+                with self.subTest(header=header):
+                    response = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+                    self.assertNotIn("Content-Encoding", response)
+                    response.close()
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING="br;q=0, *")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            response.close()
+            self.assertEqual(self.client.get("/static/../manage.py").status_code, 404)
+
+
+# with the cached sessions and users, a logged in request only runs the queries of its view.
+# the cached sessions and users need a cache shared by the worker processes ("caching.py").
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db")
+class CachedSessionTests(SharedCacheMixin, BlogTestCase):
+    shared_caches = ["sessions"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+
+    def session_and_user_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        tables = [query["sql"].split(" FROM ", 1)[-1].split(" ", 1)[0] for query in context.captured_queries]
+        return response, [table for table in tables if table in ('"django_session"', '"auth_user"')]
+
+    def test_logged_in_requests_read_no_session_or_user(self):
+        self.client.login(username="author", password="secret-pass-123")
+        url = reverse("personal_app:draft_list")
+        self.client.get(url)
+        response, queries = self.session_and_user_queries(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_a_new_password_logs_the_sessions_out(self):
+        self.client.login(username="author", password="secret-pass-123")
+        url = reverse("personal_app:draft_list")
+        self.assertEqual(self.client.get(url).status_code, 200)
+        user = User.objects.get(pk=self.author.pk)
+        user.set_password("another-pass-456")
+        user.save()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_logout_forgets_the_user(self):
+        self.client.login(username="author", password="secret-pass-123")
+        self.client.get(reverse("personal_app:draft_list"))
+        self.assertIsNotNone(user_cache().get("auth-user:%s" % self.author.pk))
+        self.client.post(reverse("user_logout"))
+        self.assertIsNone(user_cache().get("auth-user:%s" % self.author.pk))
+
+    # "locmem" is private to every worker process: a password change in one worker could not drop the copies.
+    def test_a_process_local_cache_does_not_keep_the_user(self):
+        with override_settings(CACHES=dict(settings.CACHES, sessions={
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "local-sessions"})):
+            self.client.login(username="author", password="secret-pass-123")
+            url = reverse("personal_app:draft_list")
+            self.client.get(url)
+            response, queries = self.session_and_user_queries(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('"auth_user"', queries)
+            self.assertIsNone(user_cache().get("auth-user:%s" % self.author.pk))
+
+    # one backend: a wrong password is hashed once, not once per backend.
+    def test_a_failed_login_checks_the_password_once(self):
+        with mock.patch.object(User, "check_password", autospec=True, return_value=False) as check_password:
+            self.assertIsNone(authenticate(username="author", password="wrong-pass"))
+        self.assertEqual(check_password.call_count, 1)
+
+
+class ArchiveTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.other = User.objects.create_user(username="other")
+
+    def rollups(self):
+        return {(rollup.author_id, rollup.year, rollup.month): (rollup.post_count, rollup.latest_post_id)
+                for rollup in ArchiveRollup.objects.all()}
+
+    # the months are counted again by the "refresh_archive" job.
+    def publish(self, author, title):
+        post = make_post(author, title=title, published=False)
+        post.publish()
+        run_pending()
+        return post
+
+    def test_publish_and_delete_update_the_rollup(self):
+        now = timezone.localtime()
+        first = self.publish(self.author, "First")
+        second = self.publish(self.author, "Second")
+        self.publish(self.other, "Other")
+        self.assertEqual(self.rollups()[(self.author.pk, now.year, now.month)], (2, second.pk))
+
+        self.client.login(username="author", password="secret-pass-123")
+        self.client.post(reverse("personal_app:post_delete", kwargs={"pk": second.pk}))
+        # not counted again until the job runs.
+        self.assertEqual(self.rollups()[(self.author.pk, now.year, now.month)][0], 2)
+        run_pending()
+        self.assertEqual(self.rollups()[(self.author.pk, now.year, now.month)], (1, first.pk))
+        first.delete()
+        run_pending()
+        self.assertNotIn((self.author.pk, now.year, now.month), self.rollups())
+        self.assertIn((self.other.pk, now.year, now.month), self.rollups())
+
+    def test_publishing_again_moves_the_post_to_the_new_month(self):
+        old_date = timezone.make_aware(datetime(2020, 3, 15))
+        post = make_post(self.author, title="Old")
+        Post.objects.filter(pk=post.pk).update(published_date=old_date)
+        rebuild_archive()
+        self.assertEqual(self.rollups(), {(self.author.pk, 2020, 3): (1, post.pk)})
+
+        post.refresh_from_db()
+        post.publish()
+        self.assertEqual(Job.objects.get(name="refresh_archive").payload["published_dates"][0], old_date.isoformat())
+        run_pending()
+        now = timezone.localtime()
+        self.assertEqual(self.rollups(), {(self.author.pk, now.year, now.month): (1, post.pk)})
+
+    def test_rebuild_matches_the_incremental_updates(self):
+        for number in range(5):
+            self.publish(self.author if number % 2 else self.other, "Post %s" % number)
+        incremental = self.rollups()
+        ArchiveRollup.objects.all().delete()
+        call_command("rebuild_archive", batch_size=1, stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_archive_pages(self):
+        post = self.publish(self.author, "Archived")
+        now = timezone.localtime()
+        response = self.client.get(reverse("personal_app:archive_index"))
+        self.assertContains(response, "%s-%02d" % (now.year, now.month))
+        self.assertContains(response, "author</a> (1)")
+
+        response = self.client.get(reverse("personal_app:archive_month", kwargs={"year": now.year, "month": now.month}))
+        self.assertContains(response, post.title)
+        response = self.client.get(reverse("personal_app:archive_author", kwargs={"username": "author"}))
+        self.assertContains(response, post.title)
+
+        self.assertEqual(self.client.get(reverse("personal_app:archive_month",
+                                                 kwargs={"year": 1999, "month": 1})).status_code, 404)
+        self.assertEqual(self.client.get(reverse("personal_app:archive_month",
+                                                 kwargs={"year": now.year, "month": 13})).status_code, 404)
+
+    def test_years_out_of_range_are_not_found(self):
+        for year in (0, 10000, 99999999999999999999):
+            with self.subTest(year=year):
+                self.assertEqual(self.client.get("/archive/%s/1/" % year).status_code, 404)
+
+
+class ExportImportTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="secret-pass-123")
+        cls.post = make_post(cls.author, title="Exported")
+        make_comments(cls.post, approved=3, pending=2)
+        make_post(cls.author, title="Draft", published=False)
+
+    def export(self, directory):
+        path = os.path.join(directory, "blog.jsonl.gz")
+        counts = export_blog(path, chunk_size=2)
+        self.assertEqual(counts, {"user": 1, "post": 2, "comment": 5})
+        return path
+
+    def snapshot(self):
+        return sorted((post.author.username, post.title, post.body_html, post.published_date is None,
+                       post.approved_comment_count, sorted(post.comments.values_list("text", "approved_comment")))
+                      for post in Post.objects.select_related("author"))
+
+    def test_import_into_an_empty_blog(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.export(directory)
+            expected = self.snapshot()
+            password = self.author.password
+            Post.objects.all().delete()
+            User.objects.all().delete()
+
+            output = StringIO()
+            call_command("import_blog", path, batch_size=2, stdout=output)
+            self.assertIn("Imported 1 users, 2 posts and 5 comments", output.getvalue())
+            self.assertEqual(self.snapshot(), expected)
+            self.assertEqual(User.objects.get(username="author").password, password)
+            self.assertFalse(ImportMapping.objects.exists())
+            self.assertEqual(ArchiveRollup.objects.get().post_count, 1)
+
+            # the same file again: nothing is imported twice.
+            call_command("import_blog", path, stdout=StringIO())
+            self.assertEqual(Post.objects.count(), 2)
+
+    def test_a_stopped_import_continues_after_its_last_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.export(directory)
+            expected = self.snapshot()
+            Post.objects.all().delete()
+
+            # the third batch (the first comments) fails: the users and the posts stay imported.
+            original = transfer.IMPORTERS["comment"]
+            with mock.patch.dict(transfer.IMPORTERS, {"comment": mock.Mock(side_effect=RuntimeError("stopped"))}):
+                with self.assertRaises(RuntimeError):
+                    import_blog(path, batch_size=3)
+            self.assertEqual(Post.objects.count(), 2)
+            self.assertEqual(Comment.objects.count(), 0)
+            self.assertEqual(ImportRun.objects.get().line, 4)
+
+            with mock.patch.dict(transfer.IMPORTERS, {"comment": original}):
+                self.assertEqual(import_blog(path, batch_size=3), {"user": 0, "post": 0, "comment": 5})
+            # the existing user was reused.
+            self.assertEqual(User.objects.count(), 1)
+            self.assertEqual(self.snapshot(), expected)
+
+    def test_the_html_and_the_counters_of_the_file_are_made_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.export(directory)
+            with gzip.open(path, "rt") as lines:
+                rows = [json.loads(line) for line in lines]
+            for row in rows:
+                if row["model"] == "post":
+                    row["body_html"] = "<script>alert('post')</script>"
+                    row["approved_comment_count"] = 1000
+                elif row["model"] == "comment":
+                    row["text_html"] = "<script>alert('comment')</script>"
+            with gzip.open(path, "wt") as output:
+                output.writelines(json.dumps(row) + "\n" for row in rows)
+            Post.objects.all().delete()
+
+            import_blog(path)
+            for post in Post.objects.all():
+                self.assertEqual(post.body_html, render_post_html(post.body))
+                # the counter is counted from the imported comments, not taken from the file.
+                self.assertEqual(post.approved_comment_count, post.comments.filter(approved_comment=True).count())
+            for comment in Comment.objects.all():
+                self.assertEqual(comment.text_html, render_comment_html(comment.text))
+            self.assertEqual(Comment.objects.count(), 5)
+
+    def test_not_an_export_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "other.jsonl.gz")
+            with gzip.open(path, "wt") as output:
+                output.write('{"model": "post"}\n')
+            with self.assertRaises(CommandError):
+                call_command("import_blog", path, stdout=StringIO())
+
+
+class StartupTests(BlogTestCase):
+
+    # the new processes get a copy of the (empty) test database, like a worker starting on a new server.
+    @contextmanager
+    def startup_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "startup.sqlite3")
+            connection.ensure_connection()
+            with closing(sqlite3.connect(path)) as target:
+                connection.connection.backup(target)
+            with mock.patch.dict(os.environ, {"BLOG_DB_PATH": path}):
+                yield
+
+    def test_cold_start_is_within_the_budget(self):
+        with self.startup_database():
+            result = cold_start("wsgi", "/about/")
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(sorted(result["modules"]), sorted(STARTUP_MODULES))
+        # no tkinter (missing on the servers without a display), no test client, no benchmark helpers.
+        self.assertEqual(result["unwanted"], [])
+        self.assertLessEqual(result["cold_start_ms"], settings.BLOG_COLD_START_BUDGET_MS,
+                             "slowest imports: %s" % result["slowest"][:10])
+
+    @override_settings(BLOG_COLD_START_BUDGET_MS=1)
+    def test_profile_startup_check_fails_over_the_budget(self):
+        output = StringIO()
+        with self.startup_database(), self.assertRaisesMessage(CommandError, "over the budget of 1ms: asgi"):
+            call_command("profile_startup", entries="asgi", path="/about/", runs=1, check=True, stdout=output)
+        self.assertIn("asgi /about/ --> 200", output.getvalue())
+        self.assertIn("personal_app.forms", output.getvalue())
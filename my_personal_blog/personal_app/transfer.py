@@ -0,0 +1,173 @@
+import gzip
+import json
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from personal_app.models import Comment, ImportMapping, ImportRun, Post
+
+
+# Export/import of the whole blog ("export_blog"/"import_blog" commands), e.g. to move it to another server.
+# The file is gzipped json lines: one "meta" line, then the authors, the posts and the comments, one row per line,
+# each ordered by primary key. Both sides stream it (a chunk of rows at a time), so the memory used does not grow
+# with the size of the blog, unlike "dumpdata"/"loaddata" which load everything and insert one row at a time.
+# The import:
+#   - inserts the rows with "bulk_create", one transaction per batch of lines,
+#   - gives the rows new primary keys; the posts/comments are pointed to them through "ImportMapping",
+#   - reuses a user which exists already (same username),
+#   - saves the last imported line with every batch ("ImportRun"), so a stopped import continues where it stopped.
+# The html of the file ("body_html", "text_html") is not used: it is rendered (and sanitized) again from the text,
+# a changed file cannot put a "<script>" into the pages. The same goes for the "approved_comment_count" of the posts:
+# it is counted again from the imported comments.
+
+EXPORT_FORMAT = 1
+
+USER_FIELDS = ["id", "username", "email", "first_name", "last_name", "password", "is_staff", "is_active",
+               "date_joined", "last_login"]
+POST_FIELDS = ["id", "author_id", "title", "body", "body_html", "created_date", "published_date",
+               "approved_comment_count"]
+COMMENT_FIELDS = ["id", "post_id", "author", "text", "text_html", "created_date", "approved_comment"]
+DATE_FIELDS = {"date_joined", "last_login", "created_date", "published_date"}
+
+
+def _write(output, model, row):
+    output.write(json.dumps(dict(row, model=model), cls=DjangoJSONEncoder, separators=(",", ":")))
+    output.write("\n")
+
+
+# write the blog into "path"; returns the number of rows written per model.
+def export_blog(path, chunk_size=2000):
+    counts = {"user": 0, "post": 0, "comment": 0}
+    sources = [
+        # the authors only: the users who wrote at least one post.
+        ("user", User.objects.filter(pk__in=Post.objects.values("author_id")).values(*USER_FIELDS)),
+        ("post", Post.objects.values(*POST_FIELDS)),
+        ("comment", Comment.objects.values(*COMMENT_FIELDS)),
+    ]
+    # one transaction: the posts and comments are read from the same snapshot of the database.
+    with transaction.atomic(), gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as output:
+        _write(output, "meta", {"format": EXPORT_FORMAT, "export_id": uuid.uuid4().hex,
+                                "created_date": timezone.now()})
+        for model, rows in sources:
+            for row in rows.order_by("pk").iterator(chunk_size=chunk_size):
+                _write(output, model, row)
+                counts[model] += 1
+    return counts
+
+
+def _parse(row, fields):
+    values = {}
+    for name in fields:
+        value = row.get(name)
+        values[name] = parse_datetime(value) if name in DATE_FIELDS and value else value
+    return values
+
+
+def _new_ids(run, model, old_ids):
+    return dict(ImportMapping.objects.filter(run=run, model=model, old_id__in=old_ids).values_list("old_id", "new_id"))
+
+
+def _map(run, model, pairs):
+    ImportMapping.objects.bulk_create([ImportMapping(run=run, model=model, old_id=old, new_id=new)
+                                       for old, new in pairs])
+
+
+def _import_users(run, rows):
+    existing = dict(User.objects.filter(username__in=[row["username"] for row in rows]).values_list("username", "pk"))
+    new_users = []
+    for row in rows:
+        if row["username"] not in existing:
+            values = _parse(row, USER_FIELDS)
+            del values["id"]
+            new_users.append(User(**values))
+    User.objects.bulk_create(new_users)
+    existing.update((user.username, user.pk) for user in new_users)
+    _map(run, "user", [(row["id"], existing[row["username"]]) for row in rows])
+
+
+def _import_posts(run, rows):
+    authors = _new_ids(run, "user", {row["author_id"] for row in rows})
+    posts = []
+    for row in rows:
+        values = _parse(row, POST_FIELDS)
+        del values["id"], values["approved_comment_count"]
+        values["author_id"] = authors[row["author_id"]]
+        post = Post(**values)
+        post.render_html()
+        posts.append(post)
+    Post.objects.bulk_create(posts)
+    _map(run, "post", [(row["id"], post.pk) for row, post in zip(rows, posts)])
+
+
+def _import_comments(run, rows):
+    posts = _new_ids(run, "post", {row["post_id"] for row in rows})
+    comments = []
+    for row in rows:
+        values = _parse(row, COMMENT_FIELDS)
+        del values["id"]
+        values["post_id"] = posts[row["post_id"]]
+        comment = Comment(**values)
+        comment.render_html()
+        comments.append(comment)
+    Comment.objects.bulk_create(comments)
+    # "bulk_create" does not call "Comment.save()", which keeps the counters: they are counted here, in the same
+    # transaction as the batch (a post whose comments span two batches is simply counted twice).
+    Post.objects.filter(pk__in=set(posts.values())).refresh_comment_counts()
+
+
+IMPORTERS = {"user": _import_users, "post": _import_posts, "comment": _import_comments}
+
+
+class InvalidExportFile(ValueError):
+    pass
+
+
+# read the file of "export_blog" into this database; returns the number of rows imported per model in this call
+# (a finished import is not run again, a stopped one continues after its last committed batch).
+def import_blog(path, batch_size=2000, log=None):
+    log = log or (lambda message: None)
+    counts = {"user": 0, "post": 0, "comment": 0}
+    with gzip.open(path, "rt", encoding="utf-8") as lines:
+        meta = json.loads(next(lines, "{}"))
+        if meta.get("model") != "meta" or meta.get("format") != EXPORT_FORMAT:
+            raise InvalidExportFile("%s is not an export_blog file (format %s)." % (path, EXPORT_FORMAT))
+        run, _ = ImportRun.objects.get_or_create(export_id=meta["export_id"], defaults={"source": str(path)})
+        if run.finished_date is not None:
+            log("already imported on %s" % run.finished_date)
+            return counts
+        if run.line:
+            log("continuing after line %s" % run.line)
+
+        def flush(model, rows, last_line):
+            with transaction.atomic():
+                IMPORTERS[model](run, rows)
+                run.line = last_line
+                run.save(update_fields=["line"])
+            counts[model] += len(rows)
+            log("%ss: %s" % (model, counts[model]))
+
+        rows, model, line_number = [], None, 1
+        for line_number, line in enumerate(lines, start=2):
+            # the lines of the batches committed by an earlier (stopped) run.
+            if line_number <= run.line:
+                continue
+            row = json.loads(line)
+            if row["model"] not in IMPORTERS:
+                raise InvalidExportFile("Unknown model %r on line %s." % (row["model"], line_number))
+            if rows and (row["model"] != model or len(rows) >= batch_size):
+                flush(model, rows, line_number - 1)
+                rows = []
+            model = row["model"]
+            rows.append(row)
+        if rows:
+            flush(model, rows, line_number)
+
+    with transaction.atomic():
+        run.finished_date = timezone.now()
+        run.save(update_fields=["finished_date"])
+        run.mappings.all().delete()
+    return counts
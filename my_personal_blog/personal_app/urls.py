@@ -1,23 +1,51 @@
-from personal_app import views
+from personal_app import api, async_views, feeds, views
+from django.conf import settings
 from django.urls import path
-from personal_app.views import (AboutView, PostListView, DraftListView,
-                                PostDetailView, PostCreateView, PostUpdateView, PostDeleteView)
+from personal_app.async_views import AsyncAboutView, AsyncPostDetailView, AsyncPostListView
+from personal_app.views import (AboutView, PostListView, DraftListView, ModerationView,
+                                PostDetailView, PostCreateView, PostUpdateView, PostDeleteView,
+                                ArchiveIndexView, ArchiveMonthView, ArchiveAuthorView)
 
 
 app_name = "personal_app"
 
 
+# under ASGI the read-only pages are served by the async views ("async_views.py"), see "BLOG_ASYNC_VIEWS".
+if settings.BLOG_ASYNC_VIEWS:
+    post_list_view, post_detail_view = AsyncPostListView.as_view(), AsyncPostDetailView.as_view()
+    about_view, comment_list_view = AsyncAboutView.as_view(), async_views.post_comments
+else:
+    post_list_view, post_detail_view = PostListView.as_view(), PostDetailView.as_view()
+    about_view, comment_list_view = AboutView.as_view(), views.post_comments
+
+
 urlpatterns = [
     path("create_post/", PostCreateView.as_view(), name="post_create"),
     path("register/", views.register, name="register"),
-    path("", PostListView.as_view(), name="post_list"),
-    path("about/", AboutView.as_view(), name="about"),
-    path("post/<pk>/", PostDetailView.as_view(), name="post_detail"),
+    path("", post_list_view, name="post_list"),
+    path("about/", about_view, name="about"),
+    path("search/", views.search, name="search"),
+    path("post/<pk>/", post_detail_view, name="post_detail"),
     path("update_post/<pk>/", PostUpdateView.as_view(), name="post_update"),
     path("delete_post/<pk>/", PostDeleteView.as_view(), name="post_delete"),
     path("post_drafts/", DraftListView.as_view(), name="draft_list"),
+    path("moderation/", ModerationView.as_view(), name="moderation"),
+    path("post/<pk>/comments/", comment_list_view, name="comment_list"),
     path("comment/post/<pk>/", views.add_comment_to_post, name="add_comment"),
     path("comment/<pk>/approved/", views.approve_comment, name="approve_comment"),
     path("comment/<pk>/removed/", views.comment_remove, name="remove_comment"),
-    path("publish_post/<pk>/", views.post_publish, name="publish_post")
+    path("publish_post/<pk>/", views.post_publish, name="publish_post"),
+    path("cache_stats/", views.cache_stats, name="cache_stats"),
+    path("request_metrics/", views.request_metrics, name="request_metrics"),
+    # read-only json api, see "api.py".
+    path("api/v1/posts/", api.post_list, name="api_post_list"),
+    path("api/v1/posts/<int:pk>/", api.post_detail, name="api_post_detail"),
+    path("api/v1/posts/<int:pk>/comments/", api.post_comments, name="api_comment_list"),
+    # the archive by month and by author, see "archive.py".
+    path("archive/", ArchiveIndexView.as_view(), name="archive_index"),
+    path("archive/<int:year>/<int:month>/", ArchiveMonthView.as_view(), name="archive_month"),
+    path("archive/author/<str:username>/", ArchiveAuthorView.as_view(), name="archive_author"),
+    # rss/atom/json feeds, see "feeds.py".
+    path("feeds/<str:feed_format>/", feeds.post_feed, name="post_feed"),
+    path("feeds/<str:username>/<str:feed_format>/", feeds.post_feed, name="author_feed"),
 ]
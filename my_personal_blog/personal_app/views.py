@@ -1,23 +1,33 @@
 from django.core.exceptions import ValidationError
-from typing import Literal
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
-from django.views.generic import (View, TemplateView, ListView, CreateView,
+from django.views.generic import (TemplateView, ListView, CreateView,
                                   DetailView, UpdateView, DeleteView)
 
-from django.template.loader import get_template
+from django.template.loader import render_to_string
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, HttpResponseRedirect
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.http import Http404, JsonResponse
 from django.utils import timezone
+from django.utils.safestring import mark_safe
+from personal_app.archive import month_range
 from personal_app.forms import PostForm, CommentForm, UserForm
-from personal_app.models import Post, Comment
-from typing import Dict, List, Any
+from personal_app.fragments import fragment_stats, get_or_render
+from personal_app.metrics import METRICS_WINDOW, summary as metrics_summary
+from personal_app.models import ArchiveRollup, Post, Comment
+from personal_app.pagination import InvalidCursor, KeysetPaginationMixin, KeysetPaginator
+from personal_app.search import search_posts
 
 
 # Create your views here.
 
+# number of comments rendered with the post, the rest are loaded page by page from the "post_comments" view.
+COMMENT_PAGE_SIZE = 20
+
 # Notes:-
 # "Post.objects" --> it is a query.
 # "Post.objects.all()" --> it means "select * from Post;" in Mysql database.
@@ -30,29 +40,29 @@ class AboutView(TemplateView):
     template_name = "personal_app/about.html"
 
 
-class PostListView(ListView):  # we are dealing with the CRUD part of the database
+class PostListView(KeysetPaginationMixin, ListView):  # we are dealing with the CRUD part of the database
     model = Post
     template_name = "personal_app/post_list.html"
     context_object_name = "list_of_post_objects"
 
+    # pages are cut on (published_date, pk), see "pagination.py". We never use OFFSET.
+    keyset_field = "published_date"
+
     # Remember "queryset" returns a "list" of objects.
     # Queryset is inherited from its ancestor classes.
     # "get_queryset" function is present already in the table/class. If we want to change any property of the table/class, then we can use it.
     def get_queryset(self):
-        queryset_list = super().get_queryset()
         # "order_by" usually sorts the data in the ascending order, that means oldest "blog" will come first.
         # so, we should simply put "-" sign so that db sorts the records in the descending order and we get latest "blog" in the first record.
         # "__" used for custom lookups. These lookups are used to put the constraints on a field/column. "lte" means less than or equal to.
         
         # select all the records where the records should be created in the present moment or the past.
-        if not self.request.user.is_authenticated:
-            objects_list = Post.objects.filter(published_date__lte=timezone.now()).order_by("-published_date")
-        else:
-            objects_list = Post.objects.filter(
-                published_date__lte=timezone.now(),
-                author=self.request.user
-            ).order_by("-published_date")     
-        return objects_list
+        # the "published_date <= now" part is applied by the paginator, see "get_keyset_upper_bound" below.
+        return published_posts_for(self.request.user)
+
+    # only the posts published up to the present moment are listed.
+    def get_keyset_upper_bound(self):
+        return timezone.now()
 
 
 class PostDetailView(DetailView):
@@ -62,6 +72,26 @@ class PostDetailView(DetailView):
     # "context_object_name" is the "key" in the context dictionary. This key will be used in template tag.
     context_object_name = "post_object"
 
+    # the template shows the author of the post, so we load the author in the same query.
+    def get_queryset(self):
+        return super().get_queryset().select_related("author")
+
+    # the body and the first page of comments are rendered once and then read from the fragment cache ("fragments.py").
+    # On a cache miss the comments cost one more query, already filtered and ordered by the database.
+    # Anonymous readers never load the comments which are waiting for approval; the author gets a separate "owner" fragment.
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        post_object = self.object
+        user = self.request.user
+
+        def render_comments():
+            return render_comment_list(post_object, comment_paginator(user, post_object).page())
+
+        context["body_html"] = mark_safe(get_or_render(post_object.pk, "body", "all", lambda: render_post_body(post_object)))
+        context["comments_html"] = mark_safe(get_or_render(post_object.pk, "comments", comment_variant(user, post_object),
+                                                           render_comments))
+        return context
+
 
 class PostCreateView(LoginRequiredMixin, CreateView):
     # this "CreateView" cbv creates a model-form. We should specify the model name and fields to be displayed.
@@ -103,12 +133,12 @@ class PostUpdateView(LoginRequiredMixin, UpdateView):
 
 class PostDeleteView(LoginRequiredMixin, DeleteView):
     model = Post
-    form_class = PostForm
+    # "DeleteView" validates its own (empty) confirmation form since django 4.0, so we must not give it the "PostForm".
     success_url = reverse_lazy('personal_app:post_list')
 
 
 # we want to see all the objects including those objects which are not published yet. So, published date will be "null" for the unpublished posts/blogs.
-class DraftListView(LoginRequiredMixin, ListView):
+class DraftListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     # we are using the same "query_set" as we used for "PostListView".
     # "query_set" is a built in function/property from the ancestor class. It is already present in the present class.
     # even though a class is inherited from the ancestors, we can change the current properties of the class.
@@ -118,6 +148,7 @@ class DraftListView(LoginRequiredMixin, ListView):
     model = Post
     template_name = "personal_app/post_draft_list.html"
     context_object_name = "list_of_draft_objects"
+    keyset_field = "created_date"
 
     # we can use the in-built function to modify the properties. QuerySet function gives the "cursor" as the output.
     # Cursor means a "list of objects". By putting "filter" function we get the list of objects.
@@ -125,7 +156,100 @@ class DraftListView(LoginRequiredMixin, ListView):
     # Select only those post objects which have the "author name" equal to the "requesting user".
     def get_queryset(self):
         return Post.objects.filter(published_date__isnull=True,
-        author = self.request.user).order_by("-created_date")
+        author = self.request.user).order_by("-created_date", "-pk")
+
+
+# the comments waiting for approval on all the posts of the logged in user, oldest first.
+# The selected comments are approved/rejected together, with one UPDATE/DELETE statement ("CommentQuerySet").
+class ModerationView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    login_url = "/user/login/"
+    template_name = "personal_app/comment_moderation.html"
+    context_object_name = "list_of_pending_comments"
+    keyset_field = "created_date"
+    keyset_descending = False
+    keyset_page_size = 50
+
+    def get_queryset(self):
+        return (Comment.objects.pending_for(self.request.user)
+                .select_related("post")
+                .only("id", "author", "text_html", "created_date", "approved_comment", "post__id", "post__title")
+                .order_by("created_date", "pk"))
+
+    def post(self, request, *args, **kwargs):
+        # the ids come from the browser, "pending_for" makes sure only the comments on the user's own posts are touched.
+        selected = Comment.objects.pending_for(request.user).filter(pk__in=request.POST.getlist("comment_ids"))
+        if request.POST.get("action") == "approve":
+            selected.approve()
+        elif request.POST.get("action") == "reject":
+            selected.reject()
+        return redirect(request.get_full_path())
+
+
+# The archive ("archive.py"): the months and the authors come from the small "ArchiveRollup" table, never from a
+# GROUP BY over all the posts. The posts of one month / one author are paged like the post list.
+class ArchiveIndexView(TemplateView):
+    template_name = "personal_app/archive_index.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["months"] = (ArchiveRollup.objects.values("year", "month")
+                             .annotate(post_count=Sum("post_count")).order_by("-year", "-month"))
+        context["authors"] = (ArchiveRollup.objects.values("author__username")
+                              .annotate(post_count=Sum("post_count")).order_by("author__username"))
+        return context
+
+
+class ArchiveMonthView(KeysetPaginationMixin, ListView):
+    template_name = "personal_app/archive_month.html"
+    context_object_name = "list_of_post_objects"
+    keyset_field = "published_date"
+
+    def get_queryset(self):
+        year, month = self.kwargs["year"], self.kwargs["month"]
+        # "<int:year>" takes any number of digits: a year which python dates (and SQLite integers) can not hold
+        # would be a 500 instead of a 404.
+        if not 1 <= year <= 9999:
+            raise Http404("No such year.")
+        if not 1 <= month <= 12:
+            raise Http404("No such month.")
+        # the authors of the month and their number of posts; no row means no post in this month.
+        self.rollups = list(ArchiveRollup.objects.filter(year=year, month=month)
+                            .select_related("author").order_by("author__username"))
+        if not self.rollups:
+            raise Http404("No posts in this month.")
+        start, end = month_range(year, month)
+        return (Post.objects.select_related("author").filter(published_date__gte=start, published_date__lt=end)
+                .order_by("-published_date", "-pk"))
+
+    def get_keyset_upper_bound(self):
+        return timezone.now()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["month_start"] = month_range(self.kwargs["year"], self.kwargs["month"])[0]
+        context["rollups"] = self.rollups
+        context["post_count"] = sum(rollup.post_count for rollup in self.rollups)
+        return context
+
+
+class ArchiveAuthorView(KeysetPaginationMixin, ListView):
+    template_name = "personal_app/archive_author.html"
+    context_object_name = "list_of_post_objects"
+    keyset_field = "published_date"
+
+    def get_queryset(self):
+        self.author = get_object_or_404(User, username=self.kwargs["username"])
+        return (Post.objects.select_related("author").published().filter(author=self.author)
+                .order_by("-published_date", "-pk"))
+
+    def get_keyset_upper_bound(self):
+        return timezone.now()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["author"] = self.author
+        context["rollups"] = ArchiveRollup.objects.filter(author=self.author).order_by("-year", "-month")
+        return context
 
 
 #######################################################################################################
@@ -137,6 +261,87 @@ class DraftListView(LoginRequiredMixin, ListView):
 # from here on, we will use function based views.
 
 
+# the published posts listed on the home page: all of them for the anonymous readers, their own posts for the authors.
+# "select_related" fetches the author in the same query (JOIN); the number of approved comments is stored in the
+# post itself ("approved_comment_count"), so the template does not fire extra queries for every row.
+def published_posts_for(user):
+    objects_list = Post.objects.select_related("author").published()
+    if user.is_authenticated:
+        objects_list = objects_list.filter(author=user)
+    return objects_list.order_by("-published_date", "-pk")
+
+
+# the fragments of the detail page ("fragments.py"). The author of the post gets a separate "owner" version of the
+# comments, with the comments waiting for approval.
+def comment_variant(user, post_object):
+    return "owner" if post_object.is_written_by(user) else "public"
+
+
+def render_post_body(post_object):
+    return render_to_string("personal_app/post_body_fragment.html", {"post_object": post_object})
+
+
+def render_comment_list(post_object, comment_page):
+    return render_to_string("personal_app/comment_list_fragment.html",
+                            {"post_object": post_object, "comment_page": comment_page})
+
+
+# the comments of a post which the user can see, oldest first, paged on (created_date, pk).
+def comment_paginator(user, post_object):
+    return KeysetPaginator(Comment.objects.visible_to(user, post_object), "created_date",
+                           COMMENT_PAGE_SIZE, descending=False)
+
+
+# the next pages of comments of a post, as an html fragment (for the "Load more comments" button) or as json.
+def post_comments(request, pk):
+    post_object = get_object_or_404(Post.objects.only("pk", "author_id"), pk=pk)
+    try:
+        comment_page = comment_paginator(request.user, post_object).page(after=request.GET.get("after"))
+    except InvalidCursor:
+        raise Http404("Invalid page.")
+
+    return comment_page_response(request, post_object, comment_page)
+
+
+# one page of comments as an html fragment, or as json with "?format=json".
+def comment_page_response(request, post_object, comment_page):
+    if request.GET.get("format") == "json":
+        next_url = None
+        if comment_page.has_next:
+            next_url = "%s?format=json&after=%s" % (reverse("personal_app:comment_list", kwargs={"pk": post_object.pk}),
+                                                     comment_page.next_cursor)
+        return JsonResponse({
+            "comments": [
+                {"id": comment_object.pk, "author": comment_object.author, "text": comment_object.text,
+                 "text_html": comment_object.text_html, "created_date": comment_object.created_date,
+                 "approved": comment_object.approved_comment}
+                for comment_object in comment_page
+            ],
+            "next": next_url,
+        })
+    return render(request, "personal_app/comment_list_fragment.html",
+                  {"post_object": post_object, "comment_page": comment_page})
+
+
+# full text search over the published posts, best matches first (see "search.py").
+def search(request):
+    query = request.GET.get("q", "").strip()
+    results = search_posts(query) if query else []
+    return render(request, "personal_app/search.html", {"query": query, "results": results})
+
+
+# hit/miss counters of the fragment cache, for the monitoring.
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse({"fragments": fragment_stats()})
+
+
+# percentiles of the recent requests per url name, recorded by "RequestMetricsMiddleware".
+@staff_member_required
+def request_metrics(request):
+    return JsonResponse({"window": METRICS_WINDOW, "views": metrics_summary()})
+
+
 # post should be published, we should write a function for that.
 @login_required
 def post_publish(request, pk):
@@ -171,19 +376,19 @@ def add_comment_to_post(request, pk):
 # by default, every comment is not approved.
 @login_required
 def approve_comment(request, pk):
-    comment_object = get_object_or_404(Comment, pk=pk)
+    comment_object = get_object_or_404(Comment.objects.select_related("post"), pk=pk)
     # "approve" method is defined in the Comment class. When we call this function, we get "approved_comment=True".
-    if comment_object.post.author == request.user:
+    if comment_object.post.is_written_by(request.user):
         comment_object.approve()
-    return redirect("personal_app:post_detail", pk=comment_object.post.pk)
+    return redirect("personal_app:post_detail", pk=comment_object.post_id)
 
 
 @login_required
 def comment_remove(request, pk):
-    comment_object = get_object_or_404(Comment, pk=pk)
+    comment_object = get_object_or_404(Comment.objects.select_related("post"), pk=pk)
     # before deleting the object, save the primary key in a variable.
-    pk_saved = comment_object.post.pk
-    if comment_object.post.author == request.user:
+    pk_saved = comment_object.post_id
+    if comment_object.post.is_written_by(request.user):
         comment_object.delete()
     return redirect("personal_app:post_detail", pk=pk_saved)
 